@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models.base import Discount, Invoice, InvoiceLine
+from .models.base import Discount, Invoice, InvoiceLine, ImportJob, StockMovement, StockBalance, BillingAggregate, ProductCodeRule, PaymentInstalment
 
 class DiscountAdmin(admin.ModelAdmin):
     list_display = ('percentage', 'description')
@@ -10,18 +10,88 @@ class InvoiceLineInline(admin.TabularInline):
     extra = 1
     autocomplete_fields = ['product', 'discount']
 
+    def get_queryset(self, request):
+        # InvoiceLine.__str__ usa il nome del prodotto
+        return super().get_queryset(request).select_related('product', 'discount')
+
+class PaymentInstalmentInline(admin.TabularInline):
+    model = PaymentInstalment
+    extra = 0
+    fields = ('sequence', 'due_date', 'amount', 'payment_method', 'iban', 'status', 'paid_at')
+
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('invoice_number', 'invoice_type', 'issue_date', 'issuer', 'receiver', 'total_amount')
     list_filter = ('invoice_type', 'issue_date')
     search_fields = ('invoice_number', 'issuer__name', 'receiver__name')
-    inlines = [InvoiceLineInline]
+    inlines = [InvoiceLineInline, PaymentInstalmentInline]
     autocomplete_fields = ['issuer', 'receiver']
+    list_select_related = ['issuer', 'receiver']
 
 class InvoiceLineAdmin(admin.ModelAdmin):
     list_display = ('invoice', 'line_number', 'product', 'quantity', 'unit_price', 'line_total')
     search_fields = ('invoice__invoice_number', 'product__name')
     autocomplete_fields = ['invoice', 'product', 'discount']
+    list_select_related = ['invoice', 'product']
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'status', 'attempts', 'batch_id', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('filename', 'batch_id')
+    raw_id_fields = ['invoice']
+
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'product', 'quantity', 'reason', 'reference', 'applied')
+    list_filter = ('reason', 'applied')
+    search_fields = ('product__name', 'reference')
+    raw_id_fields = ['product', 'invoice', 'invoice_line']
+
+    # Il registro è append-only: le correzioni passano da movimenti di rettifica
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class StockBalanceAdmin(admin.ModelAdmin):
+    list_display = ('product', 'quantity', 'updated_at')
+    search_fields = ('product__name',)
+    readonly_fields = ('product', 'quantity', 'updated_at')
+
+class BillingAggregateAdmin(admin.ModelAdmin):
+    list_display = ('period', 'invoice_type', 'company', 'vat_rate', 'invoice_count', 'taxable_amount', 'vat_amount', 'total_amount')
+    list_filter = ('invoice_type', 'period', 'vat_rate')
+    search_fields = ('company__name',)
+    list_select_related = ['company']
+
+    # I totali vengono calcolati dalle fatture e non si modificano a mano
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class ProductCodeRuleAdmin(admin.ModelAdmin):
+    list_display = ('supplier', 'pattern', 'priority', 'is_active', 'notes')
+    list_filter = ('is_active',)
+    list_editable = ('priority', 'is_active')
+    search_fields = ('supplier__name', 'pattern', 'notes')
+    autocomplete_fields = ['supplier']
+    list_select_related = ['supplier']
+
+class PaymentInstalmentAdmin(admin.ModelAdmin):
+    list_display = ('invoice', 'company', 'invoice_type', 'sequence', 'due_date', 'amount', 'payment_method', 'status', 'paid_at')
+    list_filter = ('invoice_type', 'status', 'payment_method', 'due_date')
+    search_fields = ('invoice__invoice_number', 'company__name', 'iban')
+    autocomplete_fields = ['invoice', 'company']
+    list_select_related = ['invoice', 'company']
+    date_hierarchy = 'due_date'
 
 admin.site.register(Discount, DiscountAdmin)
 admin.site.register(Invoice, InvoiceAdmin)
 admin.site.register(InvoiceLine, InvoiceLineAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
+admin.site.register(StockBalance, StockBalanceAdmin)
+admin.site.register(BillingAggregate, BillingAggregateAdmin)
+admin.site.register(ProductCodeRule, ProductCodeRuleAdmin)
+admin.site.register(PaymentInstalment, PaymentInstalmentAdmin)
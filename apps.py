@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        # Registrazione dei segnali (invalidazione cache)
+        from . import signals  # noqa: F401
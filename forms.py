@@ -1,6 +1,7 @@
 from django import forms
 from .models.base import Discount, Invoice, InvoiceLine
 from django.core.exceptions import ValidationError
+from .services.invoice_sources import is_invoice_name
 import os
 
 
@@ -150,7 +151,7 @@ class InvoiceUploadForm(forms.Form):
     xml_files = forms.FileField(
         widget=MultipleFileInput(),
         label='File XML Fatture',
-        help_text='Seleziona uno o più file XML da caricare'
+        help_text='Seleziona uno o più file XML (anche firmati .xml.p7m) da caricare'
     )
     
     def clean_xml_files(self):
@@ -158,9 +159,9 @@ class InvoiceUploadForm(forms.Form):
         if xml_files:
             valid_files = []
             for xml_file in xml_files:
-                # Controlla l'estensione del file
-                if not xml_file.name.endswith('.xml'):
-                    raise forms.ValidationError("Il file caricato non è un file XML valido.")
+                # Controlla l'estensione del file (XML semplice o firmato .p7m)
+                if not is_invoice_name(xml_file.name):
+                    raise forms.ValidationError("Il file caricato non è un file XML o XML.P7M valido.")
                 valid_files.append(xml_file)
             return valid_files
         else:
@@ -0,0 +1,91 @@
+# billing/management/commands/benchmark_import.py
+import json
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from billing.services.benchmark import ImportBenchmark, compare_results
+from billing.services.own_company import invalidate_own_company
+from billing.services.synthetic_invoices import SyntheticInvoiceGenerator
+from crm.models.base import Company
+
+STAGES = ('extraction', 'queries', 'import')
+
+# Cache locale al processo durante la misura: la cache condivisa non riceve
+# le aziende e i prodotti del database di test
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Misura velocità di estrazione, query per fattura e throughput di importazione '
+        'su fatture sintetiche, in un database di test separato'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=200, help='Fatture generate per ogni fase')
+        parser.add_argument('--lines', type=int, default=20, help='Righe per fattura')
+        parser.add_argument('--suppliers', type=int, default=10, help='Fornitori distinti')
+        parser.add_argument('--products', type=int, default=50, help='Prodotti distinti per fornitore')
+        parser.add_argument('--discount-ratio', type=float, default=0.2, help='Frazione di righe scontate')
+        parser.add_argument('--seed', type=int, default=0, help='Seme del generatore')
+        parser.add_argument('--workers', type=int, default=1, help='Processi per la fase di importazione')
+        parser.add_argument('--chunk-size', type=int, default=50, help='File per transazione')
+        parser.add_argument('--repeat', type=int, default=3, help='Ripetizioni della fase di estrazione')
+        parser.add_argument('--stage', action='append', choices=STAGES, dest='stages', help='Fasi da eseguire (default: tutte)')
+        parser.add_argument('--output', help='File JSON in cui salvare i risultati')
+        parser.add_argument('--compare', help='File JSON di un esecuzione precedente da confrontare')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Impossibile leggere {options["compare"]}: {e}')
+
+        generator = SyntheticInvoiceGenerator(
+            lines=options['lines'],
+            suppliers=options['suppliers'],
+            products=options['products'],
+            discount_ratio=options['discount_ratio'],
+            seed=options['seed']
+        )
+        benchmark = ImportBenchmark(
+            generator,
+            invoices=options['invoices'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            repeat=options['repeat']
+        )
+
+        # Database di test, MEDIA_ROOT temporanea e cache locale: i dati reali
+        # non vengono toccati. La copia locale dell'azienda propria viene
+        # svuotata prima e dopo, perché sopravvive al cambio di cache
+        invalidate_own_company()
+        old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root, CACHES=BENCHMARK_CACHES):
+                    Company.objects.create(
+                        name='Azienda Benchmark SPA',
+                        vat_number=generator.receiver_vat_number,
+                        is_own_company=True
+                    )
+                    report = benchmark.run(options['stages'] or STAGES)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            invalidate_own_company()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Risultati salvati in {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            for name, reference, value, change, worse in compare_results(baseline['results'], report['results']):
+                style = self.style.ERROR if worse and abs(change) >= 10 else self.style.SUCCESS
+                self.stdout.write(style(f'{name}: {reference} -> {value} ({change:+.1f}%)'))
@@ -0,0 +1,47 @@
+# billing/management/commands/build_payment_schedules.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from billing.models.base import Invoice
+from billing.services.invoice_parser import InvoiceParser
+
+
+class Command(BaseCommand):
+    help = 'Crea le rate di pagamento delle fatture importate prima dello scadenzario, rileggendo i file XML'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Fatture elaborate per transazione')
+
+    def handle(self, *args, **options):
+        parser = InvoiceParser(validate=False)
+        invoices = Invoice.objects.filter(instalments__isnull=True).order_by('id')
+        created = 0
+        errors = 0
+
+        # Le fatture elaborate escono dal queryset: si riparte sempre dall'inizio
+        while True:
+            batch = list(invoices[:options['batch_size']])
+            if not batch:
+                break
+            # I documenti dello stesso file (lotti) vengono estratti una volta sola
+            documents_by_file = {}
+            with transaction.atomic():
+                for invoice in batch:
+                    payments = None
+                    if invoice.file_xml:
+                        name = invoice.file_xml.name
+                        try:
+                            if name not in documents_by_file:
+                                with invoice.file_xml.open('rb') as fh:
+                                    documents_by_file[name] = parser.extract(fh)
+                            payments = next(
+                                (document['payments'] for document in documents_by_file[name]
+                                 if document['invoice_number'] == invoice.invoice_number),
+                                None
+                            )
+                        except Exception as e:
+                            documents_by_file[name] = []
+                            errors += 1
+                            self.stderr.write(f'Fattura {invoice.invoice_number}: file non leggibile ({e}), rata unica')
+                    created += len(parser.save_instalments(invoice, payments))
+
+        self.stdout.write(self.style.SUCCESS(f'Rate create: {created} ({errors} file non leggibili)'))
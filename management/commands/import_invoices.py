@@ -0,0 +1,84 @@
+# billing/management/commands/import_invoices.py
+import os
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from billing.models.base import Invoice
+from billing.services.batch_import import BatchImporter
+from billing.services.invoice_sources import iter_invoice_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa in blocco fatture elettroniche XML da file, cartelle, pattern glob '
+        'o archivi ZIP dello SDI, senza estrarli su disco'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='File, cartelle, pattern glob o archivi ZIP')
+        parser.add_argument('--workers', type=int, default=None, help='Processi per il parsing (default: numero di CPU)')
+        parser.add_argument('--chunk-size', type=int, default=50, help='File salvati per transazione')
+        parser.add_argument('--force', action='store_true', help='Non saltare i file già importati')
+        parser.add_argument('--quiet', action='store_true', help='Mostra solo errori e riepilogo')
+
+    def handle(self, *args, **options):
+        importer = BatchImporter(workers=options['workers'], chunk_size=options['chunk_size'])
+        counts = Counter()
+
+        skip = None
+        if not options['force']:
+            imported = self.imported_names()
+
+            def skip(name):
+                if name in imported:
+                    counts['skipped'] += 1
+                    return True
+                return False
+
+        start = time.perf_counter()
+        files = iter_invoice_files(options['paths'], skip=skip)
+        for result in importer.import_files(files):
+            counts[result['status']] += 1
+            if options['quiet'] and result['status'] != 'error':
+                continue
+            style = {
+                'success': self.style.SUCCESS,
+                'duplicate': self.style.WARNING,
+            }.get(result['status'], self.style.ERROR)
+            self.stdout.write(style(f"[{result['status']}] {result['filename']}: {result['message']}"))
+        elapsed = time.perf_counter() - start
+
+        stats = importer.stats
+        self.stdout.write(
+            f"Totale: {stats['files']} - caricate: {counts['success']}, "
+            f"duplicate: {counts['duplicate']}, errori: {counts['error']}, "
+            f"già importate (saltate): {counts['skipped']}"
+        )
+        self.stdout.write(
+            f"Tempo: {elapsed:.2f}s - {stats['files'] / elapsed if elapsed else 0:.1f} file/s, "
+            f"{stats['lines'] / elapsed if elapsed else 0:.1f} righe/s"
+        )
+        self.stdout.write(
+            f"Parsing: {stats['parse_time']:.2f}s (somma sui worker) - DB: {stats['db_time']:.2f}s"
+        )
+
+    def imported_names(self):
+        """
+        Nomi base dei file XML già associati a una fattura, per saltare i
+        file già importati senza leggerli né parsarli.
+
+        I file salvati per contenuto hanno come nome l'hash: per questi vale
+        original_filename; per quelli precedenti il nome in file_xml, così
+        com'è. Un nome rinominato dallo storage (nome_abc1234.xml) non viene
+        ricondotto all'originale, che potrebbe essere un altro file: i file
+        non riconosciuti per nome vengono letti e scartati dal controllo
+        sull'hash del contenuto.
+        """
+        imported = set(
+            Invoice.objects.exclude(original_filename='').values_list('original_filename', flat=True).iterator()
+        )
+        names = Invoice.objects.filter(original_filename='').exclude(file_xml='').exclude(
+            file_xml__isnull=True
+        ).values_list('file_xml', flat=True)
+        imported.update(os.path.basename(name) for name in names.iterator())
+        return imported
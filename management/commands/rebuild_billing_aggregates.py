@@ -0,0 +1,11 @@
+# billing/management/commands/rebuild_billing_aggregates.py
+from django.core.management.base import BaseCommand
+from billing.services.billing_aggregates import rebuild_billing_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce da zero i totali di periodo usati da cruscotti e liquidazione IVA'
+
+    def handle(self, *args, **options):
+        created = rebuild_billing_aggregates()
+        self.stdout.write(self.style.SUCCESS(f'Totali ricostruiti: {created} righe'))
@@ -0,0 +1,46 @@
+# billing/management/commands/reconcile_invoices.py
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from billing.models.base import Invoice
+from billing.services.invoice_filters import parse_date
+from billing.services.reconciliation import DEFAULT_TOLERANCE, reconcile_invoices
+
+
+class Command(BaseCommand):
+    help = 'Verifica la coerenza fra righe, IVA per aliquota e totali delle fatture di un periodo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='Data iniziale (AAAA-MM-GG o GG/MM/AAAA)')
+        parser.add_argument('--date-to', help='Data finale (AAAA-MM-GG o GG/MM/AAAA)')
+        parser.add_argument('--type', choices=[code for code, label in Invoice.INVOICE_TYPES], help='Solo fatture di acquisto (IN) o di vendita (OUT)')
+        parser.add_argument('--tolerance', type=Decimal, default=DEFAULT_TOLERANCE, help='Differenza tollerata per gli arrotondamenti')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        for option, lookup in (('date_from', 'issue_date__gte'), ('date_to', 'issue_date__lte')):
+            if options[option]:
+                date = parse_date(options[option])
+                if date is None:
+                    raise CommandError(f'Data non valida: {options[option]}')
+                invoices = invoices.filter(**{lookup: date})
+        if options['type']:
+            invoices = invoices.filter(invoice_type=options['type'])
+
+        start = time.perf_counter()
+        result = reconcile_invoices(invoices, tolerance=options['tolerance'])
+        elapsed = time.perf_counter() - start
+
+        for issue in result['issues']:
+            line = f" riga {issue['line_number']}" if issue['line_number'] is not None else ''
+            self.stdout.write(
+                f"Fattura {issue['invoice_number']}{line}: {issue['message']} "
+                f"(calcolato {issue['expected']}, memorizzato {issue['actual']})"
+            )
+
+        summary = (
+            f"Fatture verificate: {result['checked']}, righe: {result['lines']}, "
+            f"anomalie: {len(result['issues'])} in {elapsed:.2f}s"
+        )
+        style = self.style.WARNING if result['issues'] else self.style.SUCCESS
+        self.stdout.write(style(summary))
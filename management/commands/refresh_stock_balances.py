@@ -0,0 +1,14 @@
+# billing/management/commands/refresh_stock_balances.py
+from django.core.management.base import BaseCommand
+from billing.services.stock_ledger import refresh_stock_balances
+
+
+class Command(BaseCommand):
+    help = 'Applica ai saldi di magazzino i movimenti non ancora applicati'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products', help='Limita ai prodotti indicati (ripetibile)')
+
+    def handle(self, *args, **options):
+        applied = refresh_stock_balances(options['products'])
+        self.stdout.write(self.style.SUCCESS(f'Movimenti applicati: {applied}'))
@@ -0,0 +1,20 @@
+# billing/management/commands/run_import_worker.py
+from django.core.management.base import BaseCommand
+from billing.services.job_queue import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Avvia il worker che importa le fatture messe in coda dalla pagina di caricamento'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Secondi di attesa quando la coda è vuota')
+        parser.add_argument('--once', action='store_true', help='Termina quando la coda è vuota')
+        parser.add_argument('--stale-timeout', type=int, default=600, help='Secondi dopo i quali un job RUNNING viene rimesso in coda')
+
+    def handle(self, *args, **options):
+        processed = run_worker(
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            stale_timeout=options['stale_timeout']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Job elaborati: {processed}'))
@@ -1,7 +1,10 @@
+import re
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from decimal import Decimal
+from billing.storage import invoice_xml_storage
 
 # Lazy loading dei modelli da altre app
 if 'crm' in settings.INSTALLED_APPS:
@@ -52,8 +55,31 @@ class Invoice(models.Model):
     ]
 
     # File originale
-    file_xml = models.FileField(upload_to='fatture_xml/',  blank=True, null=True, verbose_name=_("file XML"))
-    
+    # I file vengono salvati per hash del contenuto, compressi, in sottocartelle
+    file_xml = models.FileField(
+        upload_to='fatture_xml/',
+        storage=invoice_xml_storage,
+        blank=True,
+        null=True,
+        verbose_name=_("file XML")
+    )
+    original_filename = models.CharField(
+        _("nome file originale"),
+        max_length=255,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text=_("Nome del file caricato, usato per il download e per saltare i file già importati")
+    )
+    content_hash = models.CharField(
+        _("hash contenuto"),
+        max_length=64,
+        unique=True,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_("SHA-256 del documento XML, usato per riconoscere i file già caricati")
+    )
 
     # Dati principali della fattura
     invoice_number = models.CharField(_("numero fattura"), max_length=50, db_index=True)
@@ -93,6 +119,11 @@ class Invoice(models.Model):
         verbose_name_plural = _("fatture")
         indexes = [
             models.Index(fields=['invoice_number', 'issue_date']),
+            # Indice per la verifica dei duplicati in fase di import
+            models.Index(fields=['issuer', 'invoice_type', 'invoice_number']),
+            # Indici per le liste fornitori/clienti filtrate per data
+            models.Index(fields=['receiver', 'issue_date']),
+            models.Index(fields=['issuer', 'issue_date']),
         ]
 
     def __str__(self):
@@ -153,14 +184,249 @@ class InvoiceLine(models.Model):
     def __str__(self):
         return f"Riga {self.line_number} - {self.product.name}"
 
-    def save(self, *args, **kwargs):
-        """
-        Override del save per gestire l'aggiornamento del magazzino.
-        Quando una riga viene salvata, aggiorna la quantità del prodotto
-        in magazzino in base al tipo di fattura.
-        """
-        super().save(*args, **kwargs)
-        
-        # Aggiorna le quantità di magazzino
-        delta = self.quantity if self.invoice.invoice_type == 'IN' else -self.quantity
-        self.product.update_stock(delta)
\ No newline at end of file
+
+class ImportJob(models.Model):
+    """Fattura caricata e in coda per l'importazione da parte del worker"""
+    STATUS = [
+        ('PENDING', _('In attesa')),
+        ('RUNNING', _('In elaborazione')),
+        ('SUCCESS', _('Caricata')),
+        ('DUPLICATE', _('Duplicata')),
+        ('ERROR', _('Errore')),
+    ]
+
+    batch_id = models.UUIDField(_("lotto"), db_index=True)
+    file = models.FileField(_("file"), upload_to='import_queue/', blank=True, null=True)
+    filename = models.CharField(_("nome file"), max_length=255)
+    status = models.CharField(_("stato"), max_length=10, choices=STATUS, default='PENDING')
+    message = models.TextField(_("messaggio"), blank=True)
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='import_jobs',
+        verbose_name=_("fattura")
+    )
+    attempts = models.PositiveSmallIntegerField(_("tentativi"), default=0)
+    next_attempt_at = models.DateTimeField(_("prossimo tentativo"), null=True, blank=True)
+    created_at = models.DateTimeField(_("data creazione"), auto_now_add=True)
+    started_at = models.DateTimeField(_("inizio elaborazione"), null=True, blank=True)
+    finished_at = models.DateTimeField(_("fine elaborazione"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("importazione in coda")
+        verbose_name_plural = _("importazioni in coda")
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.get_status_display()})"
+
+
+class StockMovement(models.Model):
+    """
+    Movimento di magazzino generato dalle righe fattura.
+
+    Il registro è append-only: modifiche ed eliminazioni delle righe non
+    aggiornano i movimenti esistenti ma ne aggiungono di compensativi.
+    """
+    REASONS = [
+        ('INVOICE', _('Riga fattura')),
+        ('ADJUSTMENT', _('Rettifica')),
+        ('REVERSAL', _('Storno')),
+    ]
+
+    product = models.ForeignKey(
+        'warehouse.Product',
+        on_delete=models.CASCADE,
+        related_name='stock_movements',
+        verbose_name=_("prodotto")
+    )
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements',
+        verbose_name=_("fattura")
+    )
+    invoice_line = models.ForeignKey(
+        InvoiceLine,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements',
+        verbose_name=_("riga fattura")
+    )
+    quantity = models.DecimalField(_("quantità"), max_digits=12, decimal_places=2)
+    reason = models.CharField(_("causale"), max_length=10, choices=REASONS, default='INVOICE')
+    reference = models.CharField(_("riferimento"), max_length=255, blank=True)
+    applied = models.BooleanField(_("applicato al saldo"), default=False)
+    created_at = models.DateTimeField(_("data creazione"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("movimento di magazzino")
+        verbose_name_plural = _("movimenti di magazzino")
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['applied', 'product']),
+            models.Index(fields=['invoice_line', 'product']),
+        ]
+
+    def __str__(self):
+        return f"{self.product} {self.quantity:+} ({self.get_reason_display()})"
+
+
+class StockBalance(models.Model):
+    """Saldo di magazzino per prodotto, aggiornato dai movimenti applicati"""
+    product = models.OneToOneField(
+        'warehouse.Product',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stock_balance',
+        verbose_name=_("prodotto")
+    )
+    quantity = models.DecimalField(_("quantità"), max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField(_("ultimo aggiornamento"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("saldo di magazzino")
+        verbose_name_plural = _("saldi di magazzino")
+
+    def __str__(self):
+        return f"{self.product}: {self.quantity}"
+
+
+class BillingAggregate(models.Model):
+    """
+    Totali mensili precalcolati per controparte, tipo fattura e aliquota IVA.
+
+    Le righe con aliquota valorizzata riportano imponibile e imposta delle
+    righe fattura con quell'aliquota; la riga con aliquota vuota riporta il
+    numero di fatture e il totale documento della controparte nel mese.
+    """
+    period = models.DateField(_("periodo"), help_text=_("Primo giorno del mese"))
+    company = models.ForeignKey(
+        'crm.Company',
+        on_delete=models.CASCADE,
+        related_name='billing_aggregates',
+        verbose_name=_("controparte")
+    )
+    invoice_type = models.CharField(_("tipo fattura"), max_length=3, choices=Invoice.INVOICE_TYPES)
+    vat_rate = models.DecimalField(_("aliquota IVA"), max_digits=5, decimal_places=2, null=True, blank=True)
+
+    invoice_count = models.PositiveIntegerField(_("numero fatture"), default=0)
+    line_count = models.PositiveIntegerField(_("numero righe"), default=0)
+    taxable_amount = models.DecimalField(_("imponibile"), max_digits=14, decimal_places=2, default=Decimal('0'))
+    vat_amount = models.DecimalField(_("importo IVA"), max_digits=14, decimal_places=2, default=Decimal('0'))
+    total_amount = models.DecimalField(_("totale documenti"), max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField(_("ultimo aggiornamento"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("totale di periodo")
+        verbose_name_plural = _("totali di periodo")
+        ordering = ['period', 'invoice_type', 'company', 'vat_rate']
+        indexes = [
+            models.Index(fields=['period', 'invoice_type']),
+            models.Index(fields=['company', 'invoice_type', 'period']),
+        ]
+
+    def __str__(self):
+        rate = f"{self.vat_rate}%" if self.vat_rate is not None else _("totale")
+        return f"{self.period:%m/%Y} {self.get_invoice_type_display()} {self.company} - {rate}"
+
+
+class ProductCodeRule(models.Model):
+    """
+    Espressione regolare con cui ricavare il codice articolo di un fornitore
+    dalla descrizione, per le righe senza CodiceArticolo.
+
+    Il codice è il gruppo ``code`` se presente, altrimenti il primo gruppo o
+    l'intera corrispondenza. Le regole vengono provate in ordine di priorità.
+    """
+    supplier = models.ForeignKey(
+        'crm.Company',
+        on_delete=models.CASCADE,
+        related_name='product_code_rules',
+        verbose_name=_("fornitore")
+    )
+    pattern = models.CharField(
+        _("espressione regolare"),
+        max_length=255,
+        help_text=_("Es. ^(?P<code>[A-Z]{2}\\d{4,})\\s per un codice a inizio descrizione")
+    )
+    priority = models.PositiveIntegerField(_("priorità"), default=100, help_text=_("Le regole con valore minore vengono provate per prime"))
+    is_active = models.BooleanField(_("attiva"), default=True)
+    notes = models.CharField(_("note"), max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = _("regola codice articolo")
+        verbose_name_plural = _("regole codice articolo")
+        ordering = ['supplier', 'priority', 'id']
+        indexes = [
+            models.Index(fields=['supplier', 'is_active', 'priority']),
+        ]
+
+    def __str__(self):
+        return f"{self.supplier}: {self.pattern}"
+
+    def clean(self):
+        try:
+            re.compile(self.pattern)
+        except re.error as e:
+            raise ValidationError({'pattern': _("Espressione regolare non valida: %(error)s") % {'error': e}})
+
+
+class PaymentInstalment(models.Model):
+    """
+    Rata di pagamento di una fattura, da DatiPagamento/DettaglioPagamento.
+
+    Controparte e tipo fattura sono ripetuti sulla rata per calcolare
+    scadenzario e previsioni di cassa con aggregazioni su questa sola
+    tabella, lungo gli indici su stato e scadenza.
+    """
+    STATUS = [
+        ('OPEN', _('Da pagare')),
+        ('PAID', _('Pagata')),
+    ]
+
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='instalments',
+        verbose_name=_("fattura")
+    )
+    company = models.ForeignKey(
+        'crm.Company',
+        on_delete=models.PROTECT,
+        related_name='payment_instalments',
+        verbose_name=_("controparte")
+    )
+    invoice_type = models.CharField(_("tipo fattura"), max_length=3, choices=Invoice.INVOICE_TYPES)
+    sequence = models.PositiveSmallIntegerField(_("numero rata"), default=1)
+
+    payment_terms = models.CharField(_("condizioni di pagamento"), max_length=4, blank=True, help_text=_("TP01 a rate, TP02 completo, TP03 anticipo"))
+    payment_method = models.CharField(_("modalità di pagamento"), max_length=4, blank=True, help_text=_("Codice MP01-MP23"))
+    due_date = models.DateField(_("data scadenza"))
+    amount = models.DecimalField(_("importo"), max_digits=12, decimal_places=2)
+    iban = models.CharField(_("IBAN"), max_length=34, blank=True)
+
+    status = models.CharField(_("stato"), max_length=4, choices=STATUS, default='OPEN')
+    paid_at = models.DateField(_("data pagamento"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("rata di pagamento")
+        verbose_name_plural = _("rate di pagamento")
+        ordering = ['due_date', 'invoice', 'sequence']
+        indexes = [
+            # Scadenzario e previsioni di cassa
+            models.Index(fields=['invoice_type', 'status', 'due_date']),
+            models.Index(fields=['status', 'due_date']),
+            models.Index(fields=['company', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice} - rata {self.sequence} del {self.due_date}: {self.amount}"
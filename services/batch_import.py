@@ -0,0 +1,150 @@
+# billing/services/batch_import.py
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from billing.models.base import Invoice
+from billing.services.batch_worker import extract_file, init_worker
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.own_company import get_own_company
+from billing.services.resolution_cache import ResolutionCache
+
+
+class BatchImporter:
+    """
+    Motore di importazione massiva delle fatture XML.
+
+    L'estrazione XML -> dizionario (solo CPU) viene eseguita in un pool di
+    processi; i risultati confluiscono, nell'ordine di input, in un unico
+    writer che salva le fatture in transazioni da ``chunk_size`` file, con un
+    savepoint per file così che un errore non annulli l'intero blocco.
+
+    Args:
+        workers: Numero di processi; con 1 l'estrazione avviene nel processo
+            corrente. Di default il numero di CPU.
+        chunk_size: File salvati per transazione
+        streaming: Usa l'estrattore iterparse
+        cache: ResolutionCache condivisa fra tutti i file del lotto
+
+    Dopo ogni importazione ``stats`` riporta file e righe elaborati, il tempo
+    di estrazione (somma sui worker) e il tempo speso dal writer sul DB.
+    """
+
+    def __init__(self, workers=None, chunk_size=50, streaming=True, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.streaming = streaming
+        self.cache = cache if cache is not None else ResolutionCache()
+        self.stats = self.empty_stats()
+
+    def empty_stats(self):
+        return {'files': 0, 'lines': 0, 'parse_time': 0.0, 'db_time': 0.0}
+
+    def import_files(self, files):
+        """
+        Importa i file indicati.
+
+        Args:
+            files: Iterabile di tuple (nome, contenuto in bytes)
+
+        Yields:
+            dict: {'filename', 'status', 'message'} per ogni file, nello
+            stesso formato della risposta di InvoiceUploadAjaxView
+        """
+        self.stats = self.empty_stats()
+        own_company = get_own_company()
+        own_vat_number = own_company.vat_number if own_company else None
+
+        parser = InvoiceParser(bulk=True, cache=self.cache, own_vat_number=own_vat_number)
+        chunk = []
+        for item in self.extract_files(files, own_vat_number):
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                yield from self.write_chunk(parser, chunk)
+                chunk = []
+        if chunk:
+            yield from self.write_chunk(parser, chunk)
+
+    def extract_files(self, files, own_vat_number):
+        """
+        Estrae i dati dei file, in parallelo se ``workers`` > 1.
+
+        Yields:
+            tuple: (nome, contenuto, fatture estratte, errore, tempo di estrazione)
+        """
+        if self.workers == 1:
+            for name, data in files:
+                yield (name, data) + extract_file(data, own_vat_number, self.streaming)
+            return
+
+        # Le connessioni al DB non devono essere condivise con i processi figli
+        connections.close_all()
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+
+        # Finestra limitata di file in volo: l'input può essere un generatore
+        # di migliaia di file e non va letto tutto in memoria
+        window = self.workers * 4
+        pending = deque()
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=init_worker) as pool:
+            for name, data in files:
+                pending.append((name, data, pool.submit(extract_file, data, own_vat_number, self.streaming)))
+                if len(pending) >= window:
+                    name, data, future = pending.popleft()
+                    yield (name, data) + future.result()
+            while pending:
+                name, data, future = pending.popleft()
+                yield (name, data) + future.result()
+
+    def write_chunk(self, parser, chunk):
+        """
+        Salva un blocco di fatture estratte in un'unica transazione.
+        """
+        results = []
+        start = time.perf_counter()
+
+        # Una sola query per riconoscere i file già importati dell'intero blocco
+        hashes = [item[2][0]['content_hash'] for item in chunk if item[2] is not None]
+        imported = set(Invoice.objects.filter(content_hash__in=hashes).values_list('content_hash', flat=True))
+
+        with transaction.atomic():
+            for name, data, documents, error, elapsed in chunk:
+                self.stats['files'] += 1
+                self.stats['parse_time'] += elapsed
+                if error is not None:
+                    results.append(self.result(name, 'error', f'Errore nel parsing del file {name}: {error}'))
+                    continue
+                if documents[0]['content_hash'] in imported:
+                    results.append(self.result(name, 'duplicate', parser.duplicate_message(
+                        documents[0]['invoice_number'],
+                        documents[0]['issuer']['name']
+                    )))
+                    continue
+                try:
+                    with transaction.atomic():
+                        invoice, status, message = parser.save_documents(
+                            documents,
+                            ContentFile(data, name=os.path.basename(name))
+                        )
+                except Exception as e:
+                    # Gli oggetti in cache potrebbero appartenere al savepoint annullato
+                    parser.cache.clear()
+                    status, message = 'error', f'Errore nel parsing del file {name}: {str(e)}'
+                if status == 'success':
+                    self.stats['lines'] += sum(len(invoice_data['lines']) for invoice_data in documents)
+                results.append(self.result(name, status, message))
+        self.stats['db_time'] += time.perf_counter() - start
+        return results
+
+    def result(self, name, status, message):
+        return {
+            'filename': name,
+            'status': status,
+            'message': message
+        }
@@ -0,0 +1,44 @@
+# billing/services/batch_worker.py
+"""
+Funzioni eseguite nei processi del pool di BatchImporter.
+
+Il modulo non importa modelli a livello di modulo: con il metodo di avvio
+``spawn`` il processo figlio deve prima inizializzare Django (vedi
+``init_worker``) e solo dopo può caricare InvoiceParser.
+"""
+import io
+import time
+
+
+def init_worker():
+    """
+    Inizializza Django nel processo figlio se non è già pronto (spawn).
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def extract_file(data, own_vat_number, streaming):
+    """
+    Estrae i dati di una fattura dal contenuto del file, senza accedere al DB.
+
+    Returns:
+        tuple: (documents, error, elapsed) dove documents è la lista dei
+        dizionari invoice_data (uno per fattura del lotto), error è None in
+        caso di successo ed elapsed è il tempo di estrazione in secondi
+    """
+    from billing.services.invoice_parser import InvoiceParser
+    from billing.services.invoice_validation import InvoiceValidationError
+
+    start = time.perf_counter()
+    try:
+        parser = InvoiceParser(streaming=streaming, own_vat_number=own_vat_number)
+        documents = parser.extract(io.BytesIO(data))
+        return documents, None, time.perf_counter() - start
+    except InvoiceValidationError as e:
+        return None, f'fattura elettronica non valida: {e}', time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
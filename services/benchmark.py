@@ -0,0 +1,209 @@
+# billing/services/benchmark.py
+import io
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import django
+from django.db import connection
+from django.core.files.base import ContentFile
+from billing.services.batch_import import BatchImporter
+from billing.services.invoice_parser import InvoiceParser
+
+# Metriche in cui un valore più alto è un peggioramento
+LOWER_IS_BETTER = ('seconds', 'queries', 'bytes', 'blocks')
+
+
+class ImportBenchmark:
+    """
+    Benchmark di estrazione, query per fattura e importazione completa.
+
+    Ogni fase usa fatture con numeri diversi generate da
+    SyntheticInvoiceGenerator, così nessuna viene scartata come duplicata;
+    fra una fase e l'altra restano in database aziende e prodotti, come in
+    un'installazione in uso.
+
+    Args:
+        generator: SyntheticInvoiceGenerator
+        invoices: Fatture per fase
+        workers: Processi per la fase di importazione
+        chunk_size: File per transazione nella fase di importazione
+        repeat: Ripetizioni della fase di estrazione (si tiene la migliore)
+    """
+
+    def __init__(self, generator, invoices=200, workers=1, chunk_size=50, repeat=3):
+        self.generator = generator
+        self.invoices = invoices
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.repeat = repeat
+
+    def run(self, stages=('extraction', 'queries', 'import')):
+        """
+        Esegue le fasi richieste e restituisce i risultati in un dizionario
+        serializzabile in JSON.
+        """
+        results = {}
+        if 'extraction' in stages:
+            results['extraction'] = self.bench_extraction()
+        if 'queries' in stages:
+            results['queries'] = self.bench_queries()
+        if 'import' in stages:
+            results['import'] = self.bench_import()
+        return {'meta': self.meta(), 'results': results}
+
+    def meta(self):
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': current_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'invoices': self.invoices,
+            'lines': self.generator.lines,
+            'suppliers': self.generator.suppliers,
+            'products': self.generator.products,
+            'discount_ratio': self.generator.discount_ratio,
+            'workers': self.workers,
+            'chunk_size': self.chunk_size,
+        }
+
+    def bench_extraction(self):
+        """
+        Velocità della sola estrazione XML -> dizionario, senza database,
+        con l'albero completo e con l'estrattore in streaming.
+
+        Una passata ulteriore sotto tracemalloc misura la memoria occupata
+        dalle fatture estratte tenute tutte in memoria, come in un blocco di
+        importazione, per riga: byte e blocchi allocati ancora vivi alla
+        fine, e picco durante l'estrazione.
+        """
+        files = list(self.generator.generate(self.invoices, prefix='EXT'))
+        lines = self.invoices * self.generator.lines
+        results = {}
+        for mode, streaming in (('tree', False), ('streaming', True)):
+            parser = InvoiceParser(streaming=streaming, own_vat_number=self.generator.receiver_vat_number)
+            timings = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                for name, data in files:
+                    parser.extract(io.BytesIO(data))
+                timings.append(time.perf_counter() - start)
+            seconds = min(timings)
+            results[mode] = {
+                'seconds': round(seconds, 4),
+                'files_per_second': round(self.invoices / seconds, 1),
+                'lines_per_second': round(lines / seconds, 1),
+                **self.measure_memory(parser, files, lines),
+            }
+        return results
+
+    def measure_memory(self, parser, files, lines):
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.take_snapshot()
+            documents = [parser.extract(io.BytesIO(data)) for name, data in files]
+            retained = tracemalloc.take_snapshot().compare_to(baseline, 'filename')
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        del documents
+        return {
+            'retained_bytes_per_line': round(sum(stat.size_diff for stat in retained) / lines, 1),
+            'retained_blocks_per_line': round(sum(stat.count_diff for stat in retained) / lines, 2),
+            'peak_bytes': peak,
+        }
+
+    def bench_queries(self):
+        """
+        Query eseguite da parse_and_save per ogni fattura, con salvataggio
+        delle righe in blocco e riga per riga. La prima fattura parte con la
+        cache di risoluzione vuota ed è riportata a parte.
+        """
+        results = {}
+        for mode, bulk in (('bulk', True), ('legacy', False)):
+            parser = InvoiceParser(bulk=bulk)
+            counts = []
+            for name, data in self.generator.generate(self.invoices, prefix=f'QRY-{mode}'):
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    parser.parse_and_save(ContentFile(data, name=name))
+                counts.append(counter.count)
+            results[mode] = {
+                'queries_first': counts[0],
+                'queries_mean': round(statistics.mean(counts), 2),
+                'queries_max': max(counts),
+            }
+        return results
+
+    def bench_import(self):
+        """
+        Importazione completa con BatchImporter, come il comando import_invoices.
+        """
+        importer = BatchImporter(workers=self.workers, chunk_size=self.chunk_size)
+        statuses = {}
+        start = time.perf_counter()
+        for result in importer.import_files(self.generator.generate(self.invoices, prefix='IMP')):
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+        seconds = time.perf_counter() - start
+
+        stats = importer.stats
+        return {
+            'seconds': round(seconds, 4),
+            'files_per_second': round(stats['files'] / seconds, 1),
+            'lines_per_second': round(stats['lines'] / seconds, 1),
+            'parse_seconds': round(stats['parse_time'], 4),
+            'db_seconds': round(stats['db_time'], 4),
+            'statuses': statuses,
+        }
+
+
+class QueryCounter:
+    """
+    Conta le query eseguite tramite connection.execute_wrapper, anche con
+    DEBUG disattivato e senza conservarne il testo.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def current_commit():
+    """
+    Commit git del codice in esecuzione, se disponibile.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_results(baseline, current, prefix=''):
+    """
+    Confronta due risultati di benchmark metrica per metrica.
+
+    Returns:
+        list: tuple (metrica, valore di riferimento, valore attuale,
+            variazione percentuale, True se è un peggioramento)
+    """
+    rows = []
+    for key, value in current.items():
+        name = f'{prefix}{key}'
+        reference = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            rows.extend(compare_results(reference or {}, value, f'{name}.'))
+        elif isinstance(value, (int, float)) and isinstance(reference, (int, float)) and reference:
+            change = (value - reference) / reference * 100
+            worse = change > 0 if any(part in key for part in LOWER_IS_BETTER) else change < 0
+            rows.append((name, reference, value, round(change, 1), worse))
+    return rows
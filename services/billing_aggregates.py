@@ -0,0 +1,180 @@
+# billing/services/billing_aggregates.py
+import datetime
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncMonth
+from billing.models.base import BillingAggregate, Invoice, InvoiceLine
+from crm.models.base import Company
+
+# Campo che identifica la controparte per ciascun tipo di fattura
+COUNTERPARTY_FIELDS = {
+    'IN': 'issuer',
+    'OUT': 'receiver',
+}
+
+VAT_EXPRESSION = ExpressionWrapper(
+    F('line_total') * F('vat_rate') * Decimal('0.01'),
+    output_field=DecimalField(max_digits=14, decimal_places=2)
+)
+
+# Partizioni e fatture modificate nella transazione corrente, per thread
+_pending = threading.local()
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def next_month(period):
+    return (period + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_key(invoice_type, issue_date, issuer_id, receiver_id):
+    """
+    Chiave (periodo, controparte, tipo fattura) a cui appartiene una fattura.
+    """
+    company_id = issuer_id if invoice_type == 'IN' else receiver_id
+    return month_start(issue_date), company_id, invoice_type
+
+
+def invoice_partition(invoice):
+    return partition_key(invoice.invoice_type, invoice.issue_date, invoice.issuer_id, invoice.receiver_id)
+
+
+def mark_partitions(keys=(), invoice_ids=()):
+    """
+    Segnala partizioni (o fatture, la cui partizione viene risolta dopo) da
+    ricalcolare al commit della transazione corrente.
+
+    Più modifiche nella stessa transazione, ad esempio tutte le fatture di un
+    blocco importato, producono un solo ricalcolo per partizione.
+    """
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+        _pending.invoice_ids = set()
+    _pending.keys.update(keys)
+    _pending.invoice_ids.update(invoice_ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    keys = getattr(_pending, 'keys', set())
+    invoice_ids = getattr(_pending, 'invoice_ids', set())
+    if not keys and not invoice_ids:
+        return
+    _pending.keys, _pending.invoice_ids = set(), set()
+
+    if invoice_ids:
+        for values in Invoice.objects.filter(id__in=invoice_ids).values_list(
+            'invoice_type', 'issue_date', 'issuer_id', 'receiver_id'
+        ):
+            keys.add(partition_key(*values))
+    refresh_partitions(keys)
+
+
+def refresh_partitions(keys):
+    """
+    Ricalcola le partizioni indicate a partire da fatture e righe.
+
+    Ogni partizione viene riletta per intero (le fatture di una controparte in
+    un mese), quindi il risultato non dipende dall'ordine delle modifiche.
+    """
+    for period, company_id, invoice_type in sorted(keys, key=str):
+        invoices = Invoice.objects.filter(
+            invoice_type=invoice_type,
+            issue_date__gte=period,
+            issue_date__lt=next_month(period),
+            **{COUNTERPARTY_FIELDS[invoice_type]: company_id}
+        )
+        totals = invoices.aggregate(invoice_count=Count('id'), total_amount=Sum('total_amount'))
+        rates = InvoiceLine.objects.filter(invoice__in=invoices).values('vat_rate').annotate(
+            line_count=Count('id'),
+            taxable_amount=Sum('line_total'),
+            vat_amount=Sum(VAT_EXPRESSION)
+        ).order_by()
+
+        rows = []
+        if totals['invoice_count']:
+            common = {'period': period, 'company_id': company_id, 'invoice_type': invoice_type}
+            rows.append(BillingAggregate(
+                invoice_count=totals['invoice_count'],
+                total_amount=totals['total_amount'] or Decimal('0'),
+                **common
+            ))
+            rows.extend(BillingAggregate(**common, **rate) for rate in rates)
+
+        with transaction.atomic():
+            # Il lock sulla controparte serializza i ricalcoli concorrenti della
+            # stessa partizione, che altrimenti potrebbero duplicarne le righe
+            list(Company.objects.select_for_update().filter(pk=company_id).values_list('pk'))
+            BillingAggregate.objects.filter(
+                period=period, company_id=company_id, invoice_type=invoice_type
+            ).delete()
+            BillingAggregate.objects.bulk_create(rows)
+
+
+def rebuild_billing_aggregates():
+    """
+    Ricostruisce da zero l'intera tabella dei totali.
+
+    Returns:
+        int: numero di righe create
+    """
+    rows = {}
+    line_rows = defaultdict(list)
+    for invoice_type, counterparty in COUNTERPARTY_FIELDS.items():
+        invoices = Invoice.objects.filter(invoice_type=invoice_type).annotate(
+            period=TruncMonth('issue_date')
+        ).values('period', counterparty).annotate(
+            invoice_count=Count('id'),
+            total_amount=Sum('total_amount')
+        ).order_by()
+        for item in invoices:
+            key = (item['period'], item[counterparty], invoice_type)
+            rows[key] = BillingAggregate(
+                period=item['period'], company_id=item[counterparty], invoice_type=invoice_type,
+                invoice_count=item['invoice_count'], total_amount=item['total_amount'] or Decimal('0')
+            )
+
+        lines = InvoiceLine.objects.filter(invoice__invoice_type=invoice_type).annotate(
+            period=TruncMonth('invoice__issue_date')
+        ).values('period', f'invoice__{counterparty}', 'vat_rate').annotate(
+            line_count=Count('id'),
+            taxable_amount=Sum('line_total'),
+            vat_amount=Sum(VAT_EXPRESSION)
+        ).order_by()
+        for item in lines:
+            company_id = item[f'invoice__{counterparty}']
+            line_rows[(item['period'], company_id, invoice_type)].append(BillingAggregate(
+                period=item['period'], company_id=company_id, invoice_type=invoice_type,
+                vat_rate=item['vat_rate'], line_count=item['line_count'],
+                taxable_amount=item['taxable_amount'] or Decimal('0'),
+                vat_amount=item['vat_amount'] or Decimal('0')
+            ))
+
+    aggregates = list(rows.values())
+    for key in rows:
+        aggregates.extend(line_rows.get(key, []))
+
+    with transaction.atomic():
+        BillingAggregate.objects.all().delete()
+        BillingAggregate.objects.bulk_create(aggregates, batch_size=1000)
+    return len(aggregates)
+
+
+def vat_settlement(date_from, date_to):
+    """
+    Riepilogo per la liquidazione IVA: imponibile e imposta per mese, tipo
+    fattura e aliquota, letti dai totali precalcolati.
+    """
+    return BillingAggregate.objects.filter(
+        period__gte=month_start(date_from),
+        period__lte=month_start(date_to),
+        vat_rate__isnull=False
+    ).values('period', 'invoice_type', 'vat_rate').annotate(
+        taxable_amount=Sum('taxable_amount'),
+        vat_amount=Sum('vat_amount')
+    ).order_by('period', 'invoice_type', 'vat_rate')
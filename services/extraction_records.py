@@ -0,0 +1,79 @@
+# billing/services/extraction_records.py
+import sys
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+# Valori distinti oltre i quali la tabella dei decimali condivisi non cresce
+# più (aliquote e percentuali di sconto sono poche decine)
+MAX_SHARED_DECIMALS = 1024
+
+_shared_decimals = {}
+_shared_discounts = {}
+
+DISCOUNT_DESCRIPTION = 'Sconto da fattura elettronica'
+
+
+@dataclass(slots=True, frozen=True)
+class DiscountRecord:
+    """Sconto percentuale di una riga (ScontoMaggiorazione di tipo SC)"""
+    percentage: Decimal
+    description: str = DISCOUNT_DESCRIPTION
+
+
+@dataclass(slots=True)
+class LineRecord:
+    """
+    Riga estratta da un DettaglioLinee.
+
+    Con ``__slots__`` ogni riga occupa un oggetto di dimensione fissa invece
+    di un dizionario (più il sotto-dizionario del prodotto usato in
+    precedenza): la descrizione è anche il nome del prodotto e non viene
+    ripetuta. Unità di misura, aliquota IVA e sconto sono condivisi fra
+    tutte le righe che hanno lo stesso valore.
+    """
+    line_number: int
+    description: str
+    external_product_code: str
+    quantity: Decimal
+    unit_of_measure: str
+    unit_price: Decimal
+    vat_rate: Decimal
+    line_total: Decimal
+    discount: Optional[DiscountRecord] = None
+
+
+def shared_text(value):
+    """
+    Stringa internata: i valori ripetuti su molte righe (unità di misura)
+    sono un solo oggetto in memoria.
+    """
+    return sys.intern(value) if value else ''
+
+
+def shared_decimal(text):
+    """
+    Decimal condiviso per i valori che si ripetono su molte righe, come
+    l'aliquota IVA: le righe con lo stesso testo ricevono lo stesso oggetto.
+
+    Raises:
+        InvalidOperation: se il testo non è un numero
+    """
+    value = _shared_decimals.get(text)
+    if value is None:
+        value = Decimal(text)
+        if len(_shared_decimals) < MAX_SHARED_DECIMALS:
+            _shared_decimals[text] = value
+    return value
+
+
+def shared_discount(percentage_text):
+    """
+    DiscountRecord condiviso per percentuale.
+    """
+    discount = _shared_discounts.get(percentage_text)
+    if discount is None:
+        discount = DiscountRecord(shared_decimal(percentage_text))
+        if len(_shared_discounts) < MAX_SHARED_DECIMALS:
+            _shared_discounts[percentage_text] = discount
+    return discount
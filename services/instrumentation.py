@@ -0,0 +1,102 @@
+# billing/services/instrumentation.py
+import json
+import logging
+import time
+from contextlib import contextmanager
+from django.db import connection
+
+logger = logging.getLogger('billing.import')
+
+# Fasi dell'importazione, nell'ordine in cui vengono riportate
+STAGES = (
+    'parse',
+    'validate',
+    'extract',
+    'resolve_companies',
+    'persist_invoice',
+    'resolve_products',
+    'persist_lines',
+    'stock',
+    'commit',
+)
+
+
+class ImportMetrics:
+    """
+    Tempo e numero di query SQL per fase dell'importazione.
+
+    Le fasi possono essere annidate: tempo e query vengono attribuiti alla
+    fase più interna attiva, così la somma delle fasi coincide con il totale
+    e la fase esterna riporta solo ciò che non rientra in quelle interne
+    (ad esempio ``commit`` comprende i ricalcoli eseguiti al commit).
+
+    Le query vengono contate con connection.execute_wrapper, anche con DEBUG
+    disattivato e senza conservarne il testo.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.files = 0
+        self._stack = []
+
+    @contextmanager
+    def track(self):
+        """
+        Attiva il conteggio delle query per la durata del blocco.
+        """
+        with connection.execute_wrapper(self._count_query):
+            yield self
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._stack[-1]['elapsed'] += now - self._stack[-1]['started']
+        frame = {'name': name, 'started': now, 'elapsed': 0.0, 'queries': 0}
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._stack.pop()
+            stats = self.stages.setdefault(name, {'seconds': 0.0, 'queries': 0, 'calls': 0})
+            stats['seconds'] += frame['elapsed'] + now - frame['started']
+            stats['queries'] += frame['queries']
+            stats['calls'] += 1
+            if self._stack:
+                self._stack[-1]['started'] = now
+
+    def _count_query(self, execute, sql, params, many, context):
+        if self._stack:
+            self._stack[-1]['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def summary(self):
+        """
+        Riepilogo serializzabile in JSON, con le fasi nell'ordine di STAGES.
+        """
+        order = {name: index for index, name in enumerate(STAGES)}
+        stages = {
+            name: {
+                'seconds': round(stats['seconds'], 4),
+                'queries': stats['queries'],
+                'calls': stats['calls'],
+            }
+            for name, stats in sorted(self.stages.items(), key=lambda item: order.get(item[0], len(order)))
+        }
+        return {
+            'files': self.files,
+            'seconds': round(sum(stats['seconds'] for stats in self.stages.values()), 4),
+            'queries': sum(stats['queries'] for stats in self.stages.values()),
+            'stages': stages,
+        }
+
+    def log(self, **context):
+        """
+        Registra il riepilogo come metrica strutturata: JSON nel messaggio e
+        dizionario in ``extra`` per gli handler che lo gestiscono.
+        """
+        summary = dict(context, **self.summary())
+        logger.info('import_metrics %s', json.dumps(summary, default=str), extra={'import_metrics': summary})
+        return summary
+
@@ -0,0 +1,58 @@
+# billing/services/invoice_filters.py
+import datetime
+from django.db.models import Q
+from billing.models.base import Invoice
+
+
+def parse_date(value):
+    """
+    Converte una data in formato ISO (AAAA-MM-GG) o italiano (GG/MM/AAAA);
+    restituisce None se il valore è vuoto o non valido.
+    """
+    for date_format in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def filter_invoices(queryset, params, counterparty_field):
+    """
+    Applica i filtri delle liste fatture ricevuti in query string.
+
+    Args:
+        queryset: Fatture di partenza
+        params: QueryDict con date_from, date_to, payment_status e search
+        counterparty_field: 'issuer' per le fatture fornitori, 'receiver' per
+            quelle clienti; la ricerca testuale usa il nome della controparte
+
+    Returns:
+        tuple: (queryset filtrato, True se è stato applicato almeno un filtro)
+    """
+    filtered = False
+
+    date_from = parse_date(params.get('date_from'))
+    if date_from:
+        queryset = queryset.filter(issue_date__gte=date_from)
+        filtered = True
+
+    date_to = parse_date(params.get('date_to'))
+    if date_to:
+        queryset = queryset.filter(issue_date__lte=date_to)
+        filtered = True
+
+    payment_status = params.get('payment_status')
+    if payment_status in dict(Invoice.PAYMENT_STATUS):
+        queryset = queryset.filter(payment_status=payment_status)
+        filtered = True
+
+    search = (params.get('search[value]') or params.get('search') or '').strip()
+    if search:
+        queryset = queryset.filter(
+            Q(invoice_number__icontains=search) |
+            Q(**{f'{counterparty_field}__name__icontains': search})
+        )
+        filtered = True
+
+    return queryset, filtered
@@ -1,18 +1,82 @@
 # billing/services/invoice_parser.py
 from decimal import Decimal
 import datetime
+import io
+import os
+from contextlib import nullcontext
 from xml.etree import ElementTree as ET
-from billing.models.base import Invoice, InvoiceLine, Discount
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from billing.models.base import Invoice, InvoiceLine, Discount, PaymentInstalment
+from billing.services.resolution_cache import ResolutionCache
+from billing.services.streaming_extractor import StreamingInvoiceExtractor
+from billing.services.extraction_records import LineRecord, shared_decimal, shared_discount, shared_text
+from billing.services.invoice_validation import InvoiceValidationError, validate_payload
+from billing.services.own_company import get_own_company
+from billing.services.payload import compute_content_hash, unwrap_payload
+from billing.services.product_codes import (
+    CODE_FROM_ARTICLE, TRUSTED_CODE_SOURCES, default_code_rules, select_article_code
+)
+from billing.services.product_matching import default_matcher
+from billing.services.stock_ledger import sync_invoice_movements
 from warehouse.models.base import Product, ProductAlias
 from crm.models.base import Company as CRMCompany
 
+# Verifica dei documenti prima dell'estrazione (vedi invoice_validation):
+# facoltativa perché richiede una seconda lettura completa di ogni file
+VALIDATE_INVOICES = getattr(settings, 'BILLING_VALIDATE_INVOICES', False)
+
 class InvoiceParser:
     """
     Classe responsabile del parsing e della persistenza delle fatture XML
+
+    Con ``bulk=True`` le righe vengono costruite in memoria e inserite con un
+    unico ``bulk_create``, insieme ai relativi movimenti di magazzino, il
+    tutto in un'unica transazione.
+
+    ``cache`` è una ResolutionCache condivisibile tra più chiamate per
+    risolvere aziende, prodotti e sconti di un intero lotto di file senza
+    ripetere le stesse query; se non indicata ne viene creata una nuova.
+
+    Con ``streaming=True`` l'estrazione usa StreamingInvoiceExtractor
+    (iterparse in un'unica passata) invece di caricare l'intero albero XML.
+
+    ``own_vat_number`` permette di indicare la partita IVA della nostra
+    azienda: in quel caso l'estrazione non accede al database e può essere
+    eseguita in un processo separato.
+
+    ``metrics`` è un ImportMetrics facoltativo in cui vengono registrati
+    tempo e query di ciascuna fase dell'importazione.
+
+    ``matcher`` è il ProductMatcher usato per riconoscere le varianti di
+    descrizione di prodotti già noti; di default quello condiviso dal processo.
+
+    ``code_rules`` sono le ProductCodeRules con cui ricavare il codice
+    articolo dalla descrizione quando la riga non ha CodiceArticolo.
+
+    Con ``validate`` (default BILLING_VALIDATE_INVOICES) ogni documento
+    viene verificato con validate_payload prima dell'estrazione: i file non
+    validi vengono scartati con InvoiceValidationError, senza accedere al
+    database.
     """
     
-    def __init__(self):
+    def __init__(self, bulk=False, cache=None, streaming=False, own_vat_number=None, metrics=None,
+                 matcher=None, code_rules=None, validate=None):
         self.ns = {'p': 'http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2'}
+        self.bulk = bulk
+        self.cache = cache if cache is not None else ResolutionCache()
+        self.streaming = streaming
+        self.own_vat_number = own_vat_number
+        self.metrics = metrics
+        self.matcher = matcher if matcher is not None else default_matcher
+        self.code_rules = code_rules if code_rules is not None else default_code_rules
+        self.validate = VALIDATE_INVOICES if validate is None else validate
+
+    def stage(self, name):
+        """
+        Contesto della fase ``name`` per le metriche, se attive.
+        """
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
     
     def parse_and_save(self, xml_file):
         """
@@ -22,216 +86,522 @@ class InvoiceParser:
             xml_file: File XML da parsare
             
         Returns:
-            tuple: (invoice, status, message) dove status può essere 'success', 'duplicate', 'error'
+            tuple: (invoice, status, message) dove status può essere 'success', 'duplicate', 'error';
+            per i file con più fatture (lotti) invoice è la prima salvata
+
+        Raises:
+            DatabaseError: errori del database (lock, connessione persa), che
+                possono essere temporanei: il chiamante decide se ritentare
         """
+        if self.metrics is not None:
+            self.metrics.files += 1
         try:
-            # Parsing del file XML
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            
-            # Estrazione dei dati principali della fattura
-            invoice_data = self.extract_invoice_data(root)
+            with self.stage('parse'):
+                payload = self.read_payload(xml_file)
+
+                # I file già caricati si riconoscono dall'hash, prima di ogni parsing
+                content_hash = compute_content_hash(payload)
+                existing_invoice = Invoice.objects.filter(
+                    content_hash=content_hash
+                ).select_related('issuer').only('invoice_number', 'issuer__name').first()
+            if existing_invoice:
+                return None, 'duplicate', self.duplicate_message(
+                    existing_invoice.invoice_number,
+                    existing_invoice.issuer.name
+                )
 
-            # Ottieni o crea le aziende
-            issuer = self.get_or_create_company(invoice_data['issuer'])
-            receiver = self.get_or_create_company(invoice_data['receiver'])
+            # Parsing del file XML ed estrazione dei dati delle fatture
+            with self.stage('extract'):
+                documents = self.extract_payload(payload, content_hash)
+            return self.save_documents(documents, xml_file)
 
-            # Verifica se la fattura esiste già
-            existing_invoice = Invoice.objects.filter(
-                invoice_number=invoice_data['invoice_number'],
-                issuer=issuer,
-                invoice_type=invoice_data['invoice_type']
-            ).first()
+        except InvoiceValidationError as e:
+            return None, 'error', f'Il file {xml_file.name} non è una fattura elettronica valida: {e}'
+        except DatabaseError:
+            self.cache.clear()
+            raise
+        except Exception as e:
+            # Gli oggetti in cache potrebbero appartenere a una transazione annullata
+            self.cache.clear()
+            return None, 'error', f'Errore nel parsing del file {xml_file.name}: {str(e)}'
 
-            if existing_invoice:
-                return None, 'duplicate', f'La fattura n. {invoice_data["invoice_number"]} di {issuer.name} è già presente nel sistema.'
-
-            # Creazione dell'oggetto Invoice
-            invoice = Invoice.objects.create(
-                file_xml=xml_file,
-                invoice_number=invoice_data['invoice_number'],
-                invoice_type=invoice_data['invoice_type'],
-                issue_date=invoice_data['issue_date'],
-                currency=invoice_data['currency'],
+    def save_documents(self, documents, xml_file):
+        """
+        Salva nel database le fatture estratte da un file, in un'unica
+        transazione.
+
+        Le fatture di un lotto condividono l'header: emittente e destinatario
+        vengono risolti una sola volta e il file viene salvato una sola volta
+        e collegato a tutte. Le fatture già presenti vengono saltate; il
+        content_hash del file va alla prima fattura salvata.
+
+        Args:
+            documents: Lista di dizionari invoice_data prodotta da extract()
+            xml_file: File originale da allegare alle fatture
+
+        Returns:
+            tuple: (invoice, status, message) con status 'success' o 'duplicate'
+            e invoice la prima fattura salvata; gli errori vengono propagati
+            al chiamante
+        """
+        first = documents[0]
+        content_hash = first.get('content_hash')
+
+        # Ottieni o crea le aziende
+        with self.stage('resolve_companies'):
+            issuer = self.get_or_create_company(first['issuer'])
+            receiver = self.get_or_create_company(first['receiver'])
+
+        # Verifica con una sola query quali fatture esistono già
+        with self.stage('persist_invoice'):
+            numbers = [invoice_data['invoice_number'] for invoice_data in documents]
+            existing = set(Invoice.objects.filter(
+                invoice_number__in=numbers,
                 issuer=issuer,
-                receiver=receiver,
-                taxable_amount=invoice_data['taxable_amount'],
-                vat_amount=invoice_data['vat_amount'],
-                total_amount=invoice_data['total_amount'],
-                notes=invoice_data.get('notes', '')
-            )
+                invoice_type=first['invoice_type']
+            ).values_list('invoice_number', flat=True))
 
-            # Creazione delle righe della fattura
-            for line_data in invoice_data['lines']:
-                # Ottieni o crea il prodotto basato sui dati del fornitore
-                product = self.get_or_create_product(
-                    line_data['product'], 
-                    invoice.issuer
-                )
-                
-                # Gestione dello sconto se presente
-                discount = self.get_or_create_discount(line_data.get('discount'))
-
-                InvoiceLine.objects.create(
-                    invoice=invoice,
-                    line_number=line_data['line_number'],
-                    product=product,
-                    external_product_code=line_data['external_product_code'],
-                    description=line_data['description'],
-                    quantity=line_data['quantity'],
-                    unit_of_measure=line_data['unit_of_measure'],
-                    unit_price=line_data['unit_price'],
-                    vat_rate=line_data['vat_rate'],
-                    line_total=line_data['line_total'],
-                    discount=discount
-                )
+        pending = []
+        for invoice_data in documents:
+            if invoice_data['invoice_number'] not in existing:
+                # Un numero ripetuto nello stesso lotto viene salvato una volta
+                existing.add(invoice_data['invoice_number'])
+                pending.append(invoice_data)
+        duplicates = len(documents) - len(pending)
 
-            return invoice, 'success', f'Fattura n. {invoice.invoice_number} di {issuer.name} caricata con successo!'
-            
+        if not pending:
+            return None, 'duplicate', self.duplicate_message(first['invoice_number'], issuer.name)
+
+        invoices = []
+        try:
+            # Fatture e righe in un'unica transazione: i totali di periodo
+            # vengono ricalcolati una sola volta, al commit
+            # La fase commit comprende ciò che avviene al commit (saldi, totali)
+            with self.stage('commit'), transaction.atomic():
+                original_filename = os.path.basename(xml_file.name or '')[:255]
+                for invoice_data in pending:
+                    with self.stage('persist_invoice'):
+                        invoice = self.create_invoice(
+                            invoice_data, issuer, receiver,
+                            # Il file è salvato con la prima fattura e riusato dalle altre
+                            invoices[0].file_xml.name if invoices else xml_file,
+                            content_hash=None if invoices else content_hash,
+                            original_filename=original_filename
+                        )
+                    if self.bulk:
+                        self.save_lines_bulk(invoice, invoice_data['lines'])
+                    else:
+                        self.save_lines(invoice, invoice_data['lines'])
+                    with self.stage('persist_invoice'):
+                        self.save_instalments(invoice, invoice_data.get('payments'))
+                    invoices.append(invoice)
         except Exception as e:
-            return None, 'error', f'Errore nel parsing del file {xml_file.name}: {str(e)}'
+            # Cache e indice dei prodotti del fornitore possono riferirsi a
+            # oggetti della transazione annullata
+            self.cache.clear()
+            self.matcher.invalidate(issuer)
+            # Lo stesso file caricato in contemporanea da un'altra richiesta:
+            # l'indice univoco su content_hash rende il controllo sicuro
+            if (isinstance(e, IntegrityError) and content_hash
+                    and Invoice.objects.filter(content_hash=content_hash).exists()):
+                return None, 'duplicate', self.duplicate_message(first['invoice_number'], issuer.name)
+            raise
+
+        invoice = invoices[0]
+        if len(documents) == 1:
+            return invoice, 'success', f'Fattura n. {invoice.invoice_number} di {issuer.name} caricata con successo!'
+        message = (
+            f'Lotto di {len(invoices)} fatture di {issuer.name} caricato con successo '
+            f'(n. {", ".join(item.invoice_number for item in invoices)})'
+        )
+        if duplicates:
+            message += f'; {duplicates} già presenti nel sistema'
+        return invoice, 'success', message + '!'
+
+    def duplicate_message(self, invoice_number, issuer_name):
+        return f'La fattura n. {invoice_number} di {issuer_name} è già presente nel sistema.'
+
+    def extract(self, xml_file):
+        """
+        Legge il file XML e restituisce la lista dei dizionari invoice_data,
+        uno per ogni FatturaElettronicaBody.
+
+        Il file può essere anche firmato (.xml.p7m), codificato in base64 o
+        compresso: il documento XML viene estratto in memoria.
+        """
+        return self.extract_payload(self.read_payload(xml_file))
+
+    def read_payload(self, xml_file):
+        """
+        Legge il file ed estrae il documento XML da eventuali buste
+        """
+        return unwrap_payload(xml_file.read())
+
+    def extract_payload(self, payload, content_hash=None):
+        """
+        Estrae le fatture dal documento XML; il content_hash del documento
+        viene assegnato alla prima
+        """
+        if self.validate:
+            with self.stage('validate'):
+                validate_payload(payload)
+        documents = self.parse_payload(io.BytesIO(payload))
+        for invoice_data in documents:
+            invoice_data['content_hash'] = None
+        documents[0]['content_hash'] = content_hash or compute_content_hash(payload)
+        return documents
+
+    def parse_payload(self, source):
+        """
+        Parsa il documento XML con l'estrattore configurato
+        """
+        if self.streaming:
+            return StreamingInvoiceExtractor(self).extract(source)
+
+        tree = ET.parse(source)
+        return self.extract_invoice_data(tree.getroot())
+
+    def create_invoice(self, invoice_data, issuer, receiver, xml_file, content_hash=None, original_filename=''):
+        """
+        Crea l'oggetto Invoice a partire dai dati estratti
+        """
+        return Invoice.objects.create(
+            file_xml=xml_file,
+            original_filename=original_filename,
+            invoice_number=invoice_data['invoice_number'],
+            invoice_type=invoice_data['invoice_type'],
+            issue_date=invoice_data['issue_date'],
+            currency=invoice_data['currency'],
+            issuer=issuer,
+            receiver=receiver,
+            taxable_amount=invoice_data['taxable_amount'],
+            vat_amount=invoice_data['vat_amount'],
+            total_amount=invoice_data['total_amount'],
+            notes=invoice_data.get('notes', ''),
+            content_hash=content_hash
+        )
+
+    def save_instalments(self, invoice, payments):
+        """
+        Crea le rate di pagamento della fattura con un solo bulk_create.
+
+        Senza DatiPagamento la fattura diventa un'unica rata pari al totale
+        documento, in scadenza alla data di emissione; lo stesso vale per
+        l'importo di un'unica rata che non lo riporta.
+        """
+        payments = payments or [{}]
+        counterparty_id = invoice.issuer_id if invoice.invoice_type == 'IN' else invoice.receiver_id
+        instalments = [
+            PaymentInstalment(
+                invoice=invoice,
+                company_id=counterparty_id,
+                invoice_type=invoice.invoice_type,
+                sequence=sequence,
+                payment_terms=payment.get('payment_terms', ''),
+                payment_method=payment.get('payment_method', ''),
+                due_date=payment.get('due_date') or invoice.issue_date,
+                amount=payment['amount'] if payment.get('amount') is not None else (
+                    invoice.total_amount if len(payments) == 1 else Decimal('0')
+                ),
+                iban=payment.get('iban', ''),
+            )
+            for sequence, payment in enumerate(payments, start=1)
+        ]
+        return PaymentInstalment.objects.bulk_create(instalments)
+
+    def preload_products(self, invoice, lines_data):
+        """
+        Precarica in cache alias e prodotti di tutte le righe con una query IN,
+        deduplicando i nomi ripetuti all'interno della fattura
+        """
+        names = {line_data.description for line_data in lines_data}
+        self.cache.preload_products(invoice.issuer, names)
+
+    def build_line(self, invoice, line_data):
+        """
+        Costruisce (senza salvarla) una riga fattura risolvendo prodotto e sconto
+        """
+        # Senza CodiceArticolo il codice viene cercato nella descrizione con
+        # le regole del fornitore, note solo a questo punto
+        external_product_code, code_source = line_data.external_product_code, CODE_FROM_ARTICLE
+        if not external_product_code:
+            external_product_code, code_source = self.code_rules.extract(invoice.issuer, line_data.description)
+
+        # Ottieni o crea il prodotto basato sui dati del fornitore: la
+        # descrizione della riga è anche il nome del prodotto. Il codice
+        # stimato dalla descrizione resta solo sulla riga
+        product = self.get_or_create_product(
+            {
+                'name': line_data.description,
+                'external_code': external_product_code if code_source in TRUSTED_CODE_SOURCES else '',
+                'description': line_data.description
+            },
+            invoice.issuer
+        )
+        
+        # Gestione dello sconto se presente
+        discount = self.get_or_create_discount(line_data.discount)
+
+        return InvoiceLine(
+            invoice=invoice,
+            line_number=line_data.line_number,
+            product=product,
+            external_product_code=external_product_code,
+            description=line_data.description,
+            quantity=line_data.quantity,
+            unit_of_measure=line_data.unit_of_measure,
+            unit_price=line_data.unit_price,
+            vat_rate=line_data.vat_rate,
+            line_total=line_data.line_total,
+            discount=discount
+        )
+
+    def save_lines(self, invoice, lines_data):
+        """
+        Salva le righe una alla volta: ogni save() registra i movimenti di
+        magazzino della riga
+        """
+        with self.stage('resolve_products'):
+            self.preload_products(invoice, lines_data)
+        for line_data in lines_data:
+            with self.stage('resolve_products'):
+                line = self.build_line(invoice, line_data)
+            with self.stage('persist_lines'):
+                line.save()
+
+    def save_lines_bulk(self, invoice, lines_data):
+        """
+        Inserisce tutte le righe con un solo bulk_create e registra i relativi
+        movimenti di magazzino con un secondo bulk_create.
+
+        bulk_create non invoca i segnali di InvoiceLine, quindi i movimenti
+        vengono generati qui; i saldi dei prodotti vengono aggiornati dopo il
+        commit, senza tenere lock sui prodotti durante l'importazione.
+        """
+        with self.stage('resolve_products'):
+            self.preload_products(invoice, lines_data)
+            lines = [self.build_line(invoice, line_data) for line_data in lines_data]
+        with self.stage('persist_lines'):
+            InvoiceLine.objects.bulk_create(lines)
+        with self.stage('stock'):
+            sync_invoice_movements(invoice, lines, created=True)
+        return lines
 
     def extract_invoice_data(self, root):
         """
         Estrae i dati dalla fattura elettronica nel formato XML specificato.
+
+        Restituisce un dizionario invoice_data per ogni FatturaElettronicaBody:
+        i file in forma di lotto contengono più fatture con un unico header.
         """
-        # Estrazione dei dati principali della fattura dal corpo XML
         header = root.find('.//FatturaElettronicaHeader', self.ns)
-        body = root.find('.//FatturaElettronicaBody', self.ns)
-        
-        # Dati generali
-        dati_generali = body.find('.//DatiGeneraliDocumento', self.ns)
+
+        # Estrazione dei dati del cedente/prestatore (fornitore)
+        issuer_data = self.extract_party_data(header.find('.//CedentePrestatore', self.ns))
+        invoice_type = self.resolve_invoice_type(issuer_data)
+          
+        # Estrazione dei dati del cessionario/committente (cliente)
+        receiver_data = self.extract_party_data(
+            header.find('.//CessionarioCommittente', self.ns),
+            with_contacts=False
+        )
+
+        documents = []
+        for body in root.findall('.//FatturaElettronicaBody', self.ns):
+            # Dati generali
+            general_data = self.extract_general_data(body.find('.//DatiGeneraliDocumento', self.ns))
+
+            # Estrazione delle righe della fattura
+            lines = [self.extract_line_data(line) for line in body.findall('.//DettaglioLinee', self.ns)]
+
+            # Calcolo degli importi dai dati di riepilogo
+            summaries = [
+                self.extract_summary_data(riepilogo) for riepilogo in body.findall('.//DatiRiepilogo', self.ns)
+            ]
+
+            # Rate di pagamento
+            payments = [
+                payment
+                for dati_pagamento in body.findall('DatiPagamento', self.ns)
+                for payment in self.extract_payment_data(dati_pagamento)
+            ]
+
+            documents.append(self.build_invoice_data(
+                general_data, invoice_type, issuer_data, receiver_data, lines, summaries, payments
+            ))
+        if not documents:
+            raise ValueError('Nessun FatturaElettronicaBody nel documento')
+        return documents
+
+    def extract_general_data(self, dati_generali):
+        """
+        Estrae numero, data, divisa e totale da DatiGeneraliDocumento.
+        """
         invoice_number = dati_generali.findtext('Numero', namespaces=self.ns)
-        tipo_documento = dati_generali.findtext('TipoDocumento', namespaces=self.ns)
         
         # Conversione data da stringa a oggetto datetime
         issue_date_str = dati_generali.findtext('Data', namespaces=self.ns)
         issue_date = datetime.datetime.strptime(issue_date_str, '%Y-%m-%d').date() if issue_date_str else None
         
-        currency = dati_generali.findtext('Divisa', namespaces=self.ns)
-        total_amount = Decimal(dati_generali.findtext('ImportoTotaleDocumento', namespaces=self.ns) or '0')
-
-        # Estrazione dei dati del cedente/prestatore (fornitore)
-        cedente = header.find('.//CedentePrestatore', self.ns)
-        dati_anagrafici_cedente = cedente.find('.//DatiAnagrafici', self.ns)
-        sede_cedente = cedente.find('.//Sede', self.ns)
-        
-        issuer_data = {
-            'name': dati_anagrafici_cedente.findtext('.//Denominazione', namespaces=self.ns),
-            'vat_number': dati_anagrafici_cedente.findtext('.//IdFiscaleIVA/IdCodice', namespaces=self.ns),
-            'address': f"{sede_cedente.findtext('Indirizzo', namespaces=self.ns)} {sede_cedente.findtext('NumeroCivico', namespaces=self.ns) or ''}",
-            'city': sede_cedente.findtext('Comune', namespaces=self.ns),
-            'postal_code': sede_cedente.findtext('CAP', namespaces=self.ns),
-            'country': sede_cedente.findtext('Nazione', namespaces=self.ns),
-            'phone': cedente.findtext('.//Contatti/Telefono', namespaces=self.ns) or '',
-            'email': cedente.findtext('.//Contatti/Email', namespaces=self.ns) or ''
+        return {
+            'invoice_number': invoice_number,
+            'issue_date': issue_date,
+            'currency': dati_generali.findtext('Divisa', namespaces=self.ns),
+            'total_amount': Decimal(dati_generali.findtext('ImportoTotaleDocumento', namespaces=self.ns) or '0'),
         }
 
-        # Controlla se il cedente è la nostra azienda
-        own_company = CRMCompany.objects.filter(is_own_company=True).first()
-        if issuer_data['vat_number']==own_company.vat_number:
-            invoice_type = 'OUT'  # Se il cedente è la nostra azienda, è una fattura in uscita
-        else:
-            invoice_type = 'IN'   # Altrimenti è una fattura in entrata
-          
-        # Estrazione dei dati del cessionario/committente (cliente)
-        cessionario = header.find('.//CessionarioCommittente', self.ns)
-        dati_anagrafici_cessionario = cessionario.find('.//DatiAnagrafici', self.ns)
-        sede_cessionario = cessionario.find('.//Sede', self.ns)
+    def extract_party_data(self, party, with_contacts=True):
+        """
+        Estrae anagrafica e sede da CedentePrestatore o CessionarioCommittente.
+        """
+        dati_anagrafici = party.find('.//DatiAnagrafici', self.ns)
+        sede = party.find('.//Sede', self.ns)
         
-        receiver_data = {
-            'name': dati_anagrafici_cessionario.findtext('.//Denominazione', namespaces=self.ns),
-            'vat_number': dati_anagrafici_cessionario.findtext('.//IdFiscaleIVA/IdCodice', namespaces=self.ns),
-            'address': f"{sede_cessionario.findtext('Indirizzo', namespaces=self.ns)} {sede_cessionario.findtext('NumeroCivico', namespaces=self.ns) or ''}",
-            'city': sede_cessionario.findtext('Comune', namespaces=self.ns),
-            'postal_code': sede_cessionario.findtext('CAP', namespaces=self.ns),
-            'country': sede_cessionario.findtext('Nazione', namespaces=self.ns),
-            'phone': '',  # Non presente nel XML di esempio
-            'email': ''   # Non presente nel XML di esempio
+        return {
+            'name': dati_anagrafici.findtext('.//Denominazione', namespaces=self.ns),
+            'vat_number': dati_anagrafici.findtext('.//IdFiscaleIVA/IdCodice', namespaces=self.ns),
+            'address': f"{sede.findtext('Indirizzo', namespaces=self.ns)} {sede.findtext('NumeroCivico', namespaces=self.ns) or ''}",
+            'city': sede.findtext('Comune', namespaces=self.ns),
+            'postal_code': sede.findtext('CAP', namespaces=self.ns),
+            'country': sede.findtext('Nazione', namespaces=self.ns),
+            # I contatti del cessionario non sono presenti nel XML di esempio
+            'phone': (party.findtext('.//Contatti/Telefono', namespaces=self.ns) or '') if with_contacts else '',
+            'email': (party.findtext('.//Contatti/Email', namespaces=self.ns) or '') if with_contacts else ''
         }
 
-        # Estrazione delle righe della fattura
-        lines = []
-        dettaglio_linee = body.findall('.//DettaglioLinee', self.ns)
+    def resolve_invoice_type(self, issuer_data):
+        """
+        Determina se la fattura è in uscita o in entrata confrontando il
+        cedente con la nostra azienda.
+        """
+        own_vat_number = self.own_vat_number
+        if own_vat_number is None:
+            own_vat_number = get_own_company().vat_number
+        if issuer_data['vat_number']==own_vat_number:
+            return 'OUT'  # Se il cedente è la nostra azienda, è una fattura in uscita
+        return 'IN'   # Altrimenti è una fattura in entrata
+
+    def extract_line_data(self, line):
+        """
+        Estrae i dati di una singola DettaglioLinee in un LineRecord.
+        """
+        description = line.findtext('Descrizione', namespaces=self.ns) or ''
         
-        for line in dettaglio_linee:
-            description = line.findtext('Descrizione', namespaces=self.ns) or ''
-            
-            # Tentativo di estrazione del codice prodotto
-            external_product_code = ''
-            if description and ' ' in description:
-                potential_code = description.split(' ')[0]
-                if potential_code.isupper():  # Supponiamo che i codici siano in maiuscolo
-                    external_product_code = potential_code
-            
-            # Estrazione dei valori numerici
-            try:
-                quantity = Decimal(line.findtext('Quantita', namespaces=self.ns) or '0')
-                unit_price = Decimal(line.findtext('PrezzoUnitario', namespaces=self.ns) or '0')
-                line_total = Decimal(line.findtext('PrezzoTotale', namespaces=self.ns) or '0')
-                vat_rate = Decimal(line.findtext('AliquotaIVA', namespaces=self.ns) or '0')
-            except (ValueError, TypeError):
-                quantity = Decimal('0')
-                unit_price = Decimal('0')
-                line_total = Decimal('0')
-                vat_rate = Decimal('0')
-            
-            # Gestione degli sconti
-            discount_data = None
-            sconto_maggiorazione = line.find('.//ScontoMaggiorazione', self.ns)
-            if sconto_maggiorazione is not None:
-                tipo = sconto_maggiorazione.findtext('Tipo', namespaces=self.ns)
-                if tipo == 'SC':  # Sconto
-                    percentuale = sconto_maggiorazione.findtext('Percentuale', namespaces=self.ns)
-                    if percentuale:
-                        discount_data = {
-                            'percentage': Decimal(percentuale),
-                            'description': 'Sconto da fattura elettronica'
-                        }
-            
-            line_data = {
-                'line_number': int(line.findtext('NumeroLinea', namespaces=self.ns) or '0'),
-                'product': {
-                    'name': description,
-                    'external_code': external_product_code,
-                    'description': description
-                },
-                'external_product_code': external_product_code,
-                'description': description,
-                'quantity': quantity,
-                'unit_of_measure': line.findtext('UnitaMisura', namespaces=self.ns) or '',
-                'unit_price': unit_price,
-                'vat_rate': vat_rate,
-                'line_total': line_total,
-                'discount': discount_data
-            }
-            lines.append(line_data)
-
-        # Calcolo degli importi dai dati di riepilogo
-        dati_riepilogo = body.findall('.//DatiRiepilogo', self.ns)
+        # Codice prodotto da CodiceArticolo; in assenza viene ricavato dalla
+        # descrizione con le regole del fornitore in fase di salvataggio
+        external_product_code = select_article_code(
+            (codice.findtext('CodiceTipo', namespaces=self.ns) or '',
+             codice.findtext('CodiceValore', namespaces=self.ns) or '')
+            for codice in line.findall('CodiceArticolo', self.ns)
+        )
+        
+        # Estrazione dei valori numerici
+        try:
+            quantity = Decimal(line.findtext('Quantita', namespaces=self.ns) or '0')
+            unit_price = Decimal(line.findtext('PrezzoUnitario', namespaces=self.ns) or '0')
+            line_total = Decimal(line.findtext('PrezzoTotale', namespaces=self.ns) or '0')
+            vat_rate = shared_decimal(line.findtext('AliquotaIVA', namespaces=self.ns) or '0')
+        except (ValueError, TypeError):
+            quantity = Decimal('0')
+            unit_price = Decimal('0')
+            line_total = Decimal('0')
+            vat_rate = Decimal('0')
+        
+        # Gestione degli sconti
+        discount_data = None
+        sconto_maggiorazione = line.find('.//ScontoMaggiorazione', self.ns)
+        if sconto_maggiorazione is not None:
+            tipo = sconto_maggiorazione.findtext('Tipo', namespaces=self.ns)
+            if tipo == 'SC':  # Sconto
+                percentuale = sconto_maggiorazione.findtext('Percentuale', namespaces=self.ns)
+                if percentuale:
+                    discount_data = shared_discount(percentuale)
+        
+        return LineRecord(
+            line_number=int(line.findtext('NumeroLinea', namespaces=self.ns) or '0'),
+            description=description,
+            external_product_code=external_product_code,
+            quantity=quantity,
+            unit_of_measure=shared_text(line.findtext('UnitaMisura', namespaces=self.ns)),
+            unit_price=unit_price,
+            vat_rate=vat_rate,
+            line_total=line_total,
+            discount=discount_data
+        )
+
+    def extract_summary_data(self, riepilogo):
+        """
+        Estrae imponibile e imposta da un blocco DatiRiepilogo.
+        """
+        return (
+            Decimal(riepilogo.findtext('ImponibileImporto', namespaces=self.ns) or '0'),
+            Decimal(riepilogo.findtext('Imposta', namespaces=self.ns) or '0'),
+        )
+
+    def extract_payment_data(self, dati_pagamento):
+        """
+        Estrae le rate di un blocco DatiPagamento, una per DettaglioPagamento.
+
+        La scadenza è DataScadenzaPagamento o, in sua assenza, la data di
+        riferimento più i giorni dei termini di pagamento; se non ricavabile
+        resta None e al salvataggio si usa la data della fattura.
+        """
+        payment_terms = dati_pagamento.findtext('CondizioniPagamento', namespaces=self.ns) or ''
+        payments = []
+        for detail in dati_pagamento.findall('DettaglioPagamento', self.ns):
+            due_date = self.parse_date(detail.findtext('DataScadenzaPagamento', namespaces=self.ns))
+            if due_date is None:
+                reference = self.parse_date(detail.findtext('DataRiferimentoTerminiPagamento', namespaces=self.ns))
+                days = detail.findtext('GiorniTerminiPagamento', namespaces=self.ns)
+                if reference is not None:
+                    due_date = reference + datetime.timedelta(days=int(days) if days and days.isdigit() else 0)
+            amount = detail.findtext('ImportoPagamento', namespaces=self.ns)
+            payments.append({
+                'payment_terms': payment_terms[:4],
+                'payment_method': (detail.findtext('ModalitaPagamento', namespaces=self.ns) or '')[:4],
+                'due_date': due_date,
+                'amount': Decimal(amount) if amount else None,
+                'iban': (detail.findtext('IBAN', namespaces=self.ns) or '').replace(' ', '')[:34],
+            })
+        return payments
+
+    def parse_date(self, value):
+        try:
+            return datetime.datetime.strptime(value.strip(), '%Y-%m-%d').date()
+        except (AttributeError, ValueError):
+            return None
+
+    def build_invoice_data(self, general_data, invoice_type, issuer_data, receiver_data, lines, summaries,
+                           payments=None):
+        """
+        Compone il dizionario invoice_data a partire dalle parti estratte;
+        le righe restano LineRecord.
+        """
+        total_amount = general_data['total_amount']
         taxable_amount = Decimal('0')
         vat_amount = Decimal('0')
         
-        for riepilogo in dati_riepilogo:
-            taxable_amount += Decimal(riepilogo.findtext('ImponibileImporto', namespaces=self.ns) or '0')
-            vat_amount += Decimal(riepilogo.findtext('Imposta', namespaces=self.ns) or '0')
+        for taxable, vat in summaries:
+            taxable_amount += taxable
+            vat_amount += vat
         
         # Se non abbiamo trovato dati di riepilogo, calcola dalla somma delle righe
         if taxable_amount == 0:
-            taxable_amount = sum(line['line_total'] for line in lines)
+            taxable_amount = sum(line.line_total for line in lines)
             vat_amount = total_amount - taxable_amount
 
         return {
-            'invoice_number': invoice_number,
+            'invoice_number': general_data['invoice_number'],
             'invoice_type': invoice_type,
-            'issue_date': issue_date,
-            'currency': currency,
+            'issue_date': general_data['issue_date'],
+            'currency': general_data['currency'],
             'issuer': issuer_data,
             'receiver': receiver_data,
             'taxable_amount': taxable_amount,
             'vat_amount': vat_amount,
             'total_amount': total_amount,
             'lines': lines,
+            'payments': payments or [],
             'notes': ''  # Campo vuoto di default
         }
 
@@ -239,6 +609,10 @@ class InvoiceParser:
         """
         Ottiene o crea un'azienda basata sui dati estratti dalla fattura.
         """
+        company = self.cache.get_company(company_data['vat_number'])
+        if company:
+            return company
+
         # Cerca l'azienda per partita IVA
         company = CRMCompany.objects.filter(vat_number=company_data['vat_number']).first()
         
@@ -255,6 +629,7 @@ class InvoiceParser:
                 email=company_data.get('email', ''),
             )
         
+        self.cache.set_company(company_data['vat_number'], company)
         return company
 
     def get_or_create_product(self, product_data, supplier):
@@ -264,18 +639,32 @@ class InvoiceParser:
         name = product_data['name']
         description = product_data.get('description', '')
         external_code = product_data.get('external_code', '')
-        
+
         # Prima cerchiamo tramite ProductAlias per questo fornitore
-        alias = ProductAlias.objects.filter(
-            supplier=supplier,
-            alias_name=name
-        ).first()
-        
-        if alias:
-            return alias.product
+        if self.cache.has_alias(supplier, name):
+            product = self.cache.get_alias_product(supplier, name)
+            if product:
+                return product
+        else:
+            alias = ProductAlias.objects.filter(
+                supplier=supplier,
+                alias_name=name
+            ).select_related('product').first()
+            
+            if alias:
+                self.cache.set_alias_product(supplier, name, alias.product)
+                return alias.product
+
+        # Poi per codice del fornitore o per descrizione equivalente a un alias noto
+        product = self.match_product(supplier, name, external_code, description)
+        if product:
+            return product
         
         # Se non c'è un alias, cerchiamo il prodotto per nome
-        product = Product.objects.filter(name=name).first()
+        if self.cache.has_product(name):
+            product = self.cache.get_product(name)
+        else:
+            product = Product.objects.filter(name=name).first()
         
         if not product:
             # Se non esiste, creiamo un nuovo prodotto
@@ -283,9 +672,17 @@ class InvoiceParser:
                 name=name,
                 description=description
             )
+        self.cache.set_product(name, product)
         
-        # Creiamo un alias per questo prodotto associato al fornitore
+        # Creiamo un alias per questo prodotto associato al fornitore; un
+        # prodotto simile già noto viene solo segnalato nella descrizione
         if external_code or description:
+            suggestion = self.matcher.suggest(supplier, name, external_code)
+            if suggestion is not None and suggestion.product_id != product.pk:
+                description = (
+                    f'{description} (simile a "{suggestion.alias_name}", '
+                    f'prodotto {suggestion.product_id}, {suggestion.confidence:.2f}: da verificare)'
+                )
             ProductAlias.objects.create(
                 product=product,
                 supplier=supplier,
@@ -293,9 +690,40 @@ class InvoiceParser:
                 external_code=external_code,
                 description=description
             )
+            self.cache.set_alias_product(supplier, name, product)
+            self.matcher.add(supplier, product.pk, name, external_code)
         
         return product
 
+    def match_product(self, supplier, name, external_code, description):
+        """
+        Cerca il prodotto con il ProductMatcher: stesso codice esterno o
+        stessa descrizione normalizzata senza codici in conflitto. Le
+        somiglianze per trigrammi non associano mai la riga.
+
+        La variante trovata viene registrata come nuovo alias del prodotto,
+        così le fatture successive la riconoscono con la ricerca esatta.
+        """
+        match = self.matcher.match(supplier, name, external_code)
+        if match is None:
+            return None
+
+        # L'indice può riferirsi a prodotti creati in transazioni annullate
+        product = Product.objects.filter(pk=match.product_id).first()
+        if product is None:
+            return None
+
+        ProductAlias.objects.create(
+            product=product,
+            supplier=supplier,
+            alias_name=name,
+            external_code=external_code,
+            description=f'{description} (riconosciuto da "{match.alias_name}", {match.method} {match.confidence:.2f})'
+        )
+        self.cache.set_alias_product(supplier, name, product)
+        self.matcher.add(supplier, product.pk, name, external_code)
+        return product
+
     def get_or_create_discount(self, discount_data):
         """
         Ottiene o crea uno sconto basato sui dati della fattura.
@@ -303,9 +731,15 @@ class InvoiceParser:
         if not discount_data:
             return None
             
+        percentage = discount_data.percentage
+        discount = self.cache.get_discount(percentage)
+        if discount:
+            return discount
+
         discount, created = Discount.objects.get_or_create(
-            percentage=discount_data['percentage'],
-            defaults={'description': discount_data.get('description', 'Sconto')}
+            percentage=percentage,
+            defaults={'description': discount_data.description}
         )
         
-        return discount
\ No newline at end of file
+        self.cache.set_discount(percentage, discount)
+        return discount
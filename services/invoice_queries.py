@@ -0,0 +1,50 @@
+# billing/services/invoice_queries.py
+from decimal import Decimal
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from django.db.models.functions import Coalesce
+from billing.models.base import Invoice, InvoiceLine
+
+AMOUNT = DecimalField(max_digits=14, decimal_places=2)
+
+
+def invoice_lines_queryset(invoice=None):
+    """
+    Righe fattura (di ``invoice``, se indicata) con prodotto e sconto in
+    join e importi calcolati in SQL:
+
+    - ``gross_amount``: quantità x prezzo unitario (il prezzo per le righe
+      senza quantità, come nella riconciliazione)
+    - ``discount_amount``: sconto applicato all'importo lordo
+    - ``line_vat_amount``: IVA del totale riga all'aliquota della riga
+    """
+    gross = Case(
+        When(quantity=0, then=F('unit_price')),
+        default=F('unit_price') * F('quantity'),
+        output_field=AMOUNT
+    )
+    lines = InvoiceLine.objects.select_related('product', 'discount').annotate(
+        gross_amount=gross,
+        discount_amount=ExpressionWrapper(
+            F('gross_amount') * Coalesce(F('discount__percentage'), Value(Decimal('0'))) * Value(Decimal('0.01')),
+            output_field=AMOUNT
+        ),
+        line_vat_amount=ExpressionWrapper(
+            F('line_total') * F('vat_rate') * Value(Decimal('0.01')),
+            output_field=AMOUNT
+        ),
+    ).order_by('line_number')
+    if invoice is not None:
+        lines = lines.filter(invoice=invoice)
+    return lines
+
+
+def invoice_detail_queryset():
+    """
+    Fatture con emittente e destinatario in join.
+
+    Le righe non vengono precaricate: il dettaglio le riceve come
+    invoice_lines_queryset(invoice), valutato solo se il frammento della
+    tabella non è in cache. In ogni caso bastano due query qualunque sia il
+    numero di righe.
+    """
+    return Invoice.objects.select_related('issuer', 'receiver')
@@ -0,0 +1,64 @@
+# billing/services/invoice_sources.py
+import glob
+import io
+import os
+import zipfile
+
+# Estensioni dei file fattura riconosciuti (XML semplici o firmati CAdES)
+INVOICE_EXTENSIONS = ('.xml', '.p7m')
+
+
+def is_invoice_name(name):
+    return name.lower().endswith(INVOICE_EXTENSIONS)
+
+
+def iter_invoice_files(paths, skip=None):
+    """
+    Restituisce i file fattura contenuti nei percorsi indicati.
+
+    Ogni percorso può essere un file, una cartella (visitata ricorsivamente),
+    un pattern glob oppure un archivio ZIP come quelli prodotti dallo SDI.
+    Gli archivi vengono letti in memoria membro per membro, senza estrarli su
+    disco, e possono contenere a loro volta altri ZIP.
+
+    Args:
+        paths: Elenco di percorsi
+        skip: Funzione opzionale che riceve il nome base del file e restituisce
+            True se va saltato; viene chiamata prima di leggerne il contenuto
+
+    Yields:
+        tuple: (nome, contenuto in bytes)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    yield from _iter_path(os.path.join(root, filename), skip)
+        elif os.path.exists(path):
+            yield from _iter_path(path, skip)
+        else:
+            for match in sorted(glob.glob(path, recursive=True)):
+                if os.path.isfile(match):
+                    yield from _iter_path(match, skip)
+
+
+def _iter_path(path, skip):
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            yield from _iter_zip(archive, path, skip)
+    elif is_invoice_name(path) and not (skip and skip(os.path.basename(path))):
+        with open(path, 'rb') as f:
+            yield path, f.read()
+
+
+def _iter_zip(archive, archive_name, skip):
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = f'{archive_name}/{info.filename}'
+        if info.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(archive.read(info))) as nested:
+                yield from _iter_zip(nested, name, skip)
+        elif is_invoice_name(info.filename) and not (skip and skip(os.path.basename(info.filename))):
+            yield name, archive.read(info)
@@ -0,0 +1,173 @@
+# billing/services/invoice_validation.py
+import datetime
+import io
+import logging
+import threading
+from xml.etree import ElementTree as ET
+from django.conf import settings
+from billing.services.streaming_extractor import local_name
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+# Percorso dello schema XSD FatturaPA v1.2 (con gli schemi importati, es.
+# xmldsig, disponibili in locale). Se non indicato o se lxml non è
+# installato si esegue solo il controllo strutturale.
+XSD_PATH = getattr(settings, 'BILLING_FATTURAPA_XSD', None)
+
+# Errori riportati al massimo per ciascun file
+MAX_ERRORS = 20
+
+ROOT = 'FatturaElettronica'
+HEADER = 'FatturaElettronica/FatturaElettronicaHeader'
+BODY = 'FatturaElettronica/FatturaElettronicaBody'
+
+# Elementi dell'header necessari all'importazione
+REQUIRED_HEADER_PATHS = (
+    f'{HEADER}/CedentePrestatore/DatiAnagrafici/IdFiscaleIVA/IdCodice',
+    f'{HEADER}/CedentePrestatore/DatiAnagrafici/Anagrafica',
+    f'{HEADER}/CedentePrestatore/Sede',
+    f'{HEADER}/CessionarioCommittente/DatiAnagrafici',
+    f'{HEADER}/CessionarioCommittente/Sede',
+)
+
+# Elementi necessari in ogni FatturaElettronicaBody, relativi al body
+REQUIRED_BODY_PATHS = (
+    'DatiGenerali/DatiGeneraliDocumento/Data',
+    'DatiGenerali/DatiGeneraliDocumento/Numero',
+    'DatiBeniServizi',
+)
+
+DATE_PATH = 'DatiGenerali/DatiGeneraliDocumento/Data'
+
+
+class InvoiceValidationError(ValueError):
+    """
+    Il documento non è una fattura FatturaPA importabile.
+
+    ``errors`` è la lista di coppie (percorso, messaggio) delle anomalie.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors[:MAX_ERRORS]
+        details = '; '.join(f'{path}: {message}' if path else message for path, message in self.errors)
+        if len(errors) > MAX_ERRORS:
+            details += f' (e altri {len(errors) - MAX_ERRORS} errori)'
+        super().__init__(details)
+
+
+_schema_lock = threading.Lock()
+_schema = {'loaded': False, 'schema': None}
+
+
+def get_schema():
+    """
+    Schema XSD compilato, caricato alla prima richiesta e riusato da tutte
+    le validazioni del processo; None se non configurato o non caricabile.
+    """
+    with _schema_lock:
+        if not _schema['loaded']:
+            _schema['loaded'] = True
+            if XSD_PATH and etree is not None:
+                try:
+                    _schema['schema'] = etree.XMLSchema(etree.parse(XSD_PATH))
+                except (OSError, etree.XMLSchemaParseError, etree.XMLSyntaxError) as e:
+                    logger.error("Schema FatturaPA non caricabile da %s: %s", XSD_PATH, e)
+            elif XSD_PATH:
+                logger.warning("BILLING_FATTURAPA_XSD impostato ma lxml non è installato: solo controllo strutturale")
+        return _schema['schema']
+
+
+def validate_payload(payload):
+    """
+    Verifica il documento XML prima di estrarne i dati.
+
+    Con lo schema XSD configurato la verifica è completa; altrimenti viene
+    controllata in un'unica passata la presenza degli elementi usati
+    dall'importazione, in ogni body, e il formato della data documento.
+
+    Raises:
+        InvoiceValidationError: con i percorsi degli elementi non validi
+    """
+    schema = get_schema()
+    if schema is not None:
+        validate_schema(schema, payload)
+    else:
+        validate_structure(payload)
+
+
+def validate_schema(schema, payload):
+    parser = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+    try:
+        document = etree.fromstring(bytes(payload), parser)
+    except etree.XMLSyntaxError as e:
+        raise InvoiceValidationError([('', f'XML non valido: {e}')])
+    if not schema.validate(document):
+        raise InvoiceValidationError([
+            (error.path, f'riga {error.line}: {error.message}') for error in schema.error_log
+        ])
+
+
+def validate_structure(payload):
+    errors = []
+    seen = set()
+    stack = []
+    elements = []
+    bodies = 0
+    body_paths = None
+    body_date = None
+
+    try:
+        for event, elem in ET.iterparse(io.BytesIO(payload), events=('start', 'end')):
+            if event == 'start':
+                stack.append(local_name(elem.tag))
+                elements.append(elem)
+                path = '/'.join(stack)
+                if len(stack) == 1 and stack[0] != ROOT:
+                    raise InvoiceValidationError([(stack[0], f'elemento radice atteso {ROOT}')])
+                if path == BODY:
+                    bodies += 1
+                    body_paths, body_date = set(), None
+                elif body_paths is not None and path.startswith(BODY + '/'):
+                    body_paths.add(path[len(BODY) + 1:])
+                else:
+                    seen.add(path)
+                continue
+
+            path = '/'.join(stack)
+            stack.pop()
+            elements.pop()
+            if body_paths is not None and path == f'{BODY}/{DATE_PATH}':
+                body_date = elem.text
+            elif path == BODY:
+                errors.extend(check_body(bodies, body_paths, body_date))
+                body_paths = None
+            # Gli elementi chiusi non servono più: svuotati e staccati dal
+            # padre, l'albero contiene solo il ramo aperto e la memoria non
+            # cresce con il numero di righe
+            elem.clear()
+            if elements:
+                elements[-1].remove(elem)
+    except ET.ParseError as e:
+        raise InvoiceValidationError([('', f'XML non valido: {e}')])
+
+    errors = [(path, 'elemento obbligatorio mancante') for path in REQUIRED_HEADER_PATHS if path not in seen] + errors
+    if not bodies:
+        errors.append((BODY, 'elemento obbligatorio mancante'))
+    if errors:
+        raise InvoiceValidationError(errors)
+
+
+def check_body(index, paths, date):
+    prefix = f'{BODY}[{index}]'
+    errors = [(f'{prefix}/{path}', 'elemento obbligatorio mancante') for path in REQUIRED_BODY_PATHS if path not in paths]
+    if date is not None:
+        try:
+            datetime.datetime.strptime(date.strip(), '%Y-%m-%d')
+        except ValueError:
+            errors.append((f'{prefix}/{DATE_PATH}', f'data non valida "{date.strip()}" (formato atteso AAAA-MM-GG)'))
+    return errors
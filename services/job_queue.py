@@ -0,0 +1,234 @@
+# billing/services/job_queue.py
+import datetime
+import time
+import uuid
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from billing.models.base import ImportJob
+from billing.services.instrumentation import ImportMetrics
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.resolution_cache import ResolutionCache
+
+# Tentativi massimi per job: gli errori imprevisti (database, file non
+# leggibile, worker interrotto) vengono ritentati, quelli del documento no
+MAX_ATTEMPTS = getattr(settings, 'BILLING_IMPORT_MAX_ATTEMPTS', 3)
+
+# Attesa prima di un nuovo tentativo (secondi), moltiplicata per il numero
+# di tentativi già fatti
+RETRY_DELAY = getattr(settings, 'BILLING_IMPORT_RETRY_DELAY', 60)
+
+# Giorni per cui i file dei job in errore restano disponibili per un controllo
+ERROR_FILE_RETENTION_DAYS = getattr(settings, 'BILLING_IMPORT_ERROR_RETENTION_DAYS', 7)
+
+# Secondi fra due pulizie dei file scaduti da parte del worker
+CLEANUP_INTERVAL = 3600
+
+# Stato dell'ImportJob corrispondente a ciascun esito di parse_and_save
+RESULT_STATUS = {
+    'success': 'SUCCESS',
+    'duplicate': 'DUPLICATE',
+    'error': 'ERROR',
+}
+
+
+def enqueue(uploaded_file, batch_id=None):
+    """
+    Salva il file caricato e lo mette in coda per l'importazione.
+
+    Args:
+        uploaded_file: File ricevuto dalla richiesta
+        batch_id: Lotto a cui aggiungere il file; se assente ne viene creato uno
+
+    Returns:
+        ImportJob: il job creato, in stato PENDING
+    """
+    return ImportJob.objects.create(
+        batch_id=batch_id or uuid.uuid4(),
+        file=uploaded_file,
+        filename=uploaded_file.name
+    )
+
+
+def claim_job():
+    """
+    Prende in carico il job in attesa più vecchio, se presente, saltando
+    quelli il cui nuovo tentativo non è ancora previsto.
+
+    Il passaggio a RUNNING è un UPDATE condizionato allo stato PENDING, così
+    più worker possono lavorare sulla stessa coda senza elaborare due volte
+    lo stesso file (anche su database privi di SELECT ... SKIP LOCKED).
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        job = ImportJob.objects.select_for_update(skip_locked=True).filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now),
+            status='PENDING'
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+
+        claimed = ImportJob.objects.filter(pk=job.pk, status='PENDING').update(
+            status='RUNNING',
+            started_at=now,
+            attempts=job.attempts + 1
+        )
+    if not claimed:
+        return None
+
+    job.status = 'RUNNING'
+    job.started_at = now
+    job.attempts += 1
+    return job
+
+
+def process_job(job, parser):
+    """
+    Importa il file del job e ne registra l'esito; tempi e query per fase
+    vengono registrati nel log.
+
+    Un'eccezione imprevista rimette il job in coda con un'attesa crescente
+    finché non si raggiungono MAX_ATTEMPTS tentativi; gli errori del
+    documento (file non valido, XML non leggibile) sono definitivi.
+    """
+    parser.metrics = ImportMetrics()
+    retry = False
+    try:
+        with job.file.open('rb'), parser.metrics.track():
+            # Il file viene allegato alla fattura con il nome originale
+            xml_file = File(job.file.file, name=job.filename)
+            invoice, status, message = parser.parse_and_save(xml_file)
+    except Exception as e:
+        invoice, status, message = None, 'error', f'Errore nel parsing del file {job.filename}: {str(e)}'
+        retry = job.attempts < MAX_ATTEMPTS
+
+    job.message = message
+    job.invoice = invoice
+    job.finished_at = timezone.now()
+    if retry:
+        job.status = 'PENDING'
+        job.next_attempt_at = job.finished_at + datetime.timedelta(seconds=RETRY_DELAY * job.attempts)
+        job.message = f'{message} (tentativo {job.attempts} di {MAX_ATTEMPTS}, nuovo tentativo previsto)'
+    else:
+        job.status = RESULT_STATUS[status]
+        job.next_attempt_at = None
+    job.save(update_fields=['status', 'message', 'invoice', 'finished_at', 'next_attempt_at'])
+    parser.metrics.log(job_id=job.pk, filename=job.filename, status=status, attempt=job.attempts)
+
+    # Il file resta solo per un nuovo tentativo o, per gli errori, fino a
+    # cleanup_error_files
+    if job.status not in ('PENDING', 'ERROR'):
+        job.file.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(file=None)
+    return job
+
+
+def requeue_stale_jobs(timeout=600):
+    """
+    Rimette in coda i job rimasti RUNNING oltre ``timeout`` secondi, ad
+    esempio perché il worker che li elaborava è stato interrotto. Quelli che
+    hanno già esaurito i tentativi (un file che blocca ogni volta il worker)
+    passano in errore.
+    """
+    now = timezone.now()
+    stale = ImportJob.objects.filter(status='RUNNING', started_at__lt=now - datetime.timedelta(seconds=timeout))
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='ERROR',
+        message=f'Elaborazione interrotta per {MAX_ATTEMPTS} volte',
+        finished_at=now
+    )
+    return stale.update(
+        status='PENDING',
+        started_at=None
+    )
+
+
+def cleanup_error_files(days=ERROR_FILE_RETENTION_DAYS):
+    """
+    Elimina i file dei job in errore conclusi da più di ``days`` giorni; i
+    job restano con il loro messaggio.
+
+    Returns:
+        int: numero di file eliminati
+    """
+    limit = timezone.now() - datetime.timedelta(days=days)
+    jobs = ImportJob.objects.filter(status='ERROR', finished_at__lt=limit).exclude(file='').exclude(file__isnull=True)
+    deleted = 0
+    for job in jobs.iterator():
+        job.file.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(file=None)
+        deleted += 1
+    return deleted
+
+
+def run_worker(poll_interval=2.0, once=False, stale_timeout=600):
+    """
+    Ciclo del worker: elabora i job in attesa uno dopo l'altro e attende
+    ``poll_interval`` secondi quando la coda è vuota.
+
+    La cache di risoluzione è condivisa dai file dello stesso lotto e
+    ricreata a ogni cambio di lotto, così un worker in esecuzione da tempo
+    non usa aziende e prodotti non più aggiornati né accumula memoria. I
+    job interrotti vengono rimessi in coda e i file dei job in errore più
+    vecchi di ERROR_FILE_RETENTION_DAYS eliminati, all'avvio e poi a
+    intervalli regolari.
+
+    Args:
+        once: Se True termina appena la coda è vuota
+
+    Returns:
+        int: numero di job elaborati
+    """
+    parser = InvoiceParser(bulk=True, streaming=True)
+    batch_id = None
+    processed = 0
+    last_maintenance = None
+
+    while True:
+        if last_maintenance is None or time.monotonic() - last_maintenance > CLEANUP_INTERVAL:
+            requeue_stale_jobs(stale_timeout)
+            cleanup_error_files()
+            last_maintenance = time.monotonic()
+
+        job = claim_job()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        if job.batch_id != batch_id:
+            parser.cache = ResolutionCache()
+            batch_id = job.batch_id
+        process_job(job, parser)
+        processed += 1
+
+
+def batch_status(batch_id):
+    """
+    Riepilogo dello stato di un lotto di importazione, per il polling della
+    pagina di caricamento.
+    """
+    jobs = list(ImportJob.objects.filter(batch_id=batch_id).order_by('created_at').values(
+        'id', 'filename', 'status', 'message'
+    ))
+    counts = {code.lower(): 0 for code, label in ImportJob.STATUS}
+    for job in jobs:
+        counts[job['status'].lower()] += 1
+
+    return {
+        'batch_id': str(batch_id),
+        'total': len(jobs),
+        'done': counts['pending'] + counts['running'] == 0,
+        'counts': counts,
+        'files': [
+            {
+                'job_id': job['id'],
+                'filename': job['filename'],
+                'status': job['status'].lower(),
+                'message': job['message'],
+            }
+            for job in jobs
+        ],
+    }
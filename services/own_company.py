@@ -0,0 +1,52 @@
+# billing/services/own_company.py
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from crm.models.base import Company
+
+OWN_COMPANY_CACHE_KEY = 'billing:own_company'
+
+# Durata della copia in cache condivisa e di quella locale al processo (secondi).
+# La copia locale ha una durata breve perché l'invalidazione tramite segnali
+# raggiunge solo il processo che ha modificato l'azienda.
+CACHE_TIMEOUT = getattr(settings, 'BILLING_OWN_COMPANY_CACHE_TIMEOUT', 3600)
+LOCAL_TIMEOUT = getattr(settings, 'BILLING_OWN_COMPANY_LOCAL_TIMEOUT', 60)
+
+_lock = threading.Lock()
+_local = {'company': None, 'expires': 0.0}
+
+
+def get_own_company():
+    """
+    Restituisce l'azienda con is_own_company=True (o None se non configurata).
+
+    Il valore viene letto prima dalla copia locale al processo, poi dalla
+    cache condivisa di Django e solo in ultima istanza dal database.
+    """
+    now = time.monotonic()
+    with _lock:
+        if _local['expires'] > now:
+            return _local['company']
+
+    company = cache.get(OWN_COMPANY_CACHE_KEY)
+    if company is None:
+        company = Company.objects.filter(is_own_company=True).first()
+        if company is not None:
+            cache.set(OWN_COMPANY_CACHE_KEY, company, CACHE_TIMEOUT)
+
+    with _lock:
+        _local['company'] = company
+        _local['expires'] = now + LOCAL_TIMEOUT
+    return company
+
+
+def invalidate_own_company(**kwargs):
+    """
+    Svuota entrambe le cache; collegata ai segnali di salvataggio ed
+    eliminazione di Company.
+    """
+    with _lock:
+        _local['company'] = None
+        _local['expires'] = 0.0
+    cache.delete(OWN_COMPANY_CACHE_KEY)
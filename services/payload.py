@@ -0,0 +1,206 @@
+# billing/services/payload.py
+import base64
+import binascii
+import gzip
+import hashlib
+import io
+import zipfile
+from django.conf import settings
+
+# Livelli di imbustamento massimi (es. ZIP -> base64 -> p7m -> XML)
+MAX_DEPTH = 5
+
+# Dimensione massima del contenuto decompresso da ZIP o gzip (byte): oltre
+# questo limite il file viene rifiutato senza leggerne il resto, così un
+# archivio costruito per espandersi a dismisura non esaurisce la memoria
+MAX_UNCOMPRESSED_SIZE = getattr(settings, 'BILLING_MAX_UNCOMPRESSED_SIZE', 50 * 1024 * 1024)
+
+CHUNK_SIZE = 64 * 1024
+
+XML_BOM = b'\xef\xbb\xbf'
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Tag ASN.1/BER usati dalle buste CAdES
+SEQUENCE = 0x30
+CONTEXT_0 = 0xA0
+OCTET_STRING = 0x04
+OCTET_STRING_CONSTRUCTED = 0x24
+
+
+def compute_content_hash(payload):
+    """
+    Restituisce lo SHA-256 esadecimale del documento XML già estratto dalla
+    busta, così che lo stesso documento firmato o in chiaro dia lo stesso hash.
+    """
+    return hashlib.sha256(payload).hexdigest()
+
+
+def unwrap_payload(data):
+    """
+    Estrae il documento XML da un file fattura eventualmente imbustato.
+
+    Riconosce firme CAdES (.p7m) in DER/BER, codifica base64 (anche in
+    formato PEM), archivi ZIP con una sola fattura e compressione gzip,
+    anche annidati fra loro. Tutto avviene in memoria: la busta p7m viene
+    percorsa tramite memoryview e, quando il contenuto firmato è un'unica
+    OCTET STRING, il risultato è una vista sul buffer originale, senza copie.
+
+    Args:
+        data: Contenuto del file (bytes o oggetto buffer)
+
+    Returns:
+        Oggetto bytes-like con il documento XML
+
+    Raises:
+        ValueError: se il formato non è riconosciuto
+    """
+    payload = memoryview(data)
+    for _ in range(MAX_DEPTH):
+        head = bytes(payload[:64]).lstrip()
+        if head.startswith(b'<') or head.startswith(XML_BOM):
+            return payload
+        if head.startswith(ZIP_MAGIC):
+            payload = memoryview(_unzip(payload))
+        elif head.startswith(GZIP_MAGIC):
+            payload = memoryview(_gunzip(payload))
+        elif head[:1] == bytes([SEQUENCE]):
+            payload = _signed_content(payload)
+        else:
+            payload = memoryview(_decode_base64(payload))
+    raise ValueError('Troppi livelli di imbustamento nel file fattura')
+
+
+def _unzip(payload):
+    with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) != 1:
+            raise ValueError(
+                "L'archivio ZIP deve contenere una sola fattura; "
+                "per gli archivi con più fatture usare il comando import_invoices"
+            )
+        member = members[0]
+        if member.file_size > MAX_UNCOMPRESSED_SIZE:
+            raise ValueError(_too_large(member.file_size))
+        # La dimensione dichiarata può essere falsa: la lettura resta comunque limitata
+        with archive.open(member) as stream:
+            return _read_limited(stream)
+
+
+def _gunzip(payload):
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(payload)) as stream:
+            return _read_limited(stream)
+    except (OSError, EOFError) as e:
+        raise ValueError(f'File gzip non valido: {e}')
+
+
+def _read_limited(stream, limit=MAX_UNCOMPRESSED_SIZE):
+    """
+    Legge ``stream`` a blocchi fino a ``limit`` byte.
+
+    Raises:
+        ValueError: se il contenuto supera il limite
+    """
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return buffer.getvalue()
+        if buffer.tell() + len(chunk) > limit:
+            raise ValueError(_too_large())
+        buffer.write(chunk)
+
+
+def _too_large(size=None):
+    declared = f' ({size} byte)' if size is not None else ''
+    return f'Contenuto decompresso troppo grande{declared}: il limite è di {MAX_UNCOMPRESSED_SIZE} byte'
+
+
+def _decode_base64(payload):
+    text = bytes(payload)
+    # Formato PEM: si scartano le righe -----BEGIN/END ...-----
+    if text.lstrip().startswith(b'-----'):
+        text = b''.join(line for line in text.splitlines() if not line.startswith(b'-----'))
+    try:
+        decoded = base64.b64decode(text)
+    except (binascii.Error, ValueError):
+        decoded = b''
+    if not decoded:
+        raise ValueError('Formato del file non riconosciuto: attesi XML, XML.P7M, base64 o ZIP')
+    return decoded
+
+
+def _read_header(buf, pos):
+    """
+    Legge l'intestazione BER in ``pos``.
+
+    Returns:
+        tuple: (tag, inizio del contenuto, lunghezza o None se indefinita)
+    """
+    tag = buf[pos]
+    pos += 1
+    if tag & 0x1F == 0x1F:
+        # Tag in forma estesa
+        while buf[pos] & 0x80:
+            pos += 1
+        pos += 1
+    length = buf[pos]
+    pos += 1
+    if length == 0x80:
+        return tag, pos, None
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(buf[pos:pos + size], 'big')
+        pos += size
+    return tag, pos, length
+
+
+def _element_end(buf, pos):
+    tag, start, length = _read_header(buf, pos)
+    if length is not None:
+        return start + length
+    # Lunghezza indefinita: i figli terminano con la coppia 00 00
+    while buf[start:start + 2] != b'\x00\x00':
+        start = _element_end(buf, start)
+    return start + 2
+
+
+def _children(buf, pos):
+    """
+    Restituisce le posizioni dei figli dell'elemento costruito in ``pos``.
+    """
+    tag, start, length = _read_header(buf, pos)
+    end = start + length if length is not None else None
+    children = []
+    while (start < end) if end is not None else (buf[start:start + 2] != b'\x00\x00'):
+        children.append(start)
+        start = _element_end(buf, start)
+    return children
+
+
+def _octets(buf, pos):
+    tag, start, length = _read_header(buf, pos)
+    if tag == OCTET_STRING:
+        return buf[start:start + length]
+    if tag == OCTET_STRING_CONSTRUCTED:
+        # OCTET STRING spezzata in blocchi (tipica del BER a lunghezza indefinita)
+        return memoryview(b''.join(bytes(_octets(buf, child)) for child in _children(buf, pos)))
+    raise ValueError('Busta p7m non valida: contenuto firmato non trovato')
+
+
+def _signed_content(buf):
+    """
+    Estrae il contenuto firmato da una busta CMS SignedData (CAdES):
+    ContentInfo -> [0] SignedData -> encapContentInfo -> [0] OCTET STRING.
+    """
+    try:
+        content_info = _children(buf, 0)
+        signed_data = _children(buf, _children(buf, content_info[1])[0])
+        # signed_data: version, digestAlgorithms, encapContentInfo, ...
+        encap_content_info = _children(buf, signed_data[2])
+        if len(encap_content_info) < 2 or buf[encap_content_info[1]] != CONTEXT_0:
+            raise ValueError('Busta p7m senza contenuto (firma detached)')
+        return _octets(buf, _children(buf, encap_content_info[1])[0])
+    except IndexError:
+        raise ValueError('Busta p7m non valida o troncata')
@@ -0,0 +1,134 @@
+# billing/services/payment_reports.py
+import datetime
+from decimal import Decimal
+from django.db.models import Count, DecimalField, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+from billing.models.base import Invoice, PaymentInstalment
+from billing.services.render_cache import CUSTOMER_LIST, SUPPLIER_LIST, bump_versions
+
+ZERO = Decimal('0.00')
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+# Fasce di scaduto in giorni (estremi inclusi), l'ultima senza limite superiore
+AGEING_BUCKETS = (
+    ('0_30', 0, 30),
+    ('31_60', 31, 60),
+    ('61_90', 61, 90),
+    ('90_plus', 91, None),
+)
+
+PERIODS = {
+    'month': TruncMonth,
+    'week': TruncWeek,
+}
+
+
+def open_instalments(invoice_type=None):
+    instalments = PaymentInstalment.objects.filter(status='OPEN')
+    if invoice_type:
+        instalments = instalments.filter(invoice_type=invoice_type)
+    return instalments
+
+
+def total(condition=None):
+    return Coalesce(Sum('amount', filter=condition), ZERO, output_field=AMOUNT_FIELD)
+
+
+def ageing_report(invoice_type, as_of=None, company=None):
+    """
+    Scadenzario per controparte delle rate aperte: crediti verso clienti
+    con ``invoice_type='OUT'``, debiti verso fornitori con ``'IN'``.
+
+    Importi a scadere e scaduti per fasce di giorni alla data ``as_of``
+    (oggi se non indicata), calcolati con un'unica query aggregata: ogni
+    fascia è una somma condizionata sulla data di scadenza.
+    """
+    as_of = as_of or datetime.date.today()
+    buckets = {'not_due': total(Q(due_date__gt=as_of))}
+    for name, min_days, max_days in AGEING_BUCKETS:
+        condition = Q(due_date__lte=as_of - datetime.timedelta(days=min_days))
+        if max_days is not None:
+            condition &= Q(due_date__gte=as_of - datetime.timedelta(days=max_days))
+        buckets[name] = total(condition)
+
+    instalments = open_instalments(invoice_type)
+    if company is not None:
+        instalments = instalments.filter(company=company)
+    return list(
+        instalments.values('company_id', 'company__name')
+        .annotate(**buckets, total=total())
+        .order_by('-total', 'company__name')
+    )
+
+
+def cash_flow_forecast(date_from=None, date_to=None, period='month', as_of=None):
+    """
+    Previsione di cassa sulle rate aperte, per mese o settimana di scadenza.
+
+    Gli incassi sono le rate delle fatture di vendita, i pagamenti quelle
+    delle fatture di acquisto. Le rate scadute prima di ``as_of`` (oggi se
+    non indicata) e non ancora pagate sono riportate a parte in
+    ``overdue``, perché non ricadono in nessun periodo futuro.
+
+    Returns:
+        dict: ``overdue`` e ``periods``, ciascuno con inflow, outflow e net
+    """
+    as_of = as_of or datetime.date.today()
+    trunc = PERIODS.get(period, TruncMonth)
+    amounts = {
+        'inflow': total(Q(invoice_type='OUT')),
+        'outflow': total(Q(invoice_type='IN')),
+    }
+
+    instalments = open_instalments()
+    overdue = instalments.filter(due_date__lt=as_of).aggregate(**amounts)
+
+    upcoming = instalments.filter(due_date__gte=max(date_from, as_of) if date_from else as_of)
+    if date_to:
+        upcoming = upcoming.filter(due_date__lte=date_to)
+    periods = (
+        upcoming.annotate(period=trunc('due_date'))
+        .values('period')
+        .annotate(**amounts)
+        .order_by('period')
+    )
+
+    return {
+        'overdue': dict(overdue, net=overdue['inflow'] - overdue['outflow']),
+        'periods': [
+            dict(row, period=as_date(row['period']), net=row['inflow'] - row['outflow'])
+            for row in periods
+        ],
+    }
+
+
+def as_date(value):
+    # TruncWeek su un DateField restituisce una data, ma alcuni backend un datetime
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def refresh_payment_status(invoice_ids):
+    """
+    Allinea ``Invoice.payment_status`` allo stato delle rate delle fatture
+    indicate: pagata se tutte le rate lo sono, parziale se solo alcune.
+
+    L'aggiornamento avviene con ``update()``, senza passare dai segnali di
+    Invoice che a loro volta modificherebbero le rate.
+    """
+    counts = (
+        PaymentInstalment.objects.filter(invoice_id__in=invoice_ids)
+        .values('invoice_id')
+        .annotate(open=Count('id', filter=Q(status='OPEN')), paid=Count('id', filter=Q(status='PAID')))
+    )
+    changed = set()
+    for row in counts:
+        if not row['paid']:
+            status = 'UNPAID'
+        elif not row['open']:
+            status = 'PAID'
+        else:
+            status = 'PARTIAL'
+        if Invoice.objects.filter(pk=row['invoice_id']).exclude(payment_status=status).update(payment_status=status):
+            changed.add(row['invoice_id'])
+    if changed:
+        bump_versions({SUPPLIER_LIST, CUSTOMER_LIST}, changed)
@@ -0,0 +1,148 @@
+# billing/services/product_codes.py
+import logging
+import re
+import threading
+import time
+from django.conf import settings
+from billing.models.base import ProductCodeRule
+from billing.services.resolution_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Fornitori di cui tenere in memoria le regole compilate
+MAX_SUPPLIERS = getattr(settings, 'BILLING_PRODUCT_CODE_RULES_SUPPLIERS', 500)
+
+# Secondi dopo i quali le regole di un fornitore vengono rilette, per
+# recepire le modifiche fatte da altri processi
+RULES_TIMEOUT = getattr(settings, 'BILLING_PRODUCT_CODE_RULES_TIMEOUT', 300)
+
+# Lunghezza massima di external_product_code
+MAX_CODE_LENGTH = 50
+
+# Provenienza del codice articolo di una riga: solo i codici del documento e
+# delle regole del fornitore identificano il prodotto, quello ricavato dalla
+# prima parola della descrizione serve solo a essere mostrato sulla riga
+CODE_FROM_ARTICLE = 'article'
+CODE_FROM_RULE = 'rule'
+CODE_FROM_DESCRIPTION = 'description'
+TRUSTED_CODE_SOURCES = (CODE_FROM_ARTICLE, CODE_FROM_RULE)
+
+# Tipi di CodiceArticolo in ordine di preferenza: il codice interno del
+# fornitore è quello che identifica l'articolo nelle sue fatture; gli altri
+# tipi (EAN, SSC, TARIC, ...) seguono nell'ordine del documento
+PREFERRED_CODE_TYPES = ('INTERNO', 'CODICE FORNITORE', 'COD. FORNITORE', 'CODICE ARTICOLO', 'FORNITORE')
+
+
+def select_article_code(codes):
+    """
+    Sceglie il codice fra le coppie (CodiceTipo, CodiceValore) di una riga.
+    """
+    codes = [(kind.strip().upper(), value.strip()) for kind, value in codes if value and value.strip()]
+    if not codes:
+        return ''
+    for preferred in PREFERRED_CODE_TYPES:
+        for kind, value in codes:
+            if kind == preferred:
+                return value[:MAX_CODE_LENGTH]
+    return codes[0][1][:MAX_CODE_LENGTH]
+
+
+def description_code(description):
+    """
+    Ultima risorsa per le righe senza CodiceArticolo né regole applicabili:
+    la prima parola della descrizione, se interamente in maiuscolo (es.
+    "ART123 Vite zincata"), come faceva l'importazione prima delle regole.
+
+    È una stima ("KIT viti" e "KIT rondelle" darebbero lo stesso codice):
+    va mostrata sulla riga ma non usata per riconoscere il prodotto.
+    """
+    if description and ' ' in description:
+        potential_code = description.split(' ')[0]
+        if potential_code.isupper():
+            return potential_code[:MAX_CODE_LENGTH]
+    return ''
+
+
+class CompiledRule:
+    __slots__ = ('pattern', 'regex')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+
+    def extract(self, description):
+        match = self.regex.search(description)
+        if match is None:
+            return ''
+        if 'code' in self.regex.groupindex:
+            code = match.group('code')
+        elif self.regex.groups:
+            code = match.group(1)
+        else:
+            code = match.group(0)
+        return (code or '').strip()[:MAX_CODE_LENGTH]
+
+
+class ProductCodeRules:
+    """
+    Regole ProductCodeRule compilate, per fornitore.
+
+    Le regole attive di un fornitore vengono lette con una query e compilate
+    alla prima richiesta, poi tenute in un LRU fino a ``timeout`` secondi o
+    fino a ``invalidate``, chiamato dai segnali di ProductCodeRule. Le regole
+    non compilabili vengono scartate con un avviso nel log.
+    """
+
+    def __init__(self, max_suppliers=MAX_SUPPLIERS, timeout=RULES_TIMEOUT):
+        self.rules = LRUCache(max_suppliers)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def invalidate(self, supplier_id=None):
+        with self._lock:
+            if supplier_id is None:
+                self.rules.clear()
+            else:
+                self.rules.set(supplier_id, None)
+
+    def rules_for(self, supplier):
+        with self._lock:
+            cached = self.rules.get(supplier.pk)
+        if cached is not None and time.monotonic() - cached[0] <= self.timeout:
+            return cached[1]
+
+        compiled = []
+        patterns = ProductCodeRule.objects.filter(supplier=supplier, is_active=True).order_by(
+            'priority', 'id'
+        ).values_list('pattern', flat=True)
+        for pattern in patterns:
+            try:
+                compiled.append(CompiledRule(pattern))
+            except re.error as e:
+                logger.warning("Regola codice articolo non valida per %s: %r (%s)", supplier, pattern, e)
+        with self._lock:
+            self.rules.set(supplier.pk, (time.monotonic(), compiled))
+        return compiled
+
+    def extract(self, supplier, description):
+        """
+        Codice articolo ricavato dalla descrizione con la prima regola del
+        fornitore che trova una corrispondenza; in mancanza, con
+        description_code.
+
+        Returns:
+            tuple: (codice, provenienza) con provenienza CODE_FROM_RULE o
+                CODE_FROM_DESCRIPTION; ('', '') se non c'è alcun codice
+        """
+        if not description:
+            return '', ''
+        for rule in self.rules_for(supplier):
+            code = rule.extract(description)
+            if code:
+                return code, CODE_FROM_RULE
+        code = description_code(description)
+        return (code, CODE_FROM_DESCRIPTION) if code else ('', '')
+
+
+# Regole condivise da tutti i parser del processo
+default_code_rules = ProductCodeRules()
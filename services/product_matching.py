@@ -0,0 +1,276 @@
+# billing/services/product_matching.py
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from warehouse.models.base import ProductAlias
+from billing.services.resolution_cache import LRUCache
+
+# Somiglianza minima (indice di Jaccard sui trigrammi) per proporre una
+# corrispondenza approssimata; i suggerimenti non vengono mai applicati
+# automaticamente
+MATCH_THRESHOLD = getattr(settings, 'BILLING_PRODUCT_MATCH_THRESHOLD', 0.8)
+
+# Fornitori di cui tenere in memoria l'indice degli alias
+MAX_SUPPLIERS = getattr(settings, 'BILLING_PRODUCT_INDEX_SUPPLIERS', 50)
+
+# Secondi dopo i quali l'indice di un fornitore viene ricostruito, per
+# includere gli alias creati da altri processi
+INDEX_TIMEOUT = getattr(settings, 'BILLING_PRODUCT_INDEX_TIMEOUT', 600)
+
+# Riferimenti di lotto, scadenza e date che variano fra una fattura e l'altra
+# senza cambiare il prodotto
+VOLATILE_PATTERNS = re.compile(
+    r'\b(?:(?:lotto|lot|batch|scadenza|scad|exp)\b\.?|l\.)\s*(?:nr?\.?|:|°)?\s*[\w/-]+'
+    r'|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b',
+    re.IGNORECASE
+)
+# Quantità con unità di misura scritte con o senza spazio (50 ml / 50ml)
+MEASURE = re.compile(r'(\d)\s+(mm|cm|m|ml|cl|l|g|gr|kg|pz|mt)\b')
+NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+NUMBERS = re.compile(r'\d+')
+
+
+def normalize_description(text):
+    """
+    Forma canonica di una descrizione: minuscole, senza accenti, punteggiatura,
+    spazi ripetuti, riferimenti di lotto/scadenza e date.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = VOLATILE_PATTERNS.sub(' ', text.lower())
+    text = NON_ALPHANUMERIC.sub(' ', text).strip()
+    return MEASURE.sub(r'\1\2', text)
+
+
+def normalize_code(code):
+    return NON_ALPHANUMERIC.sub('', (code or '').lower())
+
+
+def numeric_tokens(normalized):
+    """
+    Numeri di una descrizione normalizzata (misure, formati, varianti): due
+    descrizioni con numeri diversi non indicano mai lo stesso prodotto.
+    """
+    return tuple(sorted(NUMBERS.findall(normalized)))
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Match:
+    """Prodotto individuato per una descrizione, con confidenza da 0 a 1"""
+    __slots__ = ('product_id', 'confidence', 'method', 'alias_name')
+
+    def __init__(self, product_id, confidence, method, alias_name):
+        self.product_id = product_id
+        self.confidence = confidence
+        self.method = method
+        self.alias_name = alias_name
+
+    def __repr__(self):
+        return f'Match({self.product_id}, {self.confidence:.2f}, {self.method})'
+
+
+class SupplierIndex:
+    """
+    Indice in memoria degli alias di un fornitore: codice esterno, nome
+    normalizzato e indice invertito dei trigrammi per la ricerca approssimata.
+
+    Ogni posizione è una coppia distinta (nome normalizzato, codice), così
+    alias con la stessa descrizione ma codici diversi restano distinguibili;
+    i codici noti di ciascun prodotto escludono le righe con un codice
+    diverso. Anche a parità di codice i numeri della descrizione devono
+    coincidere.
+    """
+
+    def __init__(self):
+        self.built_at = time.monotonic()
+        self.by_code = {}
+        self.by_name = defaultdict(list)
+        self.seen = set()
+        self.names = []
+        self.products = []
+        self.product_codes = defaultdict(set)
+        self.numbers = []
+        self.sizes = []
+        self.postings = defaultdict(list)
+
+    def add(self, product_id, alias_name, external_code=''):
+        code = normalize_code(external_code)
+        name = normalize_description(alias_name)
+        if code:
+            self.by_code.setdefault(code, (product_id, alias_name, numeric_tokens(name)))
+            self.product_codes[product_id].add(code)
+
+        if not name or (name, code) in self.seen:
+            return
+        self.seen.add((name, code))
+
+        position = len(self.names)
+        grams = trigrams(name)
+        self.by_name[name].append(position)
+        self.names.append(alias_name)
+        self.products.append(product_id)
+        self.numbers.append(numeric_tokens(name))
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(position)
+
+    def compatible(self, position, code):
+        # Un codice presente sulla riga e diverso da quelli noti del prodotto
+        # esclude il prodotto, anche tramite i suoi alias senza codice
+        codes = self.product_codes.get(self.products[position])
+        return not code or not codes or code in codes
+
+    def match(self, name, external_code=''):
+        """
+        Corrispondenza certa: stesso codice esterno e stessi numeri nella
+        descrizione, oppure stessa descrizione normalizzata con un codice
+        compatibile.
+        """
+        code = normalize_code(external_code)
+        normalized = normalize_description(name)
+        if code and code in self.by_code:
+            product_id, alias_name, numbers = self.by_code[code]
+            if numbers == numeric_tokens(normalized):
+                return Match(product_id, 1.0, 'code', alias_name)
+
+        for position in self.by_name.get(normalized, ()) if normalized else ():
+            if self.compatible(position, code):
+                return Match(self.products[position], 1.0, 'name', self.names[position])
+        return None
+
+    def suggest(self, name, external_code='', threshold=MATCH_THRESHOLD):
+        """
+        Alias più simile per trigrammi, con codice compatibile e gli stessi
+        numeri nella descrizione; solo un suggerimento da verificare.
+        """
+        code = normalize_code(external_code)
+        normalized = normalize_description(name)
+        if not normalized:
+            return None
+        numbers = numeric_tokens(normalized)
+
+        # Un alias con somiglianza >= soglia condivide almeno min_shared
+        # trigrammi con la ricerca, quindi almeno uno fra i query_size -
+        # min_shared + 1 più rari: i candidati vengono presi solo dalle liste
+        # di questi e verificati sulle altre, ordinate, con ricerca binaria
+        grams = sorted(trigrams(normalized), key=lambda gram: len(self.postings.get(gram, ())))
+        query_size = len(grams)
+        min_shared = math.ceil(threshold * query_size)
+        prefix = query_size - min_shared + 1
+
+        shared = defaultdict(int)
+        for gram in grams[:prefix]:
+            for position in self.postings.get(gram, ()):
+                shared[position] += 1
+
+        # Scarta gli alias troppo corti o troppo lunghi per raggiungere la
+        # soglia, con numeri diversi o con un codice diverso
+        low, high = threshold * query_size, query_size / threshold if threshold else math.inf
+        shared = {
+            position: count for position, count in shared.items()
+            if low <= self.sizes[position] <= high
+            and self.numbers[position] == numbers and self.compatible(position, code)
+        }
+
+        for gram in grams[prefix:]:
+            posting = self.postings.get(gram)
+            if not posting:
+                continue
+            if len(posting) <= len(shared) * 4:
+                # Lista corta rispetto ai candidati: conviene scorrerla
+                for position in posting:
+                    if position in shared:
+                        shared[position] += 1
+                continue
+            for position in shared:
+                index = bisect_left(posting, position)
+                if index < len(posting) and posting[index] == position:
+                    shared[position] += 1
+
+        best, best_score = None, 0.0
+        for position, count in shared.items():
+            score = count / (query_size + self.sizes[position] - count)
+            # A parità di punteggio vince l'alias più vecchio
+            if score >= threshold and (best is None or (score, -position) > (best_score, -best)):
+                best, best_score = position, score
+        if best is None:
+            return None
+        return Match(self.products[best], best_score, 'trigram', self.names[best])
+
+
+class ProductMatcher:
+    """
+    Ricerca dei prodotti a partire da descrizione e codice del fornitore.
+
+    Gli indici vengono costruiti alla prima richiesta per ciascun fornitore
+    con una sola query sui suoi alias e mantenuti in un LRU limitato a
+    ``max_suppliers`` fornitori per ``timeout`` secondi; gli alias creati
+    durante l'importazione vengono aggiunti con ``add``.
+    """
+
+    def __init__(self, max_suppliers=MAX_SUPPLIERS, threshold=MATCH_THRESHOLD, timeout=INDEX_TIMEOUT):
+        self.indexes = LRUCache(max_suppliers)
+        self.threshold = threshold
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.indexes.clear()
+
+    def invalidate(self, supplier):
+        """
+        Scarta l'indice del fornitore, ricostruito alla richiesta successiva:
+        serve quando una transazione annullata ha aggiunto alias mai salvati.
+        """
+        with self._lock:
+            self.indexes.pop(supplier.pk)
+
+    def index_for(self, supplier):
+        with self._lock:
+            index = self.indexes.get(supplier.pk)
+        if index is None or time.monotonic() - index.built_at > self.timeout:
+            index = SupplierIndex()
+            aliases = ProductAlias.objects.filter(supplier=supplier).order_by('pk').values_list(
+                'product_id', 'alias_name', 'external_code'
+            )
+            for product_id, alias_name, external_code in aliases.iterator(chunk_size=5000):
+                index.add(product_id, alias_name, external_code)
+            with self._lock:
+                self.indexes.set(supplier.pk, index)
+        return index
+
+    def match(self, supplier, name, external_code=''):
+        """
+        Restituisce il Match certo per il fornitore, o None: stesso codice
+        esterno con gli stessi numeri nella descrizione, o stessa
+        descrizione normalizzata senza codici in conflitto.
+        """
+        return self.index_for(supplier).match(name, external_code)
+
+    def suggest(self, supplier, name, external_code=''):
+        """
+        Restituisce il prodotto più simile per trigrammi, o None. Il
+        suggerimento va confermato da un operatore e non viene mai usato
+        per associare la riga.
+        """
+        return self.index_for(supplier).suggest(name, external_code, self.threshold)
+
+    def add(self, supplier, product_id, alias_name, external_code=''):
+        with self._lock:
+            index = self.indexes.get(supplier.pk)
+        if index is not None:
+            index.add(product_id, alias_name, external_code)
+
+
+# Indici condivisi da tutti i parser del processo
+default_matcher = ProductMatcher()
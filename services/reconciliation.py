@@ -0,0 +1,147 @@
+# billing/services/reconciliation.py
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from billing.models.base import InvoiceLine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Differenza massima tollerata per gli arrotondamenti
+DEFAULT_TOLERANCE = Decimal(str(getattr(settings, 'BILLING_RECONCILIATION_TOLERANCE', '0.01')))
+
+# Fatture verificate per ogni blocco letto dal database
+BATCH_SIZE = getattr(settings, 'BILLING_RECONCILIATION_BATCH_SIZE', 5000)
+
+CENT = Decimal('0.01')
+
+CHECKS = {
+    'line_total': 'Totale riga diverso da quantità x prezzo al netto dello sconto',
+    'taxable': 'Imponibile diverso dalla somma delle righe',
+    'vat': "IVA diversa da quella calcolata per aliquota",
+    'total': 'Totale documento diverso da imponibile + IVA',
+}
+
+
+def reconcile_invoices(invoices, tolerance=DEFAULT_TOLERANCE, batch_size=BATCH_SIZE):
+    """
+    Verifica la coerenza fra righe, riepiloghi e totali delle fatture.
+
+    Per ogni fattura vengono ricalcolati totale di ogni riga (quantità x
+    prezzo unitario al netto dello sconto), imponibile e IVA per aliquota
+    (arrotondata per aliquota come nei DatiRiepilogo) e totale documento, e
+    confrontati con i valori memorizzati. Fatture e righe vengono lette per
+    colonne con values_list a blocchi di ``batch_size`` fatture; i calcoli
+    sono vettoriali con NumPy se installato, altrimenti in Decimal.
+
+    Args:
+        invoices: QuerySet delle fatture da verificare
+        tolerance: Differenza oltre la quale un valore è segnalato
+
+    Returns:
+        dict: {'checked': fatture verificate, 'lines': righe verificate,
+            'issues': lista delle anomalie}
+    """
+    reconcile = _reconcile_numpy if np is not None else _reconcile_python
+    result = {'checked': 0, 'lines': 0, 'issues': []}
+
+    columns = ('id', 'invoice_number', 'taxable_amount', 'vat_amount', 'total_amount')
+    last_id = 0
+    while True:
+        batch = list(invoices.filter(id__gt=last_id).order_by('id').values_list(*columns)[:batch_size])
+        if not batch:
+            return result
+
+        # Le righe vengono selezionate con una sottoquery sullo stesso blocco
+        block = invoices.filter(id__gt=last_id, id__lte=batch[-1][0]).values('id')
+        last_id = batch[-1][0]
+        lines = list(InvoiceLine.objects.filter(invoice__in=block).values_list(
+            'invoice_id', 'line_number', 'quantity', 'unit_price', 'discount__percentage',
+            'vat_rate', 'line_total'
+        ))
+
+        result['checked'] += len(batch)
+        result['lines'] += len(lines)
+        result['issues'].extend(reconcile(batch, lines, tolerance))
+
+
+def make_issue(invoice, check, expected, actual, line_number=None):
+    return {
+        'invoice_id': invoice[0],
+        'invoice_number': invoice[1],
+        'check': check,
+        'message': CHECKS[check],
+        'line_number': line_number,
+        'expected': Decimal(str(expected)).quantize(CENT, ROUND_HALF_UP),
+        'actual': Decimal(str(actual)).quantize(CENT, ROUND_HALF_UP),
+    }
+
+
+def _reconcile_numpy(invoices, lines, tolerance):
+    tolerance = float(tolerance)
+    issues = []
+    position = {row[0]: index for index, row in enumerate(invoices)}
+    stored = np.array([row[2:] for row in invoices], dtype=float).reshape(-1, 3)
+    invoice_count = len(invoices)
+
+    if lines:
+        invoice_index = np.fromiter((position[line[0]] for line in lines), dtype=np.int64, count=len(lines))
+        quantity = np.array([line[2] for line in lines], dtype=float)
+        unit_price = np.array([line[3] for line in lines], dtype=float)
+        discount = np.array([line[4] or 0 for line in lines], dtype=float)
+        vat_rate = np.array([line[5] for line in lines], dtype=float)
+        line_total = np.array([line[6] for line in lines], dtype=float)
+
+        # Le righe senza quantità (es. servizi) valgono il prezzo unitario
+        computed = np.where(quantity != 0, quantity, 1.0) * unit_price * (1 - discount / 100)
+        for i in np.flatnonzero(np.abs(computed - line_total) > tolerance):
+            issues.append(make_issue(invoices[invoice_index[i]], 'line_total', computed[i], line_total[i], lines[i][1]))
+
+        # Imponibile e IVA per coppia (fattura, aliquota); l'IVA è arrotondata per aliquota
+        rates, rate_index = np.unique(vat_rate, return_inverse=True)
+        group = invoice_index * len(rates) + rate_index
+        taxable_by_rate = np.bincount(group, weights=line_total, minlength=invoice_count * len(rates))
+        vat_by_rate = np.round(taxable_by_rate * np.tile(rates, invoice_count) / 100, 2)
+        taxable = taxable_by_rate.reshape(invoice_count, len(rates)).sum(axis=1)
+        vat = vat_by_rate.reshape(invoice_count, len(rates)).sum(axis=1)
+        has_lines = np.bincount(invoice_index, minlength=invoice_count) > 0
+    else:
+        taxable = vat = np.zeros(invoice_count)
+        has_lines = np.zeros(invoice_count, dtype=bool)
+
+    # Senza righe non c'è nulla da confrontare con imponibile e IVA
+    for i in np.flatnonzero(has_lines & (np.abs(taxable - stored[:, 0]) > tolerance)):
+        issues.append(make_issue(invoices[i], 'taxable', taxable[i], stored[i, 0]))
+    for i in np.flatnonzero(has_lines & (np.abs(vat - stored[:, 1]) > tolerance)):
+        issues.append(make_issue(invoices[i], 'vat', vat[i], stored[i, 1]))
+    for i in np.flatnonzero(np.abs(stored[:, 0] + stored[:, 1] - stored[:, 2]) > tolerance):
+        issues.append(make_issue(invoices[i], 'total', stored[i, 0] + stored[i, 1], stored[i, 2]))
+    return issues
+
+
+def _reconcile_python(invoices, lines, tolerance):
+    issues = []
+    by_id = {row[0]: row for row in invoices}
+    taxable_by_rate = defaultdict(lambda: defaultdict(Decimal))
+
+    for invoice_id, line_number, quantity, unit_price, discount, vat_rate, line_total in lines:
+        computed = (quantity or 1) * unit_price * (1 - (discount or Decimal('0')) / 100)
+        if abs(computed - line_total) > tolerance:
+            issues.append(make_issue(by_id[invoice_id], 'line_total', computed, line_total, line_number))
+        taxable_by_rate[invoice_id][vat_rate] += line_total
+
+    for invoice in invoices:
+        invoice_id, number, taxable_amount, vat_amount, total_amount = invoice
+        rates = taxable_by_rate.get(invoice_id)
+        if rates:
+            taxable = sum(rates.values())
+            vat = sum((amount * rate / 100).quantize(CENT, ROUND_HALF_UP) for rate, amount in rates.items())
+            if abs(taxable - taxable_amount) > tolerance:
+                issues.append(make_issue(invoice, 'taxable', taxable, taxable_amount))
+            if abs(vat - vat_amount) > tolerance:
+                issues.append(make_issue(invoice, 'vat', vat, vat_amount))
+        if abs(taxable_amount + vat_amount - total_amount) > tolerance:
+            issues.append(make_issue(invoice, 'total', taxable_amount + vat_amount, total_amount))
+    return issues
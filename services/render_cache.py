@@ -0,0 +1,94 @@
+# billing/services/render_cache.py
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from billing.services.own_company import get_own_company
+
+# Durata dei frammenti e delle risposte in cache (secondi); le chiavi
+# contengono la versione, quindi la durata serve solo a liberare spazio
+RENDER_CACHE_TIMEOUT = getattr(settings, 'BILLING_RENDER_CACHE_TIMEOUT', 3600)
+
+LIST_VERSION_KEY = 'billing:list:{}:version'
+INVOICE_VERSION_KEY = 'billing:invoice:{}:version'
+
+# Liste fatture: quella dei fornitori contiene le fatture ricevute dalla
+# nostra azienda, quella dei clienti le fatture emesse
+SUPPLIER_LIST = 'supplier'
+CUSTOMER_LIST = 'customer'
+
+# Versioni da incrementare al commit della transazione corrente, per thread
+_pending = threading.local()
+
+
+def get_version(key):
+    """
+    Versione corrente di una chiave; se manca (mai scritta o rimossa dalla
+    cache) ne viene creata una nuova, diversa da tutte le precedenti.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def list_version(name):
+    return get_version(LIST_VERSION_KEY.format(name))
+
+
+def invoice_version(invoice_id):
+    return get_version(INVOICE_VERSION_KEY.format(invoice_id))
+
+
+def invoice_lists(issuer_id, receiver_id):
+    """
+    Liste in cui compare una fattura con le parti indicate.
+    """
+    own_company = get_own_company()
+    own_id = own_company.pk if own_company is not None else None
+    lists = set()
+    if receiver_id == own_id:
+        lists.add(SUPPLIER_LIST)
+    if issuer_id == own_id:
+        lists.add(CUSTOMER_LIST)
+    return lists
+
+
+def bump_versions(lists=(), invoice_ids=()):
+    """
+    Invalida le liste e le fatture indicate al commit della transazione
+    corrente (subito se non ce n'è una attiva).
+
+    Le versioni vengono sostituite con un nuovo valore: i frammenti con la
+    versione precedente non vengono più letti e scadono da soli. Più
+    modifiche nella stessa transazione producono una sola scrittura per
+    chiave.
+    """
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    _pending.keys.update(LIST_VERSION_KEY.format(name) for name in lists)
+    _pending.keys.update(INVOICE_VERSION_KEY.format(invoice_id) for invoice_id in invoice_ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    keys = getattr(_pending, 'keys', set())
+    if not keys:
+        return
+    _pending.keys = set()
+    version = time.time_ns()
+    cache.set_many({key: version for key in keys}, None)
+
+
+def list_cache_key(name, params, exclude=('draw', '_')):
+    """
+    Chiave della risposta di una lista per i parametri della richiesta,
+    esclusi quelli che non cambiano i dati (contatore di DataTables e
+    parametro anti-cache di jQuery).
+    """
+    items = sorted((key, value) for key, values in params.lists() if key not in exclude for value in values)
+    digest = hashlib.sha256(repr(items).encode('utf-8')).hexdigest()[:32]
+    return f'billing:list:{name}:{list_version(name)}:{digest}'
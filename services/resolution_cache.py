@@ -0,0 +1,139 @@
+# billing/services/resolution_cache.py
+from collections import OrderedDict
+from warehouse.models.base import Product, ProductAlias
+
+
+class LRUCache:
+    """
+    Dizionario a dimensione limitata: oltre ``maxsize`` elementi viene
+    scartata la chiave usata meno di recente.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
+class ResolutionCache:
+    """
+    Cache di risoluzione condivisa da InvoiceParser su un intero lotto di file.
+
+    Tiene in memoria aziende (per partita IVA), alias prodotto (per fornitore e
+    nome), prodotti (per nome) e sconti (per percentuale), così che le chiavi
+    ripetute all'interno di una fattura o tra fatture dello stesso lotto non
+    tornino sul database. Ogni sezione è un LRU limitato a ``maxsize`` voci.
+
+    Per alias e prodotti viene memorizzata anche l'assenza (valore ``None``):
+    ``has_alias``/``has_product`` distinguono "non presente in cache" da
+    "non presente nel database".
+    """
+
+    def __init__(self, maxsize=10000):
+        self.companies = LRUCache(maxsize)
+        self.aliases = LRUCache(maxsize)
+        self.products = LRUCache(maxsize)
+        self.discounts = LRUCache(maxsize)
+
+    def clear(self):
+        """
+        Svuota tutte le sezioni, ad esempio dopo il rollback di una transazione
+        che potrebbe aver annullato oggetti già messi in cache.
+        """
+        self.companies.clear()
+        self.aliases.clear()
+        self.products.clear()
+        self.discounts.clear()
+
+    # Aziende
+
+    def get_company(self, vat_number):
+        return self.companies.get(vat_number)
+
+    def set_company(self, vat_number, company):
+        self.companies.set(vat_number, company)
+
+    # Prodotti e alias
+
+    def has_alias(self, supplier, name):
+        return (supplier.pk, name) in self.aliases
+
+    def get_alias_product(self, supplier, name):
+        return self.aliases.get((supplier.pk, name))
+
+    def set_alias_product(self, supplier, name, product):
+        self.aliases.set((supplier.pk, name), product)
+
+    def has_product(self, name):
+        return name in self.products
+
+    def get_product(self, name):
+        return self.products.get(name)
+
+    def set_product(self, name, product):
+        self.products.set(name, product)
+
+    def preload_products(self, supplier, names):
+        """
+        Precarica con una query ``IN`` gli alias del fornitore e i prodotti per
+        nome relativi ai nomi indicati, saltando quelli già in cache.
+        """
+        missing = {name for name in names if not self.has_alias(supplier, name)}
+        if not missing:
+            return
+
+        aliases = ProductAlias.objects.filter(
+            supplier=supplier,
+            alias_name__in=missing
+        ).select_related('product').order_by('pk')
+        found = set()
+        for alias in aliases:
+            # Come nella ricerca puntuale, vince il primo alias trovato
+            if alias.alias_name not in found:
+                self.set_alias_product(supplier, alias.alias_name, alias.product)
+                found.add(alias.alias_name)
+
+        missing -= found
+        for name in missing:
+            self.set_alias_product(supplier, name, None)
+
+        missing = {name for name in missing if not self.has_product(name)}
+        if missing:
+            for product in Product.objects.filter(name__in=missing).order_by('pk'):
+                if product.name in missing:
+                    self.set_product(product.name, product)
+                    missing.discard(product.name)
+            for name in missing:
+                self.set_product(name, None)
+
+    # Sconti
+
+    def get_discount(self, percentage):
+        return self.discounts.get(percentage)
+
+    def set_discount(self, percentage, discount):
+        self.discounts.set(percentage, discount)
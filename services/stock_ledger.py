@@ -0,0 +1,247 @@
+# billing/services/stock_ledger.py
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from billing.models.base import StockBalance, StockMovement
+from warehouse.models.base import Product
+
+# Con True i saldi non vengono aggiornati al termine di ogni transazione ma
+# solo dal comando refresh_stock_balances (es. da cron durante le importazioni)
+DEFER_REFRESH = getattr(settings, 'BILLING_DEFER_STOCK_REFRESH', False)
+
+# Movimenti applicati ai saldi per ogni transazione di aggiornamento
+REFRESH_BATCH_SIZE = getattr(settings, 'BILLING_STOCK_REFRESH_BATCH_SIZE', 5000)
+
+# Prodotti con movimenti inseriti nella transazione corrente, per thread
+_pending = threading.local()
+
+
+def signed_quantity(invoice_type, quantity):
+    """
+    Le fatture passive (IN) caricano il magazzino, quelle attive lo scaricano.
+    """
+    return quantity if invoice_type == 'IN' else -quantity
+
+
+def sync_invoice_movements(invoice, lines=None, created=False):
+    """
+    Allinea i movimenti di magazzino alle righe della fattura.
+
+    Per ogni riga viene confrontata la quantità attesa con la somma dei
+    movimenti già registrati e viene inserita solo la differenza, con un
+    unico bulk_create: risalvare una fattura invariata non produce movimenti.
+
+    Args:
+        invoice: Fattura da allineare
+        lines: Righe della fattura; se assenti vengono lette dal database
+        created: True se le righe sono appena state inserite, così da evitare
+            la lettura dei movimenti esistenti
+
+    Returns:
+        list: movimenti inseriti
+    """
+    if lines is None:
+        lines = invoice.invoice_lines.only('id', 'product_id', 'quantity')
+
+    expected = defaultdict(Decimal)
+    for line in lines:
+        expected[(line.pk, line.product_id)] += signed_quantity(invoice.invoice_type, line.quantity)
+
+    existing = {}
+    if not created:
+        existing = {
+            (line_id, product_id): total
+            for line_id, product_id, total in StockMovement.objects.filter(
+                invoice=invoice, invoice_line__isnull=False
+            ).values_list('invoice_line_id', 'product_id').annotate(
+                total=Sum('quantity')
+            ).values_list('invoice_line_id', 'product_id', 'total')
+        }
+
+    return _post_differences(invoice, expected, existing)
+
+
+def sync_line_movements(line):
+    """
+    Allinea i movimenti di una singola riga (salvataggio da admin o da
+    InvoiceLine.save()).
+    """
+    invoice = line.invoice
+    expected = {(line.pk, line.product_id): signed_quantity(invoice.invoice_type, line.quantity)}
+    existing = {
+        (line.pk, product_id): total
+        for product_id, total in StockMovement.objects.filter(
+            invoice_line=line
+        ).values_list('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    }
+    return _post_differences(invoice, expected, existing)
+
+
+def reverse_line_movements(line):
+    """
+    Storna i movimenti di una riga che sta per essere eliminata.
+
+    Lo storno non fa riferimento né alla riga né alla fattura, che potrebbero
+    essere eliminate nella stessa operazione; i movimenti originali restano
+    nel registro con i riferimenti azzerati.
+
+    Il numero della fattura viene letto con i totali, nella stessa query:
+    le righe eliminate a cascata insieme alla fattura non hanno la fattura
+    già caricata.
+    """
+    totals = [
+        (product_id, total, invoice_number)
+        for product_id, total, invoice_number in StockMovement.objects.filter(invoice_line=line).values_list(
+            'product_id'
+        ).annotate(
+            total=Sum('quantity'), invoice_number=Max('invoice__invoice_number')
+        ).values_list('product_id', 'total', 'invoice_number')
+        if total
+    ]
+    if not totals:
+        return []
+
+    movements = [
+        StockMovement(
+            product_id=product_id,
+            quantity=-total,
+            reason='REVERSAL',
+            reference=f"Storno riga {line.line_number} fattura {invoice_number}"
+        )
+        for product_id, total, invoice_number in totals
+    ]
+    StockMovement.objects.bulk_create(movements)
+    schedule_balance_refresh(movement.product_id for movement in movements)
+    return movements
+
+
+def _post_differences(invoice, expected, existing):
+    movements = []
+    for key in expected.keys() | existing.keys():
+        delta = expected.get(key, Decimal('0')) - existing.get(key, Decimal('0'))
+        if not delta:
+            continue
+        line_id, product_id = key
+        movements.append(StockMovement(
+            product_id=product_id,
+            invoice=invoice,
+            invoice_line_id=line_id,
+            quantity=delta,
+            reason='ADJUSTMENT' if key in existing else 'INVOICE',
+            reference=f"Fattura {invoice.invoice_number}"
+        ))
+
+    StockMovement.objects.bulk_create(movements)
+    schedule_balance_refresh(movement.product_id for movement in movements)
+    return movements
+
+
+def schedule_balance_refresh(product_ids):
+    """
+    Aggiorna i saldi dei prodotti indicati dopo il commit della transazione
+    corrente, fuori dai lock presi dall'importazione.
+
+    I prodotti segnalati nella stessa transazione, ad esempio da tutte le
+    righe di una fattura eliminata, vengono aggiornati con un solo
+    passaggio.
+    """
+    product_ids = set(product_ids)
+    if not product_ids or DEFER_REFRESH:
+        return
+    if not hasattr(_pending, 'product_ids'):
+        _pending.product_ids = set()
+    _pending.product_ids.update(product_ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    product_ids = getattr(_pending, 'product_ids', set())
+    if not product_ids:
+        return
+    _pending.product_ids = set()
+    refresh_stock_balances(product_ids)
+
+
+def refresh_stock_balances(product_ids=None, batch_size=REFRESH_BATCH_SIZE):
+    """
+    Applica ai saldi i movimenti non ancora applicati.
+
+    I movimenti vengono aggregati per prodotto, così ogni prodotto riceve un
+    solo aggiornamento per blocco indipendentemente dal numero di righe; la
+    stessa variazione viene riportata su Product.update_stock per mantenere
+    allineata la giacenza del magazzino. I movimenti già presi da un altro
+    processo vengono saltati (SKIP LOCKED) e applicati da quello.
+
+    Args:
+        product_ids: Limita l'aggiornamento a questi prodotti
+
+    Returns:
+        int: numero di movimenti applicati
+    """
+    applied = 0
+    while True:
+        with transaction.atomic():
+            pending = StockMovement.objects.select_for_update(skip_locked=True).filter(applied=False)
+            if product_ids is not None:
+                pending = pending.filter(product_id__in=product_ids)
+            rows = list(pending.order_by('id').values_list('id', 'product_id', 'quantity')[:batch_size])
+            if not rows:
+                return applied
+
+            deltas = defaultdict(Decimal)
+            for movement_id, product_id, quantity in rows:
+                deltas[product_id] += quantity
+
+            products = Product.objects.in_bulk(list(deltas))
+            for product_id, delta in deltas.items():
+                if not delta:
+                    continue
+                add_to_balance(product_id, delta)
+                if product_id in products:
+                    products[product_id].update_stock(delta)
+
+            StockMovement.objects.filter(id__in=[row[0] for row in rows]).update(applied=True)
+            applied += len(rows)
+
+        if len(rows) < batch_size:
+            return applied
+
+
+def add_to_balance(product_id, delta):
+    """
+    Somma ``delta`` al saldo del prodotto, creandolo se manca.
+
+    Due processi possono creare insieme il primo saldo di un prodotto: chi
+    trova il saldo già creato dall'altro riceve IntegrityError (in un
+    savepoint, senza annullare il blocco) e lo aggiorna.
+    """
+    if increment_balance(product_id, delta):
+        return
+    try:
+        with transaction.atomic():
+            StockBalance.objects.create(product_id=product_id, quantity=delta)
+    except IntegrityError:
+        increment_balance(product_id, delta)
+
+
+def increment_balance(product_id, delta):
+    return StockBalance.objects.filter(product_id=product_id).update(
+        quantity=F('quantity') + delta,
+        updated_at=timezone.now()
+    )
+
+
+def get_stock_quantity(product):
+    """
+    Giacenza del prodotto secondo il registro: saldo materializzato più i
+    movimenti non ancora applicati.
+    """
+    balance = StockBalance.objects.filter(product=product).values_list('quantity', flat=True).first()
+    pending = StockMovement.objects.filter(product=product, applied=False).aggregate(
+        total=Sum('quantity')
+    )['total']
+    return (balance or Decimal('0')) + (pending or Decimal('0'))
@@ -0,0 +1,133 @@
+# billing/services/streaming_extractor.py
+from xml.etree import ElementTree as ET
+
+
+def local_name(tag):
+    """
+    Restituisce il nome del tag senza l'eventuale namespace ``{...}``.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+class StreamingInvoiceExtractor:
+    """
+    Estrattore FatturaPA basato su ``iterparse``.
+
+    Il file viene letto in un'unica passata: ogni blocco di interesse
+    (DatiGeneraliDocumento, CedentePrestatore, CessionarioCommittente,
+    DettaglioLinee, DatiRiepilogo, DatiPagamento) viene convertito appena il
+    parser ne raggiunge la chiusura e poi svuotato e staccato dal padre, così
+    la memoria non cresce con il numero di righe. I file in forma di lotto,
+    con più FatturaElettronicaBody sotto un unico header, producono una
+    fattura per body nella stessa passata. La conversione dei singoli
+    elementi è delegata agli stessi metodi di InvoiceParser usati
+    dall'estrattore classico, per cui i dizionari prodotti da ``extract``
+    sono identici.
+    """
+
+    # Blocchi che non servono all'import o che contengono solo elementi già
+    # convertiti: vengono svuotati alla chiusura (gli allegati, in
+    # particolare, contengono payload base64 anche enormi)
+    DISCARDED = {'Allegati', 'DatiTrasmissione', 'DatiBeniServizi'}
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def iter_records(self, source):
+        """
+        Generatore a passata singola sui blocchi della fattura.
+
+        Produce tuple ``(tipo, dati)`` con tipo fra 'general', 'issuer',
+        'receiver', 'line', 'summary', 'payments' e 'body'; quest'ultimo, senza dati,
+        chiude ciascun FatturaElettronicaBody.
+        """
+        parser = self.parser
+        # Antenati dell'elemento corrente: servono per staccare dal padre gli
+        # elementi già convertiti, altrimenti restano (vuoti) nell'albero
+        stack = []
+
+        # Cedente e cessionario compaiono solo nell'header, righe e riepiloghi
+        # solo nel body: basta l'evento di chiusura per riconoscerli
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            parent = stack[-1] if stack else None
+            tag = local_name(elem.tag)
+
+            if tag == 'DettaglioLinee':
+                yield 'line', parser.extract_line_data(elem)
+            elif tag == 'DatiRiepilogo':
+                yield 'summary', parser.extract_summary_data(elem)
+            elif tag == 'DatiPagamento':
+                # Come nell'estrattore classico, solo i DatiPagamento del body
+                if parent is None or local_name(parent.tag) != 'FatturaElettronicaBody':
+                    continue
+                yield 'payments', parser.extract_payment_data(elem)
+            elif tag == 'DatiGeneraliDocumento':
+                yield 'general', parser.extract_general_data(elem)
+            elif tag == 'CedentePrestatore':
+                yield 'issuer', parser.extract_party_data(elem)
+            elif tag == 'CessionarioCommittente':
+                yield 'receiver', parser.extract_party_data(elem, with_contacts=False)
+            elif tag == 'FatturaElettronicaBody':
+                yield 'body', None
+            elif tag not in self.DISCARDED:
+                continue
+
+            # Elemento già convertito (o inutile): viene svuotato e staccato
+            # dal padre, così l'albero non conserva nulla dei blocchi letti
+            elem.clear()
+            if parent is not None:
+                parent.remove(elem)
+
+    def extract(self, source):
+        """
+        Estrae i dati delle fatture nello stesso formato di
+        InvoiceParser.extract_invoice_data: un dizionario per body.
+        """
+        parts = {'issuer': None, 'receiver': None}
+        bodies = []
+        general = None
+        lines = []
+        summaries = []
+        payments = []
+
+        for kind, data in self.iter_records(source):
+            if kind == 'line':
+                lines.append(data)
+            elif kind == 'summary':
+                summaries.append(data)
+            elif kind == 'payments':
+                payments.extend(data)
+            elif kind == 'general':
+                general = general or data
+            elif kind == 'body':
+                bodies.append((general, lines, summaries, payments))
+                general, lines, summaries, payments = None, [], [], []
+            elif parts[kind] is None:
+                parts[kind] = data
+
+        missing = [kind for kind, data in parts.items() if data is None]
+        if not bodies:
+            missing.append('body')
+        elif any(body[0] is None for body in bodies):
+            missing.append('general')
+        if missing:
+            raise ValueError(f"Blocchi obbligatori mancanti nella fattura: {', '.join(missing)}")
+
+        # L'header è comune a tutte le fatture del lotto
+        invoice_type = self.parser.resolve_invoice_type(parts['issuer'])
+        return [
+            self.parser.build_invoice_data(
+                general,
+                invoice_type,
+                parts['issuer'],
+                parts['receiver'],
+                lines,
+                summaries,
+                payments
+            )
+            for general, lines, summaries, payments in bodies
+        ]
@@ -0,0 +1,123 @@
+# billing/services/synthetic_invoices.py
+import datetime
+import random
+from decimal import Decimal, ROUND_HALF_UP
+from xml.sax.saxutils import escape
+
+NAMESPACE = 'http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2'
+
+VAT_RATES = (Decimal('22.00'), Decimal('10.00'), Decimal('4.00'))
+DISCOUNTS = (Decimal('5.00'), Decimal('10.00'), Decimal('20.00'))
+CENT = Decimal('0.01')
+
+
+class SyntheticInvoiceGenerator:
+    """
+    Generatore di fatture FatturaPA sintetiche per i benchmark.
+
+    Le fatture sono coerenti (totali di riga, riepiloghi per aliquota e totale
+    documento tornano) e riproducibili a parità di ``seed``.
+
+    Args:
+        lines: Righe per fattura
+        suppliers: Numero di fornitori diversi fra cui distribuire le fatture
+        products: Prodotti distinti per fornitore; con meno prodotti che righe
+            gli stessi articoli si ripetono, come nelle forniture reali
+        discount_ratio: Frazione di righe con sconto
+        receiver_vat_number: Partita IVA del destinatario (la nostra azienda)
+        seed: Seme del generatore casuale
+    """
+
+    def __init__(self, lines=20, suppliers=10, products=50, discount_ratio=0.2,
+                 receiver_vat_number='09876543210', seed=0):
+        self.lines = lines
+        self.suppliers = suppliers
+        self.products = products
+        self.discount_ratio = discount_ratio
+        self.receiver_vat_number = receiver_vat_number
+        self.seed = seed
+
+    def generate(self, count, prefix='BENCH'):
+        """
+        Genera ``count`` fatture.
+
+        Yields:
+            tuple: (nome file, contenuto in bytes), come iter_invoice_files
+        """
+        rng = random.Random(self.seed)
+        start = datetime.date(2024, 1, 1)
+        for index in range(count):
+            supplier = index % self.suppliers
+            issue_date = start + datetime.timedelta(days=index % 365)
+            number = f'{prefix}-{index + 1}'
+            yield f'IT{self.supplier_vat_number(supplier)}_{number}.xml', self.invoice(rng, number, supplier, issue_date)
+
+    def supplier_vat_number(self, supplier):
+        return f'{10000000000 + supplier:011d}'
+
+    def invoice(self, rng, number, supplier, issue_date):
+        lines = []
+        taxable_by_rate = {}
+        for line_number in range(1, self.lines + 1):
+            product = rng.randrange(self.products)
+            quantity = Decimal(rng.randint(1, 20))
+            # InvoiceLine.unit_price ha 2 cifre intere (max_digits=10, decimal_places=8)
+            unit_price = (Decimal(rng.randint(100, 9999)) / 100).quantize(CENT)
+            vat_rate = VAT_RATES[product % len(VAT_RATES)]
+            discount = rng.choice(DISCOUNTS) if rng.random() < self.discount_ratio else None
+
+            line_total = quantity * unit_price
+            if discount:
+                line_total = line_total * (1 - discount / 100)
+            line_total = line_total.quantize(CENT, ROUND_HALF_UP)
+            taxable_by_rate[vat_rate] = taxable_by_rate.get(vat_rate, Decimal('0')) + line_total
+
+            discount_xml = (
+                f'<ScontoMaggiorazione><Tipo>SC</Tipo><Percentuale>{discount}</Percentuale></ScontoMaggiorazione>'
+                if discount else ''
+            )
+            lines.append(
+                f'<DettaglioLinee><NumeroLinea>{line_number}</NumeroLinea>'
+                f'<CodiceArticolo><CodiceTipo>INTERNO</CodiceTipo><CodiceValore>S{supplier}P{product}</CodiceValore></CodiceArticolo>'
+                f'<Descrizione>{escape(f"Articolo {product} fornitore {supplier}")}</Descrizione>'
+                f'<Quantita>{quantity}.00</Quantita><UnitaMisura>PZ</UnitaMisura>'
+                f'<PrezzoUnitario>{unit_price}</PrezzoUnitario>{discount_xml}'
+                f'<PrezzoTotale>{line_total}</PrezzoTotale><AliquotaIVA>{vat_rate}</AliquotaIVA></DettaglioLinee>'
+            )
+
+        summaries = []
+        total = Decimal('0')
+        for vat_rate, taxable in sorted(taxable_by_rate.items()):
+            vat = (taxable * vat_rate / 100).quantize(CENT, ROUND_HALF_UP)
+            total += taxable + vat
+            summaries.append(
+                f'<DatiRiepilogo><AliquotaIVA>{vat_rate}</AliquotaIVA>'
+                f'<ImponibileImporto>{taxable}</ImponibileImporto><Imposta>{vat}</Imposta></DatiRiepilogo>'
+            )
+
+        supplier_vat = self.supplier_vat_number(supplier)
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<p:FatturaElettronica versione="FPR12" xmlns:p="{NAMESPACE}">'
+            f'<FatturaElettronicaHeader>'
+            f'<DatiTrasmissione><IdTrasmittente><IdPaese>IT</IdPaese><IdCodice>{supplier_vat}</IdCodice></IdTrasmittente>'
+            f'<ProgressivoInvio>{escape(number)}</ProgressivoInvio><FormatoTrasmissione>FPR12</FormatoTrasmissione>'
+            f'<CodiceDestinatario>0000000</CodiceDestinatario></DatiTrasmissione>'
+            f'<CedentePrestatore><DatiAnagrafici><IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>{supplier_vat}</IdCodice></IdFiscaleIVA>'
+            f'<Anagrafica><Denominazione>Fornitore {supplier} SRL</Denominazione></Anagrafica><RegimeFiscale>RF01</RegimeFiscale></DatiAnagrafici>'
+            f'<Sede><Indirizzo>Via Roma {supplier}</Indirizzo><CAP>00100</CAP><Comune>Roma</Comune><Nazione>IT</Nazione></Sede></CedentePrestatore>'
+            f'<CessionarioCommittente><DatiAnagrafici><IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>{self.receiver_vat_number}</IdCodice></IdFiscaleIVA>'
+            f'<Anagrafica><Denominazione>Azienda Benchmark SPA</Denominazione></Anagrafica></DatiAnagrafici>'
+            f'<Sede><Indirizzo>Via Milano 1</Indirizzo><CAP>20100</CAP><Comune>Milano</Comune><Nazione>IT</Nazione></Sede></CessionarioCommittente>'
+            f'</FatturaElettronicaHeader>'
+            f'<FatturaElettronicaBody><DatiGenerali><DatiGeneraliDocumento>'
+            f'<TipoDocumento>TD01</TipoDocumento><Divisa>EUR</Divisa><Data>{issue_date.isoformat()}</Data>'
+            f'<Numero>{escape(number)}</Numero><ImportoTotaleDocumento>{total}</ImportoTotaleDocumento>'
+            f'</DatiGeneraliDocumento></DatiGenerali>'
+            f'<DatiBeniServizi>{"".join(lines)}{"".join(summaries)}</DatiBeniServizi>'
+            f'<DatiPagamento><CondizioniPagamento>TP02</CondizioniPagamento><DettaglioPagamento>'
+            f'<ModalitaPagamento>MP05</ModalitaPagamento>'
+            f'<DataScadenzaPagamento>{(issue_date + datetime.timedelta(days=30)).isoformat()}</DataScadenzaPagamento>'
+            f'<ImportoPagamento>{total}</ImportoPagamento></DettaglioPagamento></DatiPagamento>'
+            f'</FatturaElettronicaBody></p:FatturaElettronica>'
+        ).encode('utf-8')
@@ -0,0 +1,105 @@
+import datetime
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from billing.models.base import Invoice, InvoiceLine, PaymentInstalment, ProductCodeRule
+from billing.services.billing_aggregates import invoice_partition, mark_partitions, partition_key
+from billing.services.own_company import invalidate_own_company
+from billing.services.payment_reports import refresh_payment_status
+from billing.services.product_codes import default_code_rules
+from billing.services.render_cache import CUSTOMER_LIST, SUPPLIER_LIST, bump_versions, invoice_lists
+from billing.services.stock_ledger import (
+    reverse_line_movements, sync_invoice_movements, sync_line_movements
+)
+
+
+@receiver(post_save, sender='crm.Company')
+@receiver(post_delete, sender='crm.Company')
+def company_changed(sender, **kwargs):
+    # Qualsiasi modifica a un'azienda può cambiare quale sia la nostra, e le
+    # liste mostrano il nome della controparte
+    invalidate_own_company()
+    bump_versions({SUPPLIER_LIST, CUSTOMER_LIST})
+
+
+@receiver(post_save, sender=ProductCodeRule)
+@receiver(post_delete, sender=ProductCodeRule)
+def product_code_rule_changed(sender, instance, **kwargs):
+    # Le regole del fornitore vengono ricompilate alla prossima richiesta
+    default_code_rules.invalidate(instance.supplier_id)
+
+
+@receiver(post_save, sender=InvoiceLine)
+def invoice_line_saved(sender, instance, raw=False, **kwargs):
+    # Registra solo la differenza rispetto ai movimenti già presenti
+    if not raw:
+        sync_line_movements(instance)
+
+
+@receiver(pre_delete, sender=InvoiceLine)
+def invoice_line_deleted(sender, instance, **kwargs):
+    reverse_line_movements(instance)
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_before_save(sender, instance, raw=False, **kwargs):
+    # Se la modifica sposta la fattura di mese, controparte o tipo, anche la
+    # partizione di origine va ricalcolata
+    instance._previous_partition = None
+    instance._previous_lists = set()
+    if not raw and not instance._state.adding:
+        previous = Invoice.objects.filter(pk=instance.pk).values_list(
+            'invoice_type', 'issue_date', 'issuer_id', 'receiver_id'
+        ).first()
+        if previous:
+            instance._previous_partition = partition_key(*previous)
+            instance._previous_lists = invoice_lists(*previous[2:])
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    mark_partitions({invoice_partition(instance), getattr(instance, '_previous_partition', None)} - {None})
+    bump_versions(
+        invoice_lists(instance.issuer_id, instance.receiver_id) | getattr(instance, '_previous_lists', set()),
+        {instance.pk}
+    )
+    # Un cambio di tipo fattura inverte il segno di tutti i movimenti
+    if not created:
+        sync_invoice_movements(instance)
+        sync_instalments(instance)
+
+
+def sync_instalments(invoice):
+    # Lo stato impostato a mano sulla fattura si riflette sulle rate; le rate
+    # seguono anche tipo e controparte
+    instalments = PaymentInstalment.objects.filter(invoice=invoice)
+    if invoice.payment_status == 'PAID':
+        instalments.filter(status='OPEN').update(status='PAID', paid_at=datetime.date.today())
+    elif invoice.payment_status == 'UNPAID':
+        instalments.filter(status='PAID').update(status='OPEN', paid_at=None)
+    company_id = invoice.issuer_id if invoice.invoice_type == 'IN' else invoice.receiver_id
+    instalments.exclude(invoice_type=invoice.invoice_type, company_id=company_id).update(
+        invoice_type=invoice.invoice_type, company_id=company_id
+    )
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted(sender, instance, **kwargs):
+    mark_partitions({invoice_partition(instance)})
+    bump_versions(invoice_lists(instance.issuer_id, instance.receiver_id), {instance.pk})
+
+
+@receiver(post_save, sender=InvoiceLine)
+@receiver(post_delete, sender=InvoiceLine)
+def invoice_line_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        mark_partitions(invoice_ids={instance.invoice_id})
+        bump_versions(invoice_ids={instance.invoice_id})
+
+
+@receiver(post_save, sender=PaymentInstalment)
+@receiver(post_delete, sender=PaymentInstalment)
+def instalment_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_payment_status({instance.invoice_id})
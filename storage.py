@@ -0,0 +1,161 @@
+# billing/storage.py
+import gzip
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressione dei nuovi file: 'zstd' (se installato zstandard) o 'gzip'
+COMPRESSION = getattr(settings, 'BILLING_XML_COMPRESSION', 'zstd' if zstandard is not None else 'gzip')
+COMPRESSION_LEVEL = getattr(settings, 'BILLING_XML_COMPRESSION_LEVEL', None)
+
+# Livelli di sottocartelle ricavate dall'hash (2 caratteri ciascuna)
+SHARD_DEPTH = getattr(settings, 'BILLING_XML_SHARD_DEPTH', 2)
+
+CHUNK_SIZE = 64 * 1024
+
+EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Storage su filesystem che memorizza i file per contenuto.
+
+    Il nome di ogni file è lo SHA-256 del contenuto originale, in
+    sottocartelle ricavate dai primi caratteri dell'hash
+    (``fatture_xml/ab/cd/abcd....xml.gz``): lo stesso file caricato più volte
+    occupa spazio una sola volta e nessuna cartella cresce oltre poche
+    centinaia di voci. Il contenuto viene compresso con zstd o gzip durante
+    la scrittura, in un'unica passata insieme al calcolo dell'hash.
+
+    ``open`` restituisce il contenuto originale decompresso in streaming; i
+    file salvati in precedenza senza compressione vengono letti così come
+    sono.
+    """
+
+    def __init__(self, compression=COMPRESSION, level=COMPRESSION_LEVEL, shard_depth=SHARD_DEPTH, **kwargs):
+        super().__init__(**kwargs)
+        if compression == 'zstd' and zstandard is None:
+            compression = 'gzip'
+        self.compression = compression
+        self.level = level
+        self.shard_depth = shard_depth
+
+    def blob_name(self, digest, directory=''):
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return '/'.join([directory.strip('/')] + shards + [f'{digest}.xml{EXTENSIONS[self.compression]}']).lstrip('/')
+
+    def save(self, name, content, max_length=None):
+        """
+        Salva ``content`` con il nome derivato dal suo hash e lo restituisce;
+        se un file con lo stesso contenuto esiste già non viene riscritto.
+        """
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        directory = os.path.dirname(name)
+        os.makedirs(self.path(directory) if directory else self.location, exist_ok=True)
+        digest = hashlib.sha256()
+
+        # Scrittura su un file temporaneo nella stessa cartella, poi
+        # rinominato: un lettore non vede mai un file parziale
+        handle, temp_path = tempfile.mkstemp(dir=self.path(directory) if directory else self.location, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as raw:
+                with self.compressor(raw, getattr(content, 'size', None)) as writer:
+                    if hasattr(content, 'seek'):
+                        content.seek(0)
+                    for chunk in content.chunks(CHUNK_SIZE):
+                        digest.update(chunk)
+                        writer.write(chunk)
+
+            name = self.blob_name(digest.hexdigest(), directory)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def compressor(self, raw, size=None):
+        if self.compression == 'zstd':
+            options = {'level': self.level} if self.level is not None else {}
+            return zstandard.ZstdCompressor(**options).stream_writer(raw, size=size if size is not None else -1, closefd=False)
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.level or 9, mtime=0)
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('ContentAddressedStorage è in sola lettura: usare save()')
+        file = File(self.stream(name), name)
+        file.size = self.size(name)
+        return file
+
+    def stream(self, name):
+        """
+        Flusso in lettura del contenuto originale, decompresso al volo.
+        """
+        path = self.path(name)
+        if name.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f'Il file {name} è compresso con zstd ma il pacchetto zstandard non è installato')
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        if name.endswith('.gz'):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+
+    def size(self, name):
+        """
+        Dimensione del contenuto originale (decompresso).
+        """
+        path = self.path(name)
+        if name.endswith('.gz'):
+            # Gli ultimi 4 byte del formato gzip riportano la dimensione originale
+            with open(path, 'rb') as fh:
+                fh.seek(-4, os.SEEK_END)
+                return int.from_bytes(fh.read(4), 'little')
+        if name.endswith('.zst') and zstandard is not None:
+            with open(path, 'rb') as fh:
+                size = zstandard.frame_content_size(fh.read(18))
+            if size >= 0:
+                return size
+            with self.stream(name) as stream:
+                return sum(len(chunk) for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''))
+        return super().size(name)
+
+    def stored_size(self, name):
+        """
+        Dimensione occupata su disco.
+        """
+        return super().size(name)
+
+
+_invoice_storage = None
+
+
+def invoice_xml_storage():
+    """
+    Storage di Invoice.file_xml, creato al primo utilizzo.
+    """
+    global _invoice_storage
+    if _invoice_storage is None:
+        _invoice_storage = ContentAddressedStorage()
+    return _invoice_storage
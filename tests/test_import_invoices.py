@@ -0,0 +1,27 @@
+# billing/tests/test_import_invoices.py
+from billing.management.commands.import_invoices import Command
+from billing.models.base import Invoice
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.product_matching import ProductMatcher
+from billing.services.resolution_cache import ResolutionCache
+from billing.tests.utils import ImportTestCase, invoice_file
+
+
+class ImportedNamesTests(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        parser = InvoiceParser(cache=ResolutionCache(), matcher=ProductMatcher())
+        invoice, _, _ = parser.parse_and_save(invoice_file('1', [('Vite 8 mm', 'V8')], name='fattura_2024001.xml'))
+        self.invoice = Invoice.objects.get(pk=invoice.pk)
+
+    def test_original_filename(self):
+        self.assertEqual(Command().imported_names(), {'fattura_2024001.xml'})
+
+    def test_legacy_file_name_is_taken_as_is(self):
+        # Un numero di 7 cifre nel nome non è il suffisso dello storage:
+        # fattura.xml è un altro file e va importato
+        Invoice.objects.filter(pk=self.invoice.pk).update(
+            original_filename='', file_xml='invoices/xml/fattura_2024001.xml'
+        )
+        self.assertEqual(Command().imported_names(), {'fattura_2024001.xml'})
@@ -0,0 +1,35 @@
+# billing/tests/test_invoice_parser.py
+from billing.models.base import Invoice
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.product_matching import ProductMatcher
+from billing.services.resolution_cache import ResolutionCache
+from billing.tests.utils import ImportTestCase, invoice_file
+from warehouse.models.base import Product
+
+
+class ConcurrentImportTests(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parser = InvoiceParser(cache=ResolutionCache(), matcher=ProductMatcher())
+
+    def test_content_hash_race_discards_rolled_back_products(self):
+        invoice, status, _ = self.parser.parse_and_save(invoice_file('1', [('Vite 8 mm', 'V8')]))
+        self.assertEqual(status, 'success')
+
+        # Un'altra richiesta ha salvato lo stesso file dopo il controllo
+        # iniziale sull'hash: il vincolo univoco scatta durante il salvataggio
+        other = invoice_file('2', [('Dado 8 mm', 'D8')])
+        documents = self.parser.extract_payload(self.parser.read_payload(other), invoice.content_hash)
+        _, status, _ = self.parser.save_documents(documents, other)
+
+        self.assertEqual(status, 'duplicate')
+        self.assertEqual(Invoice.objects.count(), 1)
+        self.assertFalse(Product.objects.filter(name='Dado 8 mm').exists())
+        self.assertFalse(self.parser.cache.has_product('Dado 8 mm'))
+        self.assertNotIn(invoice.issuer_id, self.parser.matcher.indexes)
+
+        # La stessa riga in una fattura successiva crea il prodotto da capo
+        _, status, _ = self.parser.parse_and_save(invoice_file('3', [('Dado 8mm', 'D8')]))
+        self.assertEqual(status, 'success')
+        self.assertTrue(Product.objects.filter(name='Dado 8mm').exists())
@@ -0,0 +1,43 @@
+# billing/tests/test_job_queue.py
+import datetime
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.db import OperationalError
+from django.utils import timezone
+from billing.models.base import ImportJob
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.job_queue import claim_job, enqueue, process_job
+from billing.services.product_matching import ProductMatcher
+from billing.services.resolution_cache import ResolutionCache
+from billing.tests.utils import ImportTestCase, invoice_file
+
+
+class ProcessJobTests(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parser = InvoiceParser(cache=ResolutionCache(), matcher=ProductMatcher())
+
+    def test_database_error_is_retried(self):
+        enqueue(invoice_file('1', [('Vite 8 mm', 'V8')]))
+
+        with mock.patch.object(self.parser, 'save_documents', side_effect=OperationalError('database is locked')):
+            job = process_job(claim_job(), self.parser)
+        self.assertEqual(job.status, 'PENDING')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.next_attempt_at)
+
+        # Il nuovo tentativo non viene preso prima del tempo previsto
+        self.assertIsNone(claim_job())
+        ImportJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        job = process_job(claim_job(), self.parser)
+        self.assertEqual(job.status, 'SUCCESS')
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.invoice)
+
+    def test_invalid_document_is_not_retried(self):
+        enqueue(ContentFile(b'<non-xml', name='rotto.xml'))
+        job = process_job(claim_job(), self.parser)
+        self.assertEqual(job.status, 'ERROR')
+        self.assertEqual(job.attempts, 1)
@@ -0,0 +1,57 @@
+# billing/tests/test_product_matching.py
+from django.test import SimpleTestCase
+from billing.models.base import InvoiceLine
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.product_matching import ProductMatcher, SupplierIndex
+from billing.services.resolution_cache import ResolutionCache
+from billing.tests.utils import ImportTestCase, invoice_file
+
+
+class SupplierIndexTests(SimpleTestCase):
+
+    def test_code_match_requires_same_numbers(self):
+        index = SupplierIndex()
+        index.add(1, 'KIT viti 10 pz', 'KIT')
+        self.assertEqual(index.match('KIT viti 10pz', 'KIT').product_id, 1)
+        self.assertIsNone(index.match('KIT rondelle 50 pz', 'KIT'))
+
+    def test_name_match_rejects_conflicting_code(self):
+        index = SupplierIndex()
+        index.add(1, 'Vite zincata', 'A1')
+        self.assertIsNone(index.match('Vite zincata', 'B2'))
+        self.assertEqual(index.match('vite  zincata', '').product_id, 1)
+
+
+class ProductResolutionTests(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parser = InvoiceParser(cache=ResolutionCache(), matcher=ProductMatcher())
+
+    def products_by_description(self):
+        return dict(InvoiceLine.objects.values_list('description', 'product_id'))
+
+    def test_descriptions_sharing_first_word_stay_distinct(self):
+        # Senza CodiceArticolo la prima parola in maiuscolo è solo un codice
+        # stimato: non deve unire prodotti diversi
+        lines = [
+            ('KIT viti 10 pz', ''),
+            ('KIT rondelle 50 pz', ''),
+            ('TRASPORTO merce su gomma', ''),
+            ('TRASPORTO urgente espresso', ''),
+        ]
+        _, status, _ = self.parser.parse_and_save(invoice_file('1', lines[:2] + lines[2:3]))
+        self.assertEqual(status, 'success')
+        _, status, _ = self.parser.parse_and_save(invoice_file('2', lines[1:2] + lines[3:]))
+        self.assertEqual(status, 'success')
+
+        products = self.products_by_description()
+        self.assertEqual(len(set(products.values())), 4)
+        self.assertEqual(
+            set(InvoiceLine.objects.values_list('external_product_code', flat=True)), {'KIT', 'TRASPORTO'}
+        )
+
+    def test_article_code_identifies_product(self):
+        self.parser.parse_and_save(invoice_file('1', [('Vite zincata 8 mm', 'V8')]))
+        self.parser.parse_and_save(invoice_file('2', [('Vite zinc. 8mm', 'V8')]))
+        self.assertEqual(len(set(self.products_by_description().values())), 1)
@@ -0,0 +1,58 @@
+# billing/tests/test_stock_ledger.py
+from decimal import Decimal
+from unittest import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from billing.models.base import Invoice, StockBalance, StockMovement
+from billing.services.invoice_parser import InvoiceParser
+from billing.services.product_matching import ProductMatcher
+from billing.services.resolution_cache import ResolutionCache
+from billing.services.stock_ledger import add_to_balance, get_stock_quantity, increment_balance
+from billing.tests.utils import ImportTestCase, invoice_file
+from warehouse.models.base import Product
+
+
+class StockLedgerTests(ImportTestCase):
+
+    def test_invoice_delete_reverses_lines_without_loading_invoice(self):
+        parser = InvoiceParser(cache=ResolutionCache(), matcher=ProductMatcher())
+        lines = [(f'Articolo {index}', f'A{index}') for index in range(10)]
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice, _, _ = parser.parse_and_save(invoice_file('1', lines))
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            invoice.delete()
+
+        invoice_reads = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "billing_invoice"' in query['sql']
+        ]
+        # Nessuna lettura della fattura per ciascuna riga stornata
+        self.assertLess(len(invoice_reads), len(lines))
+        self.assertEqual(
+            StockMovement.objects.filter(reason='REVERSAL', reference='Storno riga 1 fattura 1').count(), 1
+        )
+        for product in Product.objects.all():
+            self.assertEqual(get_stock_quantity(product), Decimal('0'))
+
+    def test_balance_created_concurrently_is_updated(self):
+        product = Product.objects.create(name='Vite 8 mm')
+        calls = []
+
+        def increment_after_concurrent_create(product_id, delta):
+            # Il primo aggiornamento non trova il saldo, che un altro processo
+            # crea subito dopo
+            calls.append(delta)
+            if len(calls) == 1:
+                StockBalance.objects.create(product_id=product_id, quantity=Decimal('5'))
+                return 0
+            return increment_balance(product_id, delta)
+
+        increment = mock.patch(
+            'billing.services.stock_ledger.increment_balance', side_effect=increment_after_concurrent_create
+        )
+        with increment:
+            add_to_balance(product.pk, Decimal('3'))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(StockBalance.objects.get(product=product).quantity, Decimal('8'))
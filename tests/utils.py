@@ -0,0 +1,78 @@
+# billing/tests/utils.py
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from crm.models.base import Company
+
+SUPPLIER_VAT = '01234567890'
+OWN_VAT = '09876543210'
+
+
+def line_xml(number, description, article_code=''):
+    code = (
+        f'<CodiceArticolo><CodiceTipo>INTERNO</CodiceTipo><CodiceValore>{article_code}</CodiceValore></CodiceArticolo>'
+        if article_code else ''
+    )
+    return f"""
+      <DettaglioLinee>
+        <NumeroLinea>{number}</NumeroLinea>{code}
+        <Descrizione>{description}</Descrizione>
+        <Quantita>1.00</Quantita>
+        <UnitaMisura>PZ</UnitaMisura>
+        <PrezzoUnitario>10.00</PrezzoUnitario>
+        <PrezzoTotale>10.00</PrezzoTotale>
+        <AliquotaIVA>22.00</AliquotaIVA>
+      </DettaglioLinee>"""
+
+
+def invoice_file(number, lines, issuer_vat=SUPPLIER_VAT, receiver_vat=OWN_VAT, name=None):
+    """
+    File FatturaPA minimo con una riga per ogni coppia (descrizione, codice
+    articolo) di ``lines``; codice vuoto per le righe senza CodiceArticolo.
+    """
+    total = 10 * len(lines)
+    body = ''.join(line_xml(index, description, code) for index, (description, code) in enumerate(lines, 1))
+    xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<p:FatturaElettronica versione="FPR12" xmlns:p="http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2">
+  <FatturaElettronicaHeader>
+    <DatiTrasmissione><IdTrasmittente><IdPaese>IT</IdPaese><IdCodice>{issuer_vat}</IdCodice></IdTrasmittente><ProgressivoInvio>1</ProgressivoInvio><FormatoTrasmissione>FPR12</FormatoTrasmissione><CodiceDestinatario>0000000</CodiceDestinatario></DatiTrasmissione>
+    <CedentePrestatore>
+      <DatiAnagrafici><IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>{issuer_vat}</IdCodice></IdFiscaleIVA><Anagrafica><Denominazione>Fornitore SRL</Denominazione></Anagrafica><RegimeFiscale>RF01</RegimeFiscale></DatiAnagrafici>
+      <Sede><Indirizzo>Via Roma</Indirizzo><CAP>00100</CAP><Comune>Roma</Comune><Nazione>IT</Nazione></Sede>
+    </CedentePrestatore>
+    <CessionarioCommittente>
+      <DatiAnagrafici><IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>{receiver_vat}</IdCodice></IdFiscaleIVA><Anagrafica><Denominazione>Noi SPA</Denominazione></Anagrafica></DatiAnagrafici>
+      <Sede><Indirizzo>Via Milano</Indirizzo><CAP>20100</CAP><Comune>Milano</Comune><Nazione>IT</Nazione></Sede>
+    </CessionarioCommittente>
+  </FatturaElettronicaHeader>
+  <FatturaElettronicaBody>
+    <DatiGenerali><DatiGeneraliDocumento>
+      <TipoDocumento>TD01</TipoDocumento><Divisa>EUR</Divisa><Data>2024-03-15</Data><Numero>{number}</Numero>
+      <ImportoTotaleDocumento>{total * 1.22:.2f}</ImportoTotaleDocumento>
+    </DatiGeneraliDocumento></DatiGenerali>
+    <DatiBeniServizi>{body}
+      <DatiRiepilogo><AliquotaIVA>22.00</AliquotaIVA><ImponibileImporto>{total:.2f}</ImponibileImporto><Imposta>{total * 0.22:.2f}</Imposta></DatiRiepilogo>
+    </DatiBeniServizi>
+  </FatturaElettronicaBody>
+</p:FatturaElettronica>"""
+    return ContentFile(xml.encode(), name=name or f'fattura_{number}.xml')
+
+
+class ImportTestCase(TestCase):
+    """
+    Base dei test di importazione: file salvati in una cartella temporanea
+    e azienda propria già configurata.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        self.own_company = Company.objects.create(name='Noi SPA', vat_number=OWN_VAT, is_own_company=True)
@@ -1,19 +1,37 @@
 from django.urls import path
 from billing.views.base import *
 from billing.views.parser import *
+from billing.views.datatables import *
+from billing.views.export import *
+from billing.views.payments import *
 
 app_name = 'billing'
 
 urlpatterns = [
     # Supplier Invoice URLs
     path('supplier-invoices/', SupplierInvoiceListView.as_view(), name='supplier_invoices'),
+    path('supplier-invoices/data/', SupplierInvoiceDataView.as_view(), name='supplier_invoices_data'),
+    path('supplier-invoices/export/', SupplierInvoiceExportView.as_view(), name='supplier_invoices_export'),
+    path('supplier-invoices/export/lines/', SupplierInvoiceLineExportView.as_view(), name='supplier_invoice_lines_export'),
     path('supplier-invoices/<int:invoice_id>/', SupplierInvoiceDetailView.as_view(), name='supplier_invoice_detail'),
     
     # Customer Invoice URLs
     path('customer-invoices/', CustomerInvoiceListView.as_view(), name='customer_invoices'),
+    path('customer-invoices/data/', CustomerInvoiceDataView.as_view(), name='customer_invoices_data'),
+    path('customer-invoices/export/', CustomerInvoiceExportView.as_view(), name='customer_invoices_export'),
+    path('customer-invoices/export/lines/', CustomerInvoiceLineExportView.as_view(), name='customer_invoice_lines_export'),
     path('customer-invoices/<int:invoice_id>/', CustomerInvoiceDetailView.as_view(), name='customer_invoice_detail'),
     
+    # Invoice XML URLs
+    path('invoices/<int:invoice_id>/xml/', InvoiceXMLDownloadView.as_view(), name='invoice_xml'),
+
+    # Payment URLs
+    path('payments/ageing/', PaymentAgeingView.as_view(), name='payment_ageing'),
+    path('payments/cash-flow/', CashFlowForecastView.as_view(), name='cash_flow_forecast'),
+
     # Invoice Upload URLs
     path('invoice-upload/', InvoiceUploadView.as_view(), name='invoice_upload'),
     path('invoice-upload-ajax/', InvoiceUploadAjaxView.as_view(), name='invoice_upload_ajax'),
+    path('invoice-upload-queue/', InvoiceUploadQueueView.as_view(), name='invoice_upload_queue'),
+    path('invoice-upload-queue/<uuid:batch_id>/', ImportBatchStatusView.as_view(), name='invoice_upload_status'),
 ]
\ No newline at end of file
@@ -1,19 +1,34 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from billing.models.base import Invoice
-from crm.models.base import Company
+from billing.services.invoice_queries import invoice_detail_queryset, invoice_lines_queryset
+from billing.services.render_cache import RENDER_CACHE_TIMEOUT, invoice_version
+from billing.services.own_company import get_own_company
 from billing.forms import InvoiceForm
 from datetime import datetime, timedelta
 from django.contrib import messages
 
+def detail_context(invoice, form):
+    """
+    Contesto dei dettagli fattura: la tabella delle righe è un frammento in
+    cache con la versione della fattura, e le righe vengono lette solo se
+    il frammento va ricostruito.
+    """
+    return {
+        'invoice': invoice,
+        'form': form,
+        'lines': invoice_lines_queryset(invoice),
+        'lines_version': invoice_version(invoice.id),
+        'render_cache_timeout': RENDER_CACHE_TIMEOUT,
+    }
+
 class SupplierInvoiceListView(View):
     template_name = 'billing/supplier_invoice_list.html'
 
     def get(self, request, *args, **kwargs):
-        own_company = Company.objects.get(is_own_company=True)
-        invoices = Invoice.objects.filter(receiver=own_company)
+        # Le righe della tabella vengono caricate dall'endpoint server-side
         form = InvoiceForm()
-        return render(request, self.template_name, {'invoices': invoices, 'form': form})
+        return render(request, self.template_name, {'form': form})
 
     def post(self, request, *args, **kwargs):
         if 'delete_object' in request.POST:
@@ -21,7 +36,7 @@ class SupplierInvoiceListView(View):
             invoice.delete()
             return redirect('billing:supplier_invoices')
 
-        own_company = Company.objects.get(is_own_company=True)
+        own_company = get_own_company()
         form = InvoiceForm(request.POST)
         if form.is_valid():
             new_invoice = form.save(commit=False)
@@ -29,19 +44,18 @@ class SupplierInvoiceListView(View):
             new_invoice.save()
             return redirect('billing:supplier_invoices')
 
-        invoices = Invoice.objects.filter(receiver=own_company)
-        return render(request, self.template_name, {'invoices': invoices, 'form': form})
+        return render(request, self.template_name, {'form': form})
 
 class SupplierInvoiceDetailView(View):
     template_name = 'billing/supplier_invoice_detail.html'
 
     def get(self, request, invoice_id, *args, **kwargs):
-        invoice = get_object_or_404(Invoice, id=invoice_id)
+        invoice = get_object_or_404(invoice_detail_queryset(), id=invoice_id)
         form = InvoiceForm(instance=invoice)
-        return render(request, self.template_name, {'invoice': invoice, 'form': form})
+        return render(request, self.template_name, detail_context(invoice, form))
 
     def post(self, request, invoice_id, *args, **kwargs):
-        invoice = get_object_or_404(Invoice, id=invoice_id)
+        invoice = get_object_or_404(invoice_detail_queryset(), id=invoice_id)
 
         if 'update_invoice' in request.POST:
             form = InvoiceForm(request.POST, instance=invoice)
@@ -53,16 +67,15 @@ class SupplierInvoiceDetailView(View):
             invoice.delete()
             return redirect('billing:supplier_invoices')
 
-        return render(request, self.template_name, {'invoice': invoice, 'form': form})
+        return render(request, self.template_name, detail_context(invoice, form))
 
 class CustomerInvoiceListView(View):
     template_name = 'billing/customer_invoice_list.html'
 
     def get(self, request, *args, **kwargs):
-        own_company = Company.objects.get(is_own_company=True)
-        invoices = Invoice.objects.filter(issuer=own_company)
+        # Le righe della tabella vengono caricate dall'endpoint server-side
         form = InvoiceForm()
-        return render(request, self.template_name, {'invoices': invoices, 'form': form})
+        return render(request, self.template_name, {'form': form})
 
     def post(self, request, *args, **kwargs):
         if 'delete_object' in request.POST:
@@ -70,7 +83,7 @@ class CustomerInvoiceListView(View):
             invoice.delete()
             return redirect('billing:customer_invoices')
 
-        own_company = Company.objects.get(is_own_company=True)
+        own_company = get_own_company()
         form = InvoiceForm(request.POST)
         if form.is_valid():
             new_invoice = form.save(commit=False)
@@ -78,19 +91,18 @@ class CustomerInvoiceListView(View):
             new_invoice.save()
             return redirect('billing:customer_invoices')
 
-        invoices = Invoice.objects.filter(issuer=own_company)
-        return render(request, self.template_name, {'invoices': invoices, 'form': form})
+        return render(request, self.template_name, {'form': form})
 
 class CustomerInvoiceDetailView(View):
     template_name = 'billing/customer_invoice_detail.html'
 
     def get(self, request, invoice_id, *args, **kwargs):
-        invoice = get_object_or_404(Invoice, id=invoice_id)
+        invoice = get_object_or_404(invoice_detail_queryset(), id=invoice_id)
         form = InvoiceForm(instance=invoice)
-        return render(request, self.template_name, {'invoice': invoice, 'form': form})
+        return render(request, self.template_name, detail_context(invoice, form))
 
     def post(self, request, invoice_id, *args, **kwargs):
-        invoice = get_object_or_404(Invoice, id=invoice_id)
+        invoice = get_object_or_404(invoice_detail_queryset(), id=invoice_id)
 
         if 'update_invoice' in request.POST:
             form = InvoiceForm(request.POST, instance=invoice)
@@ -102,5 +114,5 @@ class CustomerInvoiceDetailView(View):
             invoice.delete()
             return redirect('billing:customer_invoices')
 
-        return render(request, self.template_name, {'invoice': invoice, 'form': form})
+        return render(request, self.template_name, detail_context(invoice, form))
 
@@ -0,0 +1,111 @@
+# billing/views/datatables.py
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views import View
+from billing.models.base import Invoice
+from billing.services.invoice_filters import filter_invoices
+from billing.services.own_company import get_own_company
+from billing.services.render_cache import (
+    CUSTOMER_LIST, RENDER_CACHE_TIMEOUT, SUPPLIER_LIST, list_cache_key
+)
+
+
+class InvoiceDataTableView(View):
+    """
+    Endpoint JSON per DataTables in modalità server-side.
+
+    Implementa il protocollo di DataTables (draw, start, length, order,
+    search) più i filtri date_from, date_to e payment_status: paginazione,
+    ordinamento e filtri vengono eseguiti dal database e al browser arriva
+    solo la pagina richiesta.
+
+    Le risposte vengono tenute in cache per parametri e versione della
+    lista, incrementata dai segnali di Invoice: le visite ripetute alla
+    stessa pagina non interrogano il database finché una fattura della
+    lista non cambia.
+    """
+    # Campo che collega la fattura alla nostra azienda e campo della controparte
+    own_company_field = None
+    counterparty_field = None
+    detail_url_name = None
+    list_name = None
+
+    # Colonne della tabella, nell'ordine in cui compaiono nel template
+    columns = ['invoice_number', 'issue_date', 'counterparty', 'total_amount', 'payment_status']
+
+    max_page_size = 500
+
+    def get(self, request, *args, **kwargs):
+        draw = self.get_int(request.GET.get('draw'), 0)
+        cache_key = list_cache_key(self.list_name, request.GET)
+        payload = cache.get(cache_key)
+        if payload is None:
+            payload = self.get_payload(request)
+            cache.set(cache_key, payload, RENDER_CACHE_TIMEOUT)
+        return JsonResponse(dict(payload, draw=draw))
+
+    def get_payload(self, request):
+        own_company = get_own_company()
+        invoices = Invoice.objects.filter(**{self.own_company_field: own_company})
+
+        records_total = invoices.count()
+        invoices, filtered = filter_invoices(invoices, request.GET, self.counterparty_field)
+        records_filtered = invoices.count() if filtered else records_total
+
+        start = self.get_int(request.GET.get('start'), 0)
+        length = self.get_int(request.GET.get('length'), 25)
+        if length < 0 or length > self.max_page_size:
+            length = self.max_page_size
+
+        page = invoices.select_related('issuer', 'receiver').only(
+            'id', 'invoice_number', 'issue_date', 'currency', 'total_amount', 'payment_status',
+            'issuer__name', 'receiver__name'
+        ).order_by(*self.get_ordering(request.GET))[start:start + length]
+
+        return {
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': [self.serialize(invoice) for invoice in page],
+        }
+
+    def get_ordering(self, params):
+        index = self.get_int(params.get('order[0][column]'), 1)
+        column = self.columns[index] if 0 <= index < len(self.columns) else 'issue_date'
+        if column == 'counterparty':
+            column = f'{self.counterparty_field}__name'
+        prefix = '' if params.get('order[0][dir]') == 'asc' else '-'
+        # L'id come secondo criterio rende stabile la paginazione
+        return [f'{prefix}{column}', f'{prefix}id']
+
+    def get_int(self, value, default):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def serialize(self, invoice):
+        return {
+            'id': invoice.id,
+            'invoice_number': invoice.invoice_number,
+            'issue_date': invoice.issue_date.strftime('%d/%m/%Y') if invoice.issue_date else '',
+            'counterparty': str(getattr(invoice, self.counterparty_field)),
+            'total_amount': str(invoice.total_amount),
+            'currency': invoice.currency,
+            'payment_status': invoice.payment_status,
+            'detail_url': reverse(self.detail_url_name, args=[invoice.id]),
+        }
+
+
+class SupplierInvoiceDataView(InvoiceDataTableView):
+    own_company_field = 'receiver'
+    counterparty_field = 'issuer'
+    detail_url_name = 'billing:supplier_invoice_detail'
+    list_name = SUPPLIER_LIST
+
+
+class CustomerInvoiceDataView(InvoiceDataTableView):
+    own_company_field = 'issuer'
+    counterparty_field = 'receiver'
+    detail_url_name = 'billing:customer_invoice_detail'
+    list_name = CUSTOMER_LIST
@@ -0,0 +1,195 @@
+# billing/views/export.py
+import csv
+import datetime
+import mimetypes
+import os
+import tempfile
+from decimal import Decimal
+from django.conf import settings
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views import View
+from billing.models.base import Invoice, InvoiceLine
+from billing.services.invoice_filters import filter_invoices
+from billing.services.own_company import get_own_company
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# Righe lette dal database per ogni blocco dell'iteratore
+EXPORT_CHUNK_SIZE = getattr(settings, 'BILLING_EXPORT_CHUNK_SIZE', 2000)
+
+PAYMENT_STATUS_LABELS = {code: str(label) for code, label in Invoice.PAYMENT_STATUS}
+INVOICE_TYPE_LABELS = {code: str(label) for code, label in Invoice.INVOICE_TYPES}
+
+
+class Echo:
+    """Pseudo-buffer per csv.writer: restituisce la riga invece di scriverla"""
+
+    def write(self, value):
+        return value
+
+
+class InvoiceExportView(View):
+    """
+    Esportazione CSV/XLSX delle fatture filtrate come nella lista.
+
+    Il CSV viene generato riga per riga con StreamingHttpResponse leggendo il
+    database a blocchi (``iterator(chunk_size=...)``) e solo le colonne
+    necessarie (``values_list``), quindi la memoria usata non dipende dal
+    numero di righe esportate. L'XLSX, disponibile se è installato openpyxl,
+    viene scritto in modalità write_only su un file temporaneo.
+    """
+    own_company_field = None
+    counterparty_field = None
+    filename_prefix = None
+
+    def get(self, request, *args, **kwargs):
+        own_company = get_own_company()
+        invoices = Invoice.objects.filter(**{self.own_company_field: own_company})
+        invoices = filter_invoices(invoices, request.GET, self.counterparty_field)[0]
+
+        rows = self.get_rows(invoices)
+        filename = f"{self.filename_prefix}_{datetime.date.today():%d_%m_%Y}"
+        if request.GET.get('format') == 'xlsx' and Workbook is not None:
+            return self.xlsx_response(rows, filename)
+        return self.csv_response(rows, filename)
+
+    def get_headers(self):
+        return [
+            'Numero', 'Data', 'Tipo', 'Controparte', 'Partita IVA controparte',
+            'Imponibile', 'IVA', 'Totale', 'Valuta', 'Stato pagamento',
+        ]
+
+    def get_rows(self, invoices):
+        values = invoices.order_by('issue_date', 'id').values_list(
+            'invoice_number', 'issue_date', 'invoice_type',
+            f'{self.counterparty_field}__name', f'{self.counterparty_field}__vat_number',
+            'taxable_amount', 'vat_amount', 'total_amount', 'currency', 'payment_status'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        for number, issue_date, invoice_type, name, vat_number, taxable, vat, total, currency, status in values:
+            yield [
+                number, issue_date, INVOICE_TYPE_LABELS.get(invoice_type, invoice_type), name, vat_number,
+                taxable, vat, total, currency, PAYMENT_STATUS_LABELS.get(status, status),
+            ]
+
+    def csv_response(self, rows, filename):
+        writer = csv.writer(Echo(), delimiter=';')
+
+        def content():
+            # BOM e separatore ';' per l'apertura diretta in Excel in italiano
+            yield '\ufeff' + writer.writerow(self.get_headers())
+            for row in rows:
+                yield writer.writerow([self.format_csv_value(value) for value in row])
+
+        response = StreamingHttpResponse(content(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+
+    def format_csv_value(self, value):
+        if isinstance(value, Decimal):
+            return str(value).replace('.', ',')
+        if isinstance(value, datetime.date):
+            return value.strftime('%d/%m/%Y')
+        return value
+
+    def xlsx_response(self, rows, filename):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(self.get_headers())
+        for row in rows:
+            sheet.append(row)
+
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"{filename}.xlsx",
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+
+class InvoiceLineExportView(InvoiceExportView):
+    """
+    Esportazione delle righe delle fatture filtrate come nella lista.
+    """
+
+    def get_headers(self):
+        return [
+            'Numero fattura', 'Data', 'Controparte', 'Riga', 'Prodotto', 'Codice fornitore',
+            'Descrizione', 'Quantità', 'Unità di misura', 'Prezzo unitario', 'Aliquota IVA',
+            'Sconto %', 'Totale riga',
+        ]
+
+    def get_rows(self, invoices):
+        values = InvoiceLine.objects.filter(invoice__in=invoices.values('id')).order_by(
+            'invoice__issue_date', 'invoice_id', 'line_number'
+        ).values_list(
+            'invoice__invoice_number', 'invoice__issue_date', f'invoice__{self.counterparty_field}__name',
+            'line_number', 'product__name', 'external_product_code', 'description',
+            'quantity', 'unit_of_measure', 'unit_price', 'vat_rate', 'discount__percentage', 'line_total'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        for row in values:
+            yield list(row)
+
+
+class InvoiceXMLDownloadView(View):
+    """
+    Download del file originale della fattura.
+
+    Il file viene letto dallo storage decompresso a blocchi e inviato in
+    streaming, con la dimensione originale in Content-Length e il nome con
+    cui era stato caricato.
+    """
+    chunk_size = 64 * 1024
+
+    def get(self, request, invoice_id, *args, **kwargs):
+        invoice = get_object_or_404(Invoice.objects.only('id', 'file_xml', 'original_filename'), id=invoice_id)
+        if not invoice.file_xml:
+            raise Http404('Nessun file associato alla fattura')
+        try:
+            stored = invoice.file_xml.open('rb')
+        except FileNotFoundError:
+            raise Http404('File della fattura non trovato')
+
+        filename = invoice.original_filename or os.path.basename(invoice.file_xml.name)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        def content():
+            with stored:
+                yield from iter(lambda: stored.read(self.chunk_size), b'')
+
+        response = StreamingHttpResponse(content(), content_type=content_type)
+        response['Content-Length'] = stored.size
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class SupplierInvoiceExportView(InvoiceExportView):
+    own_company_field = 'receiver'
+    counterparty_field = 'issuer'
+    filename_prefix = 'fatture_fornitori'
+
+
+class CustomerInvoiceExportView(InvoiceExportView):
+    own_company_field = 'issuer'
+    counterparty_field = 'receiver'
+    filename_prefix = 'fatture_clienti'
+
+
+class SupplierInvoiceLineExportView(InvoiceLineExportView):
+    own_company_field = 'receiver'
+    counterparty_field = 'issuer'
+    filename_prefix = 'righe_fatture_fornitori'
+
+
+class CustomerInvoiceLineExportView(InvoiceLineExportView):
+    own_company_field = 'issuer'
+    counterparty_field = 'receiver'
+    filename_prefix = 'righe_fatture_clienti'
@@ -5,8 +5,17 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.contrib import messages
+from django.conf import settings
+from django.db import DatabaseError
 from billing.forms import InvoiceUploadForm
+from billing.services.instrumentation import ImportMetrics
 from billing.services.invoice_parser import InvoiceParser
+from billing.services.invoice_sources import is_invoice_name
+from billing.services.job_queue import batch_status, enqueue
+import uuid
+
+# Con True la risposta del caricamento AJAX include tempi e query per fase
+IMPORT_DEBUG = getattr(settings, 'BILLING_IMPORT_DEBUG', settings.DEBUG)
 
 class InvoiceUploadView(View):
     template_name = 'billing/invoice_upload.html'
@@ -33,19 +42,75 @@ class InvoiceUploadAjaxView(View):
         
         xml_file = request.FILES['file']
         
-        # Verifica se è un file XML (controllo di base)
-        if not xml_file.name.lower().endswith('.xml'):
+        # Verifica se è un file XML, anche firmato (controllo di base)
+        if not is_invoice_name(xml_file.name):
             return JsonResponse({
                 'status': 'error', 
-                'message': 'Il file deve essere in formato XML'
+                'message': 'Il file deve essere in formato XML o XML.P7M'
             }, status=400)
         
-        # Elabora il file
-        parser = InvoiceParser()
-        invoice, status, message = parser.parse_and_save(xml_file)
-        
-        return JsonResponse({
+        # Elabora il file (righe e magazzino scritti in blocco)
+        metrics = ImportMetrics()
+        parser = InvoiceParser(bulk=True, metrics=metrics)
+        with metrics.track():
+            try:
+                invoice, status, message = parser.parse_and_save(xml_file)
+            except DatabaseError as e:
+                # Errore temporaneo: il file può essere caricato di nuovo
+                invoice, status, message = None, 'error', f'Database non disponibile, riprovare più tardi: {e}'
+
+        response = {
             'filename': xml_file.name,
             'status': status,
             'message': message
-        })
\ No newline at end of file
+        }
+        # Tempi e query per fase: nella risposta in debug, altrimenti nei log
+        if IMPORT_DEBUG:
+            response['metrics'] = metrics.summary()
+        else:
+            metrics.log(filename=xml_file.name, status=status)
+        return JsonResponse(response)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class InvoiceUploadQueueView(View):
+    """
+    View per il caricamento asincrono: salva il file, lo mette in coda per il
+    worker (comando run_import_worker) e risponde subito con l'id del job
+    """
+    def post(self, request):
+        if 'file' not in request.FILES:
+            return JsonResponse({'status': 'error', 'message': 'Nessun file ricevuto'}, status=400)
+        
+        xml_file = request.FILES['file']
+        
+        # Verifica se è un file XML, anche firmato (controllo di base)
+        if not is_invoice_name(xml_file.name):
+            return JsonResponse({
+                'filename': xml_file.name,
+                'status': 'error', 
+                'message': 'Il file deve essere in formato XML o XML.P7M'
+            }, status=400)
+
+        try:
+            batch_id = uuid.UUID(request.POST['batch_id']) if request.POST.get('batch_id') else None
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Lotto non valido'}, status=400)
+
+        job = enqueue(xml_file, batch_id)
+        
+        return JsonResponse({
+            'job_id': job.id,
+            'batch_id': str(job.batch_id),
+            'filename': job.filename,
+            'status': 'pending',
+            'message': 'File in coda per l\'elaborazione'
+        })
+
+
+class ImportBatchStatusView(View):
+    """
+    Stato di avanzamento di un lotto di importazione, interrogato
+    periodicamente dalla pagina di caricamento
+    """
+    def get(self, request, batch_id):
+        return JsonResponse(batch_status(batch_id))
@@ -0,0 +1,46 @@
+# billing/views/payments.py
+from django.http import JsonResponse
+from django.views import View
+from billing.services.invoice_filters import parse_date
+from billing.services.payment_reports import PERIODS, ageing_report, cash_flow_forecast
+
+
+class PaymentAgeingView(View):
+    """
+    Scadenzario JSON delle rate aperte per controparte, con le fasce di
+    scaduto 0-30, 31-60, 61-90 e oltre 90 giorni.
+
+    Parametri: ``type`` (OUT crediti verso clienti, IN debiti verso
+    fornitori; default OUT), ``as_of`` (data di riferimento, default oggi) e
+    ``company`` (id della controparte).
+    """
+
+    def get(self, request, *args, **kwargs):
+        invoice_type = request.GET.get('type', 'OUT')
+        if invoice_type not in ('IN', 'OUT'):
+            return JsonResponse({'status': 'error', 'message': 'Tipo non valido: usare IN o OUT'}, status=400)
+        as_of = parse_date(request.GET.get('as_of'))
+        company = request.GET.get('company')
+
+        rows = ageing_report(invoice_type, as_of, int(company) if company and company.isdigit() else None)
+        return JsonResponse({'type': invoice_type, 'as_of': as_of, 'data': rows})
+
+
+class CashFlowForecastView(View):
+    """
+    Previsione di cassa JSON sulle rate aperte, per mese o settimana.
+
+    Parametri: ``date_from``, ``date_to`` e ``period`` (month o week).
+    """
+
+    def get(self, request, *args, **kwargs):
+        period = request.GET.get('period', 'month')
+        if period not in PERIODS:
+            return JsonResponse({'status': 'error', 'message': 'Periodo non valido: usare month o week'}, status=400)
+
+        forecast = cash_flow_forecast(
+            parse_date(request.GET.get('date_from')),
+            parse_date(request.GET.get('date_to')),
+            period
+        )
+        return JsonResponse(dict(forecast, period=period))